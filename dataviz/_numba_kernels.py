@@ -0,0 +1,50 @@
+"""Numba kernels shared by the vectorization tools (tif2vectors2.py).
+
+Every kernel has explicit signatures and cache=True, so it is compiled when this module is first imported
+and later runs load the machine code from __pycache__ instead of recompiling. Importing this module raises
+ImportError when Numba isn't installed; callers fall back to their NumPy code paths.
+"""
+import numpy as np
+from numba import njit, prange
+
+# Source pixel types the threshold kernel is compiled for; other band types use the NumPy path.
+THRESHOLD_DTYPES = (np.uint8, np.uint16, np.int16, np.float32)
+
+@njit(['i8(u1[::1], i8, u1[::1])',
+       'i8(u2[::1], i8, u1[::1])',
+       'i8(i2[::1], i8, u1[::1])',
+       'i8(f4[::1], i8, u1[::1])'],
+      parallel=True, fastmath=True, cache=True)
+def threshold_and_count(src, threshold, dst):
+    """Writes 1/0 into flat uint8 `dst` for src >= threshold and returns the number of 1s, in a single pass."""
+    total = 0
+    for i in prange(src.size):
+        v = 1 if src[i] >= threshold else 0
+        dst[i] = v
+        total += v
+    return total
+
+@njit('f8[:, ::1](f8[:, ::1], i8)', fastmath=True, cache=True)
+def chaikin_ring(points, iterations):
+    """Chaikin corner cutting on a C-contiguous float64 (n, dims) closed ring; returns a new closed ring.
+
+    Each segment P_i -> P_i+1 becomes 0.75*P_i + 0.25*P_i+1 and 0.25*P_i + 0.75*P_i+1, the result is closed
+    by repeating its first point, and smoothing stops once a ring has fewer than 4 points.
+    """
+    current = points
+    for _ in range(iterations):
+        n = current.shape[0]
+        if n < 4:
+            break
+        dims = current.shape[1]
+        smoothed = np.empty((2 * (n - 1) + 1, dims))
+        for i in range(n - 1):
+            for d in range(dims):
+                a = current[i, d]
+                b = current[i + 1, d]
+                smoothed[2 * i, d] = 0.75 * a + 0.25 * b
+                smoothed[2 * i + 1, d] = 0.25 * a + 0.75 * b
+        for d in range(dims):
+            smoothed[2 * (n - 1), d] = smoothed[0, d] # Close the new ring
+        current = smoothed
+    return current
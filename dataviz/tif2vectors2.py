@@ -1,16 +1,60 @@
 import os
 import sys
 import time
+import struct
 import numpy as np
 from osgeo import gdal, ogr, osr
+
+# Optional: gdal_array to wrap NumPy buffers as GDAL rasters without copying
+try:
+    from osgeo import gdal_array
+except ImportError:
+    gdal_array = None
+
 import threading
 import queue # For thread-safe communication with GUI
 import traceback
+import shutil
+import tempfile
+import webbrowser
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from collections import namedtuple
+from xml.sax.saxutils import escape as xml_escape
 
 # --- Tkinter Imports ---
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox, scrolledtext
 
+# Optional: shapely 2.x for vectorized geometry predicates on Arrow batches, and the precompiled Numba kernels
+# (_numba_kernels.py next to this script) for thresholding and smoothing. Both are imported by
+# _load_optional_accelerators() when processing starts, so opening the GUI doesn't pay for them.
+shapely = None
+THRESHOLD_DTYPES = ()
+_threshold_and_count = None
+_chaikin_ring_kernel = None
+_accelerators_loaded = False
+# threshold_and_count is a parallel Numba kernel, and Numba's default 'workqueue' threading layer (no TBB/OpenMP)
+# aborts the process when two threads launch parallel kernels at once; the two band threads take turns instead.
+_THRESHOLD_KERNEL_LOCK = threading.Lock()
+
+def _load_optional_accelerators():
+    """Imports shapely 2.x and the Numba kernels once per process; anything missing keeps its fallback (None)."""
+    global shapely, THRESHOLD_DTYPES, _threshold_and_count, _chaikin_ring_kernel, _accelerators_loaded
+    if _accelerators_loaded:
+        return
+    _accelerators_loaded = True
+    try:
+        import shapely as _shapely
+        if hasattr(_shapely, 'from_wkb'): # shapely 1.x has no vectorized API
+            shapely = _shapely
+    except ImportError:
+        pass
+    try:
+        from _numba_kernels import THRESHOLD_DTYPES, threshold_and_count as _threshold_and_count, chaikin_ring as _chaikin_ring_kernel
+    except ImportError:
+        pass
+
 # --- Configuration (Defaults for GUI) ---
 DEFAULT_OUTPUT_NAME = "vectorized_merged_output.gpkg" # Updated default name
 DEFAULT_CONFIDENCE_THRESHOLD_BUILDING = 40.0
@@ -20,11 +64,35 @@ DEFAULT_SIMPLIFY_BUILDING = 1.0
 DEFAULT_MIN_AREA_ROAD = 20.0
 DEFAULT_SIMPLIFY_ROAD = 1.5
 DEFAULT_CHAIKIN_ITERATIONS_ROAD = 0
+ARROW_BATCH_SIZE = 65536 # Features per Arrow record batch for columnar filter passes
+_WKB_BUF = bytearray(1 << 20) # Scratch buffer reused when packing smoothed polygons into WKB
+WKB_SPOOL_MAX_MEMORY = 256 << 20 # Bytes of kept-feature WKB held in RAM before spilling to a temp file
+LOG_MAX_LINES = 2000 # Lines kept in the GUI log widget; older lines are dropped from the top
 
 # --- GDAL/OGR Setup ---
 gdal.UseExceptions()
 ogr.UseExceptions()
 
+# I/O tuning for large rasters/GeoPackages. Values already set in the environment win.
+GDAL_TUNING_OPTIONS = {
+    'GDAL_CACHEMAX': '2048',                    # MB of raster block cache
+    'GDAL_DISABLE_READDIR_ON_OPEN': 'EMPTY_DIR', # Don't list sibling files on every open
+    'OGR_SQLITE_CACHE': '1024',                 # MB of SQLite page cache for GPKG
+    'GDAL_NUM_THREADS': 'ALL_CPUS',
+}
+for _opt, _val in GDAL_TUNING_OPTIONS.items():
+    if gdal.GetConfigOption(_opt) is None:
+        gdal.SetConfigOption(_opt, _val)
+
+# SQLite settings for the scratch-like output GeoPackage: it is rebuilt from scratch on failure, so durability
+# per statement isn't needed.
+GPKG_WRITE_PRAGMAS = (
+    "PRAGMA synchronous=OFF",
+    "PRAGMA journal_mode=MEMORY",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-262144", # 256 MB
+)
+
 # --- Helper Functions for Processing ---
 def log_message(logger_queue, message):
     """Helper to put messages onto the GUI queue."""
@@ -38,6 +106,73 @@ def log_message(logger_queue, message):
     else:
         print(message)
 
+def flush_log(logger_queue):
+    """Pushes out any buffered log lines (no-op for plain queues). Call before long blocking work."""
+    flush = getattr(logger_queue, 'flush', None)
+    if flush:
+        flush()
+
+# Sentinels the GUI matches verbatim; these must never be merged into a batch.
+CONTROL_MESSAGES = ("PROCESS_COMPLETE_SUCCESS", "PROCESS_COMPLETE_FAILURE")
+
+class BatchedLogger:
+    """Queue-like wrapper that sends log lines to the GUI queue in batches.
+
+    Each thread appends to its own list, so individual lines never touch the queue
+    lock; a buffer is joined and put as one message once it holds `flush_size` lines
+    or `flush_interval` seconds have passed. Use as a context manager so whatever is
+    left gets flushed when processing ends.
+    """
+    def __init__(self, target_queue, flush_size=64, flush_interval=0.25):
+        self.target_queue = target_queue
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self._local = threading.local()
+        self._buffers = []
+        self._buffers_lock = threading.Lock()
+
+    def _buffer(self):
+        buf = getattr(self._local, 'buf', None)
+        if buf is None:
+            buf = self._local.buf = []
+            self._local.last_flush = time.monotonic()
+            with self._buffers_lock:
+                self._buffers.append(buf)
+        return buf
+
+    def put(self, message):
+        if message in CONTROL_MESSAGES:
+            self.flush_all()
+            self.target_queue.put(message)
+            return
+        buf = self._buffer()
+        buf.append(message)
+        if len(buf) >= self.flush_size or time.monotonic() - self._local.last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        """Flushes the calling thread's buffer."""
+        buf = self._buffer()
+        if buf:
+            self.target_queue.put("\n".join(buf))
+            buf.clear()
+        self._local.last_flush = time.monotonic()
+
+    def flush_all(self):
+        """Flushes every thread's buffer. Only call once worker threads are idle."""
+        with self._buffers_lock:
+            for buf in self._buffers:
+                if buf:
+                    self.target_queue.put("\n".join(buf))
+                    buf.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.flush_all()
+        return False
+
 def get_raster_info(raster_ds, logger_queue=None):
     """Extracts key information from a GDAL Raster DataSource."""
     if not raster_ds:
@@ -92,16 +227,240 @@ def get_raster_info(raster_ds, logger_queue=None):
 
     return info
 
+def _execute_layer_sql(layer, sql, logger_queue=None, quiet=False):
+    """Runs a statement on the datasource owning `layer` with the SQLite dialect. Returns True on success.
+
+    With quiet=True a failure is not logged, for optional variants that have a plainer statement to fall back on.
+    """
+    try:
+        ds = layer.GetDataset()
+        result = ds.ExecuteSQL(sql, dialect='SQLITE')
+        if result is not None:
+            ds.ReleaseResultSet(result)
+        layer.ResetReading()
+        return True
+    except Exception as e:
+        if not quiet:
+            log_message(logger_queue, f"      SQL fast path unavailable ({e}). Falling back to per-feature processing.")
+        return False
+
+def apply_gpkg_pragmas(ds, logger_queue=None):
+    """Applies GPKG_WRITE_PRAGMAS to an open GeoPackage datasource. Failures are logged and ignored."""
+    for pragma in GPKG_WRITE_PRAGMAS:
+        try:
+            result = ds.ExecuteSQL(pragma)
+            if result is not None:
+                ds.ReleaseResultSet(result)
+        except Exception as e:
+            log_message(logger_queue, f"  Warning: Could not apply '{pragma}': {e}")
+
+def _layer_driver_name(layer):
+    """Returns the short name of the driver behind `layer` (e.g. 'GPKG'), or None if it can't be determined."""
+    try:
+        return layer.GetDataset().GetDriver().GetDescription()
+    except Exception:
+        return None
+
+def _delete_fids_sql(layer, layer_name, fids, logger_queue=None, batch_size=500):
+    """Deletes `fids` from a SQLite-backed layer with batched `DELETE ... WHERE fid IN (...)` in one transaction. Returns True on success."""
+    fid_col = layer.GetFIDColumn() or 'fid'
+    layer.StartTransaction()
+    for start in range(0, len(fids), batch_size):
+        fid_list = ",".join(str(int(fid)) for fid in fids[start:start + batch_size])
+        if not _execute_layer_sql(layer, f'DELETE FROM "{layer_name}" WHERE "{fid_col}" IN ({fid_list})', logger_queue):
+            layer.RollbackTransaction()
+            return False
+    layer.CommitTransaction()
+    return True
+
+def _iter_geometry_batches(layer, columns=(), batch_size=ARROW_BATCH_SIZE):
+    """Yields dicts of NumPy arrays ('fid', 'wkb' and any requested attribute columns) covering the whole layer.
+
+    Uses the layer's Arrow stream when the GDAL build provides one, otherwise reads features one at a time.
+    Don't modify the layer until the generator is exhausted.
+    """
+    stream = None
+    if hasattr(layer, 'GetArrowStreamAsNumPy'):
+        try:
+            stream = layer.GetArrowStreamAsNumPy(options=[f'MAX_FEATURES_IN_BATCH={batch_size}'])
+        except Exception:
+            stream = None
+    try:
+        if stream is not None:
+            fid_key = layer.GetFIDColumn() or 'OGC_FID'
+            geom_key = layer.GetGeometryColumn() or 'wkb_geometry'
+            for batch in stream:
+                out = {'fid': batch[fid_key], 'wkb': batch[geom_key]}
+                for name in columns:
+                    out[name] = batch[name]
+                yield out
+            return
+
+        layer.ResetReading()
+        fids, wkbs, values = [], [], {name: [] for name in columns}
+        for feature in layer:
+            geom = feature.GetGeometryRef()
+            fids.append(feature.GetFID())
+            wkbs.append(bytes(geom.ExportToWkb(ogr.wkbNDR)) if geom else None)
+            for name in columns:
+                values[name].append(feature.GetField(name))
+            if len(fids) == batch_size:
+                yield dict({'fid': np.array(fids), 'wkb': np.array(wkbs, dtype=object)},
+                           **{name: np.array(col) for name, col in values.items()})
+                fids, wkbs, values = [], [], {name: [] for name in columns}
+        if fids:
+            yield dict({'fid': np.array(fids), 'wkb': np.array(wkbs, dtype=object)},
+                       **{name: np.array(col) for name, col in values.items()})
+    finally:
+        stream = None
+        layer.ResetReading()
+
+def _batch_fids_to_drop(layer, drop_mask, columns=(), logger_queue=None):
+    """Scans the layer in batches and returns the FIDs where drop_mask(batch, geoms) is True.
+
+    `geoms` is the batch's geometry column decoded with shapely.from_wkb. Returns None when
+    shapely 2.x is missing or the scan fails.
+    """
+    if shapely is None:
+        return None
+    fids_to_drop = []
+    try:
+        for batch in _iter_geometry_batches(layer, columns):
+            geoms = shapely.from_wkb(batch['wkb'])
+            fids_to_drop.extend(batch['fid'][drop_mask(batch, geoms)].tolist())
+    except Exception as e:
+        log_message(logger_queue, f"      Batch path unavailable ({e}). Falling back to per-feature processing.")
+        return None
+    return fids_to_drop
+
+def _apply_layer_edits(layer, layer_name, updates=(), deletes=(), logger_queue=None):
+    """Applies (fid, wkb) geometry updates and FID deletions in a single transaction. Returns True on success."""
+    if not updates and not deletes:
+        return True
+    try:
+        layer.StartTransaction()
+        for fid, wkb in updates:
+            feature = layer.GetFeature(int(fid))
+            feature.SetGeometryDirectly(ogr.CreateGeometryFromWkb(wkb))
+            layer.SetFeature(feature)
+        for fid in deletes:
+            layer.DeleteFeature(int(fid))
+        layer.CommitTransaction()
+    except Exception as e:
+        layer.RollbackTransaction()
+        log_message(logger_queue, f"        Error writing edits to '{layer_name}': {e}")
+        return False
+    return True
+
+# Column-oriented (SoA) feature data for bulk rewrites: a list of WKB bytes plus one NumPy array per field
+# index (`columns`) and matching boolean arrays flagging NULL values (`nulls`).
+FeatureColumns = namedtuple('FeatureColumns', ['geoms_wkb', 'columns', 'nulls'])
+
+# NumPy dtypes for OGR field types; anything else is kept in an object array.
+_OGR_FIELD_DTYPES = {ogr.OFTInteger: np.int32, ogr.OFTInteger64: np.int64, ogr.OFTReal: np.float64}
+
+# Typed field readers (by index) that skip GetField()'s per-call type dispatch; other types use GetField.
+_FIELD_GETTERS = {
+    ogr.OFTInteger: ogr.Feature.GetFieldAsInteger,
+    ogr.OFTInteger64: ogr.Feature.GetFieldAsInteger64,
+    ogr.OFTReal: ogr.Feature.GetFieldAsDouble,
+    ogr.OFTString: ogr.Feature.GetFieldAsString,
+}
+
+def _field_schema(layer_defn):
+    """Returns [(field_index, getter)] for layer_defn, resolved once per layer rather than per feature."""
+    return [(i, _FIELD_GETTERS.get(layer_defn.GetFieldDefn(i).GetType(), ogr.Feature.GetField))
+            for i in range(layer_defn.GetFieldCount())]
+
+class WkbSpool:
+    """Append-only sequence of WKB geometries stored as length-prefixed records in a SpooledTemporaryFile.
+
+    Records stay in memory up to `max_memory` bytes and then spill to disk, so rewriting a huge layer doesn't
+    hold every geometry in RAM. Iterating yields the records back in insertion order as bytes.
+    """
+    def __init__(self, max_memory=WKB_SPOOL_MAX_MEMORY):
+        self._file = tempfile.SpooledTemporaryFile(max_size=max_memory)
+        self._count = 0
+
+    def append(self, wkb):
+        self._file.write(struct.pack('<I', len(wkb)))
+        self._file.write(wkb)
+        self._count += 1
+
+    def __len__(self):
+        return self._count
+
+    def __iter__(self):
+        spool = self._file
+        spool.seek(0)
+        for _ in range(self._count):
+            size = struct.unpack('<I', spool.read(4))[0]
+            yield spool.read(size)
+        spool.seek(0, os.SEEK_END)
+
+    def close(self):
+        self._file.close()
+
+def _fast_feature_count(layer):
+    """Returns the layer's feature count if the driver reports it cheaply (OLCFastFeatureCount), else -1 instead of scanning."""
+    if layer.TestCapability(ogr.OLCFastFeatureCount):
+        return layer.GetFeatureCount()
+    return -1
+
+def _empty_feature_columns(layer_defn, size, geoms_wkb=None):
+    """Preallocates a FeatureColumns record with room for `size` features of layer_defn's schema.
+
+    `geoms_wkb` is the geometry container to fill (a list by default, or a WkbSpool).
+    """
+    columns, nulls = [], []
+    for i in range(layer_defn.GetFieldCount()):
+        dtype = _OGR_FIELD_DTYPES.get(layer_defn.GetFieldDefn(i).GetType(), object)
+        columns.append(np.zeros(size, dtype=dtype))
+        nulls.append(np.zeros(size, dtype=bool))
+    return FeatureColumns([] if geoms_wkb is None else geoms_wkb, columns, nulls)
+
+def _grow_feature_columns(feature_columns, size):
+    """Returns a copy of `feature_columns` whose field arrays hold `size` rows (existing rows kept, new ones zero/not NULL)."""
+    columns = [np.concatenate([col, np.zeros(size - len(col), dtype=col.dtype)]) for col in feature_columns.columns]
+    nulls = [np.concatenate([mask, np.zeros(size - len(mask), dtype=bool)]) for mask in feature_columns.nulls]
+    return FeatureColumns(feature_columns.geoms_wkb, columns, nulls)
+
+def _create_features_from_columns(layer, layer_defn, feature_columns, logger_queue=None):
+    """Creates one feature per WKB in `feature_columns`; returns the number created. Runs inside the caller's transaction."""
+    columns = [col.tolist() for col in feature_columns.columns] # Plain Python scalars for SetField
+    nulls = feature_columns.nulls
+    added_count = 0
+    new_feature = ogr.Feature(layer_defn) # Reused for every row; each field is overwritten per row
+    for k, wkb in enumerate(feature_columns.geoms_wkb):
+        new_feature.SetFID(ogr.NullFID) # CreateFeature() stores the previous row's FID on the feature
+        # SetGeometryDirectly hands the freshly built geometry to the feature instead of cloning it
+        if new_feature.SetGeometryDirectly(ogr.CreateGeometryFromWkb(wkb)) != ogr.OGRERR_NONE:
+            log_message(logger_queue, f"        Warning: Failed to set geometry during repopulation for feature {k}. Skipping.")
+            continue
+        for i, values in enumerate(columns):
+            if nulls[i][k]:
+                new_feature.SetFieldNull(i)
+            else:
+                new_feature.SetField(i, values[k])
+        if layer.CreateFeature(new_feature) == ogr.OGRERR_NONE:
+            added_count += 1
+        else:
+            log_message(logger_queue, f"        Warning: Failed to create feature {k} during repopulation.")
+    return added_count
+
 def clear_and_repopulate_layer(layer, features_data, layer_name, action_desc="updating", logger_queue=None):
+    """Replaces every feature in `layer` with `features_data`, either a list of {'geom', 'attributes'} dicts or a FeatureColumns record."""
     layer_defn = layer.GetLayerDefn()
     original_count = layer.GetFeatureCount()
-    kept_count = len(features_data)
+    columnar = isinstance(features_data, FeatureColumns)
+    kept_count = len(features_data.geoms_wkb) if columnar else len(features_data)
 
     if kept_count == 0 and original_count == 0:
         log_message(logger_queue, f"      Skipping rewrite for {action_desc}: layer '{layer_name}' is already empty.")
         return True
 
     log_message(logger_queue, f"      Repopulating layer '{layer_name}' for {action_desc}: Clearing {original_count} features, adding {kept_count} back...")
+    flush_log(logger_queue)
 
     deleted_count = 0
     try: 
@@ -123,35 +482,38 @@ def clear_and_repopulate_layer(layer, features_data, layer_name, action_desc="up
 
     added_count = 0
     try: 
-        for data in features_data:
-            geom = data.get('geom')
-            attrs = data.get('attributes', {})
-
-            if geom is None or geom.IsEmpty():
-                continue
-
-            new_feature = ogr.Feature(layer_defn)
-            geom_clone = geom.Clone()
-            if new_feature.SetGeometry(geom_clone) != ogr.OGRERR_NONE:
-                log_message(logger_queue, f"        Warning: Failed to set geometry during repopulation for feature with attrs: {attrs}. Skipping.")
-                if new_feature: new_feature.Destroy()
-                continue 
-
-            for name, value in attrs.items():
-                field_index = layer_defn.GetFieldIndex(name)
-                if field_index >= 0:
-                    try:
-                        new_feature.SetField(name, value)
-                    except Exception as set_field_e:
-                        log_message(logger_queue, f"        Warning: Failed to set field '{name}' to '{value}' (type: {type(value)}): {set_field_e}")
+        if columnar:
+            added_count = _create_features_from_columns(layer, layer_defn, features_data, logger_queue)
+        else:
+            for data in features_data:
+                geom = data.get('geom')
+                attrs = data.get('attributes', {})
+
+                if geom is None or geom.IsEmpty():
+                    continue
+
+                new_feature = ogr.Feature(layer_defn)
+                geom_clone = geom.Clone()
+                if new_feature.SetGeometry(geom_clone) != ogr.OGRERR_NONE:
+                    log_message(logger_queue, f"        Warning: Failed to set geometry during repopulation for feature with attrs: {attrs}. Skipping.")
+                    if new_feature: new_feature.Destroy()
+                    continue 
+
+                for name, value in attrs.items():
+                    field_index = layer_defn.GetFieldIndex(name)
+                    if field_index >= 0:
+                        try:
+                            new_feature.SetField(name, value)
+                        except Exception as set_field_e:
+                            log_message(logger_queue, f"        Warning: Failed to set field '{name}' to '{value}' (type: {type(value)}): {set_field_e}")
             
-            if layer.CreateFeature(new_feature) == ogr.OGRERR_NONE:
-                added_count += 1
-            else:
-                log_message(logger_queue, f"        Warning: Failed to create feature during repopulation for feature with attrs: {attrs}.")
+                if layer.CreateFeature(new_feature) == ogr.OGRERR_NONE:
+                    added_count += 1
+                else:
+                    log_message(logger_queue, f"        Warning: Failed to create feature during repopulation for feature with attrs: {attrs}.")
             
-            if new_feature:
-                new_feature.Destroy()
+                if new_feature:
+                    new_feature.Destroy()
         
         layer.CommitTransaction() 
 
@@ -171,183 +533,291 @@ def clear_and_repopulate_layer(layer, features_data, layer_name, action_desc="up
     
     return True
 
-def simplify_layer(layer, tolerance, layer_name, logger_queue=None):
-    action_desc = "simplification"
-    start_time = time.time()
-    if tolerance <= 0.0:
-        log_message(logger_queue, f"    Skipping {action_desc} for '{layer_name}' (tolerance={tolerance}).")
-        return True
+def _polygon_ring_arrays(polygon):
+    """Returns the rings of an OGR Polygon as (n, 2) or (n, 3) float64 arrays viewed straight from its WKB.
 
-    log_message(logger_queue, f"    Applying {action_desc} to layer '{layer_name}' (tolerance {tolerance} map units)...")
-    feature_count = layer.GetFeatureCount()
-    if feature_count == 0:
-        log_message(logger_queue, f"    Layer '{layer_name}' is empty, skipping {action_desc}.")
-        return True
+    No per-vertex Python tuples are created. Returns None for layouts this doesn't handle (measured geometries).
+    """
+    if polygon.IsMeasured():
+        return None
+    dim = 3 if polygon.Is3D() else 2
+    wkb = polygon.ExportToWkb(ogr.wkbNDR)
+    # Polygon WKB: byte order (1) + type (4) + ring count (4), then per ring: point count (4) + coordinates
+    num_rings = struct.unpack_from('<I', wkb, 5)[0]
+    offset = 9
+    rings = []
+    for _ in range(num_rings):
+        num_points = struct.unpack_from('<I', wkb, offset)[0]
+        offset += 4
+        rings.append(np.frombuffer(wkb, dtype='<f8', count=num_points * dim, offset=offset).reshape(num_points, dim))
+        offset += num_points * dim * 8
+    return rings
+
+def _chaikin_ring_array(points, iterations):
+    """Chaikin corner cutting on a closed ring given as an (n, 2) or (n, 3) array; returns a new closed ring array.
+
+    Each segment P_i -> P_i+1 becomes R = 0.75*P_i + 0.25*P_i+1 and Q = 0.25*P_i + 0.75*P_i+1, and the
+    result is closed by repeating its first point.
+    """
+    current = np.ascontiguousarray(points, dtype=np.float64)
+    if _chaikin_ring_kernel is not None:
+        return _chaikin_ring_kernel(current, int(iterations))
+    for _ in range(iterations):
+        if current.shape[0] < 4:
+            break
+        p_i, p_next = current[:-1], current[1:]
+        smoothed = np.empty((2 * p_i.shape[0] + 1, current.shape[1]))
+        smoothed[0:-1:2] = 0.75 * p_i + 0.25 * p_next
+        smoothed[1:-1:2] = 0.25 * p_i + 0.75 * p_next
+        smoothed[-1] = smoothed[0] # Close the new ring
+        current = smoothed
+    return current
+
+
+def _polygon_wkb_from_rings(rings, has_z):
+    """Packs closed ring arrays into little-endian Polygon WKB and returns it as bytes.
+
+    The WKB is assembled in the shared _WKB_BUF scratch buffer (grown when a polygon doesn't fit), so building
+    a polygon costs one bytes copy instead of one OGR call per vertex. Not thread-safe.
+    """
+    global _WKB_BUF
+    dim = 3 if has_z else 2
+    total_size = 9 + sum(4 + len(ring) * dim * 8 for ring in rings)
+    if total_size > len(_WKB_BUF):
+        _WKB_BUF = bytearray(max(total_size, 2 * len(_WKB_BUF)))
+
+    with memoryview(_WKB_BUF) as buf:
+        struct.pack_into('<BII', buf, 0, 1, ogr.wkbPolygon25D if has_z else ogr.wkbPolygon, len(rings))
+        offset = 9
+        for ring in rings:
+            coords = np.ascontiguousarray(ring[:, :dim], dtype='<f8')
+            struct.pack_into('<I', buf, offset, coords.shape[0])
+            offset += 4
+            buf[offset:offset + coords.nbytes] = memoryview(coords).cast('B')
+            offset += coords.nbytes
+        return bytes(buf[:offset])
+
+def _smooth_geometry_chaikin(geom, iterations, fid, logger_queue=None):
+    """Returns a Chaikin-smoothed clone of a (Multi)Polygon; other geometries are cloned unchanged, None/empty gives None."""
+    processed_geom = None
+
+    if geom and not geom.IsEmpty():
+        geom_type = geom.GetGeometryType()
+        flat_geom_type = ogr.GT_Flatten(geom_type) 
+
+        if flat_geom_type == ogr.wkbPolygon or flat_geom_type == ogr.wkbMultiPolygon:
+            new_multi_poly = ogr.Geometry(ogr.wkbMultiPolygon)
+            # Intermediate rings/polygons carry no SRS; it is assigned once on the final geometry.
+            srs = geom.GetSpatialReference()
+
+            num_parts = geom.GetGeometryCount() if flat_geom_type == ogr.wkbMultiPolygon else 1
+
+            for k in range(num_parts):
+                part = geom.GetGeometryRef(k) if flat_geom_type == ogr.wkbMultiPolygon else geom
+                
+                if not part or part.IsEmpty() or ogr.GT_Flatten(part.GetGeometryType()) != ogr.wkbPolygon:
+                    continue
 
-    processed_features_data = []
-    layer_defn = layer.GetLayerDefn()
-    field_names = [layer_defn.GetFieldDefn(i).GetNameRef() for i in range(layer_defn.GetFieldCount())]
+                num_rings = part.GetGeometryCount()
+                ring_arrays = _polygon_ring_arrays(part)
+                part_has_z = bool(part.Is3D())
+                ring_coords = [] # Output rings as arrays; the polygon is built from them in one WKB pass
 
-    layer.ResetReading()
-    feature = layer.GetNextFeature()
-    processed_count = 0
-    log_message(logger_queue, f"      Simplifying {feature_count} features (updates every 5000)...")
+                for i in range(num_rings):
+                    ring = part.GetGeometryRef(i)
+                    if not ring or ring.IsEmpty() or ogr.GT_Flatten(ring.GetGeometryType()) != ogr.wkbLinearRing:
+                        continue
+                    
+                    if ring_arrays is not None:
+                        points = ring_arrays[i]
+                    else:
+                        points = np.asarray(ring.GetPoints(), dtype=np.float64)
+                    if len(points) < 4: 
+                        ring_coords.append(points) 
+                        continue
 
-    while feature:
-        geom = feature.GetGeometryRef()
-        attrs = {name: feature.GetField(name) for name in field_names}
-        simplified_geom = None
-        if geom:
-            try:
-                geom_clone = geom.Clone()
-                simplified = geom_clone.SimplifyPreserveTopology(tolerance)
-                if simplified and not simplified.IsEmpty():
-                    simplified_geom = simplified 
+                    try:
+                        has_z = points.shape[1] > 2
+                        # Smooth in 3D unconditionally; 2D rings get a zero z column that is dropped again on output
+                        points_xyz = points[:, :3] if has_z else np.column_stack((points, np.zeros(len(points))))
+                        # Ensure the ring is explicitly closed for Chaikin if the source doesn't guarantee it
+                        if not np.array_equal(points_xyz[0, :2], points_xyz[-1, :2]):
+                            points_xyz = np.vstack([points_xyz, points_xyz[:1]])
+
+                        smoothed_points = _chaikin_ring_array(points_xyz, iterations)
+
+                        # _chaikin_ring_array always returns a closed ring
+                        if len(smoothed_points) >= 4 and np.isfinite(smoothed_points).all():
+                            ring_coords.append(smoothed_points)
+                        else:
+                            log_message(logger_queue, f"        Warning: Chaikin resulted in invalid ring geom for FID {fid}, part {k}, ring {i}. Using original ring.")
+                            ring_coords.append(points)
+                    except Exception as e:
+                        log_message(logger_queue, f"\n        Error during Chaikin smoothing for FID {fid}, part {k}, ring {i}: {e}. Using original ring.")
+                        log_message(logger_queue, traceback.format_exc())
+                        ring_coords.append(points)
+
+                if not ring_coords:
+                    continue
+                try:
+                    new_poly = ogr.CreateGeometryFromWkb(_polygon_wkb_from_rings(ring_coords, part_has_z))
+                except Exception as e:
+                    log_message(logger_queue, f"        Warning: Could not build smoothed polygon part {k} for FID {fid}: {e}. Using original part.")
+                    new_poly = part.Clone()
+                
+                if not new_poly.IsEmpty():
+                    if new_poly.IsValid():
+                        err = new_multi_poly.AddGeometry(new_poly.Clone()) # Clone polygon before adding
+                        if err != ogr.OGRERR_NONE:
+                            log_message(logger_queue, f"        Warning: Failed to add smoothed polygon part {k} for FID {fid} to MultiPolygon. Error: {err}")
+                    else:
+                        log_message(logger_queue, f"        Warning: Polygon part {k} invalid after smoothing rings for FID {fid}. Skipping this part.")
+            
+            if not new_multi_poly.IsEmpty():
+                if not new_multi_poly.IsValid():
+                    log_message(logger_queue, f"        Warning: Final MultiPolygon for FID {fid} is invalid after smoothing. Attempting MakeValid.")
+                    repaired_multi = new_multi_poly.MakeValid()
+                    if repaired_multi and not repaired_multi.IsEmpty() and repaired_multi.IsValid():
+                        processed_geom = repaired_multi.Clone()
+                    else:
+                        log_message(logger_queue, f"          MakeValid failed for smoothed MultiPolygon FID {fid}. Keeping original.")
+                        processed_geom = geom.Clone() 
                 else:
-                    simplified_geom = geom.Clone() 
-            except Exception as e:
-                log_message(logger_queue, f"\n        Warning: SimplifyPreserveTopology failed for FID {feature.GetFID()}: {e}. Keeping original geometry.")
-                simplified_geom = geom.Clone() 
-        
-        processed_features_data.append({'geom': simplified_geom, 'attributes': attrs})
-        
-        processed_count += 1
-        if processed_count % 5000 == 0:
-            elapsed = time.time() - start_time
-            log_message(logger_queue, f"        Simplified {processed_count}/{feature_count} features in {elapsed:.1f}s...")
-
-        if feature: feature.Destroy()
-        feature = layer.GetNextFeature()
-
-    success = clear_and_repopulate_layer(layer, processed_features_data, layer_name, action_desc, logger_queue)
-    log_message(logger_queue, f"    Finished {action_desc} for '{layer_name}' in {time.time() - start_time:.2f}s.")
-    return success
-
-def filter_layer_by_min_area(layer, min_area, layer_name, logger_queue=None):
-    action_desc = "minimum area filter"
-    start_time = time.time()
-    if min_area <= 0.0:
-        log_message(logger_queue, f"    Skipping {action_desc} for '{layer_name}' (min_area={min_area}).")
-        return True
-
-    log_message(logger_queue, f"    Applying {action_desc} to layer '{layer_name}' (min_area {min_area} sq map units)...")
-    feature_count = layer.GetFeatureCount()
-    if feature_count == 0:
-        log_message(logger_queue, f"    Layer '{layer_name}' is empty, skipping {action_desc}.")
-        return True
+                    processed_geom = new_multi_poly
+                if srs and processed_geom.GetSpatialReference() is None:
+                    processed_geom.AssignSpatialReference(srs) # Shared reference, no clone
+            else: 
+                processed_geom = geom.Clone() 
+        else: 
+            processed_geom = geom.Clone()
+    else: 
+        processed_geom = None
+    return processed_geom
 
-    features_to_keep = []
-    layer_defn = layer.GetLayerDefn()
-    field_names = [layer_defn.GetFieldDefn(i).GetNameRef() for i in range(layer_defn.GetFieldCount())]
+def _fix_geometry(geom, fid, target_geom_type, logger_queue=None):
+    """Returns (geometry, status) for one feature. status is 'valid', 'repaired', 'failed' (invalid, dropped) or 'empty' (dropped).
 
-    layer.ResetReading()
-    feature = layer.GetNextFeature()
-    processed_count = 0
-    removed_count = 0
-    log_message(logger_queue, f"      Filtering {feature_count} features by area (updates every 5000)...")
+    Invalid geometries go through MakeValid(); polygon parts are pulled out of GeometryCollections when the target is (Multi)Polygon.
+    """
+    target_flat_geom_type = ogr.GT_Flatten(target_geom_type)
+    final_geom = None
+    status = 'failed' # Invalid and could not be repaired
 
-    while feature:
-        geom = feature.GetGeometryRef()
-        area = 0.0
-        keep = False
-        if geom and not geom.IsEmpty():
+    if geom and not geom.IsEmpty():
+        if geom.IsValid():
+            final_geom = geom.Clone()
+            status = 'valid'
+        else:
             try:
-                area = geom.Area()
-                if area >= min_area:
-                    keep = True
+                repaired_geom = geom.MakeValid()
+            except Exception as make_valid_err:
+                log_message(logger_queue, f"        Warning: MakeValid() crashed for FID {fid}: {make_valid_err}. Discarding feature.")
+                repaired_geom = None
+            
+            if repaired_geom and not repaired_geom.IsEmpty():
+                repaired_type = repaired_geom.GetGeometryType()
+                repaired_flat_type = ogr.GT_Flatten(repaired_type)
+
+                if repaired_flat_type == target_flat_geom_type:
+                    # MakeValid() returns a valid (or empty) geometry, so no second IsValid() pass is needed here.
+                    final_geom = repaired_geom
+                    status = 'repaired'
+                elif repaired_flat_type == ogr.wkbGeometryCollection and \
+                     (target_flat_geom_type == ogr.wkbPolygon or target_flat_geom_type == ogr.wkbMultiPolygon):
+                    collection_extract = ogr.Geometry(target_geom_type) 
+                    srs = geom.GetSpatialReference()
+                    if srs: collection_extract.AssignSpatialReference(srs.Clone())
+                    valid_parts_found = False
+                    for i in range(repaired_geom.GetGeometryCount()):
+                        part = repaired_geom.GetGeometryRef(i)
+                        if part and not part.IsEmpty() and ogr.GT_Flatten(part.GetGeometryType()) == ogr.wkbPolygon and part.IsValid():
+                            err = collection_extract.AddGeometry(part.Clone())
+                            if err == ogr.OGRERR_NONE:
+                                valid_parts_found = True
+                            else:
+                                log_message(logger_queue, f"        Warning: Failed to add valid polygon part from GeometryCollection for FID {fid}. Error: {err}")
+                    
+                    if valid_parts_found:
+                        if collection_extract.IsValid():
+                            final_geom = collection_extract.Clone() # Keep the extracted polygons (Clone before assigning)
+                            status = 'repaired'
+                            log_message(logger_queue, f"        Info: Repaired FID {fid} from GeometryCollection, extracted valid {ogr.GeometryTypeToName(target_geom_type)}.")
+                        else:
+                            log_message(logger_queue, f"        Warning: Extracted geometry from GeometryCollection for FID {fid} is invalid. Discarding feature.")
+                    else:
+                        log_message(logger_queue, f"        Warning: MakeValid() produced GeometryCollection for FID {fid}, but no valid {ogr.GeometryTypeToName(target_geom_type)} parts found. Discarding feature.")
                 else:
-                    removed_count += 1
-            except Exception as e:
-                log_message(logger_queue, f"\n        Warning: Could not calculate area for FID {feature.GetFID()}: {e}. Feature will be removed by filter.")
-                keep = False
-                removed_count += 1
-        else:
-            removed_count +=1 
-
-        if keep:
-            attrs = {name: feature.GetField(name) for name in field_names}
-            features_to_keep.append({'geom': geom.Clone() if geom else None, 'attributes': attrs})
-        
-        processed_count += 1
-        if processed_count % 5000 == 0:
-            elapsed = time.time() - start_time
-            log_message(logger_queue, f"        Area filter checked {processed_count}/{feature_count} features in {elapsed:.1f}s...")
-
-        if feature: feature.Destroy()
-        feature = layer.GetNextFeature()
-
-    log_message(logger_queue, f"      Area filter complete. Removed {removed_count} features smaller than {min_area} sq units.")
-    success = clear_and_repopulate_layer(layer, features_to_keep, layer_name, action_desc, logger_queue)
-    log_message(logger_queue, f"    Finished {action_desc} for '{layer_name}' in {time.time() - start_time:.2f}s.")
-    return success
-
-def _apply_chaikin_to_ring(points, iterations, logger_queue=None):
-    if not points or len(points) < 4:
-        return points
-    current_points = list(points)
-    for iter_num in range(iterations):
-        new_points = []
-        num_pts = len(current_points)
-        if num_pts < 4: 
-            log_message(logger_queue, f"        Warning: Chaikin smoothing reduced points below minimum (4) at iteration {iter_num}. Stopping early.")
-            break
-
-        p0_prev = current_points[num_pts - 2] # Second to last point for closing segment
-        p1_first = current_points[0]      # First point for closing segment
-
-        # Calculate Q0 and Q1 for the segment connecting the last actual point to the first (closing the loop)
-        # This means we need to conceptually use current_points[-1] (which is same as current_points[0] if closed)
-        # and current_points[0]. But GetPoints() gives list where last != first.
-        # Chaikin operates on open polylines usually, then closes them.
-        # If current_points is [P0, P1, P2, P0] (closed from OGR), we operate on [P0,P1,P2] then ensure closure.
-        # For a ring like (A, B, C, A), GetPoints() might give [(Ax,Ay), (Bx,By), (Cx,Cy), (Ax,Ay)]
-        # Or sometimes it's [(Ax,Ay), (Bx,By), (Cx,Cy)] if it's an OGR ring not yet forced to close by adding start point.
-        # Let's assume points from GetPoints() already has the last point == first point for a closed ring.
-        
-        # Chaikin's rule uses P_i and P_{i+1}
-        # The first new segment is from R0 (derived from P0, P1) and Q1 (derived from P0, P1)
-        # The last new segment is from R_N-1 (derived from P_N-1, P0) and Q0 (derived from P_N-1, P0)
-        
-        # Iterating from i=0 to num_pts-2 (if last point is duplicate of first)
-        # or i=0 to num_pts-1 (if last point is unique before closure)
-        
-        # If points are [A, B, C, A] (num_pts = 4)
-        # i=0: p0=A, p1=B -> qA, rA
-        # i=1: p0=B, p1=C -> qB, rB
-        # i=2: p0=C, p1=A -> qC, rC
-        # Result: [qA, rA, qB, rB, qC, rC, qA (to close)]
-        
-        # The provided _apply_chaikin_to_ring seems to have a specific logic for handling closure
-        # that might be slightly different from textbook, let's stick to its original intent.
-        # Original logic:
-        # p0 = current_points[num_pts - 2]
-        # p1 = current_points[0]
-        # This segment seems to be handled separately and prepended/appended.
-        
-        temp_ring_pts = []
-        for i in range(num_pts -1): # Iterate through segments P_i to P_{i+1}
-            p_i = current_points[i]
-            p_i_plus_1 = current_points[i+1]
-
-            r_x = 0.75 * p_i[0] + 0.25 * p_i_plus_1[0]
-            r_y = 0.75 * p_i[1] + 0.25 * p_i_plus_1[1]
-            q_x = 0.25 * p_i[0] + 0.75 * p_i_plus_1[0]
-            q_y = 0.25 * p_i[1] + 0.75 * p_i_plus_1[1]
-            temp_ring_pts.append((r_x, r_y))
-            temp_ring_pts.append((q_x, q_y))
-
-        if temp_ring_pts:
-            temp_ring_pts.append(temp_ring_pts[0]) # Close the new ring
-            current_points = temp_ring_pts
-        else: # Not enough points to form segments
-            break 
+                    log_message(logger_queue, f"        Warning: MakeValid() repaired FID {fid} to an incompatible type ({ogr.GeometryTypeToName(repaired_type)} for target {ogr.GeometryTypeToName(target_geom_type)}). Discarding feature.")
+            else:
+                log_message(logger_queue, f"        Warning: MakeValid() failed or produced empty geometry for FID {fid}. Discarding feature.")
+    else:
+        status = 'empty'
 
-    return current_points
+    if final_geom:
+        # Ensure the final_geom also has SRS if the original did
+        if geom and geom.GetSpatialReference() and final_geom.GetSpatialReference() is None:
+             final_geom.AssignSpatialReference(geom.GetSpatialReference().Clone())
+    return final_geom, status
 
+def _fused_batch_edits(layer, target_geom_type, tolerance, min_area, chaikin_iters, fix, logger_queue=None):
+    """shapely-vectorized body of process_layer_fused. Returns (updates, deletes, repaired_count).
 
-def smooth_layer_chaikin(layer, iterations, layer_name, logger_queue=None):
-    action_desc = f"Chaikin smoothing ({iterations} iterations)"
+    Validity, simplification and area run per batch in GEOS; MakeValid() repairs and Chaikin
+    smoothing stay per geometry through the OGR helpers.
+    """
+    updates, deletes = [], []
+    repaired_count = 0
+    for batch in _iter_geometry_batches(layer):
+        fids = batch['fid']
+        geoms = shapely.from_wkb(batch['wkb'])
+        drop = shapely.is_missing(geoms) | shapely.is_empty(geoms)
+        changed = np.zeros(len(geoms), dtype=bool)
+
+        if fix:
+            for idx in np.flatnonzero(~drop & ~shapely.is_valid(geoms)):
+                fid = int(fids[idx])
+                fixed, status = _fix_geometry(ogr.CreateGeometryFromWkb(batch['wkb'][idx]), fid, target_geom_type, logger_queue)
+                if fixed:
+                    geoms[idx] = shapely.from_wkb(fixed.ExportToWkb(ogr.wkbNDR))
+                    changed[idx] = True
+                    repaired_count += 1
+                else:
+                    drop[idx] = True
+
+        if tolerance > 0:
+            simplified = shapely.simplify(geoms, tolerance, preserve_topology=True)
+            ok = ~drop & ~(shapely.is_missing(simplified) | shapely.is_empty(simplified))
+            geoms = np.where(ok, simplified, geoms)
+            changed |= ok
+
+        if chaikin_iters > 0:
+            for idx in np.flatnonzero(~drop):
+                smoothed = _smooth_geometry_chaikin(ogr.CreateGeometryFromWkb(shapely.to_wkb(geoms[idx])), chaikin_iters, int(fids[idx]), logger_queue)
+                geoms[idx] = shapely.from_wkb(smoothed.ExportToWkb(ogr.wkbNDR))
+                changed[idx] = True
+
+        if min_area > 0:
+            drop |= ~drop & (shapely.area(geoms) < min_area)
+
+        deletes.extend(fids[drop].tolist())
+        write = changed & ~drop
+        updates.extend(zip(fids[write].tolist(), shapely.to_wkb(geoms[write], byte_order=1).tolist()))
+    return updates, deletes, repaired_count
+
+def process_layer_fused(layer, layer_name, *, tolerance, min_area, chaikin_iters, fix=True, logger_queue=None):
+    """Runs fix -> simplify -> Chaikin -> min-area filter in a single scan of the layer.
+
+    Every feature is read once and the layer is rewritten once, instead of once per stage.
+    """
+    stages = [name for name, enabled in (("fix", fix),
+                                          (f"simplify {tolerance}", tolerance > 0),
+                                          (f"Chaikin x{chaikin_iters}", chaikin_iters > 0),
+                                          (f"min area {min_area}", min_area > 0)) if enabled]
+    action_desc = f"fused post-processing ({', '.join(stages) or 'no stages'})"
     start_time = time.time()
+    if not stages:
+        log_message(logger_queue, f"    Skipping {action_desc} for '{layer_name}'.")
+        return True
 
     log_message(logger_queue, f"    Applying {action_desc} to layer '{layer_name}'...")
     feature_count = layer.GetFeatureCount()
@@ -355,300 +825,374 @@ def smooth_layer_chaikin(layer, iterations, layer_name, logger_queue=None):
         log_message(logger_queue, f"    Layer '{layer_name}' is empty, skipping {action_desc}.")
         return True
 
-    processed_data = []
+    target_geom_type = layer.GetGeomType()
+    if shapely is not None:
+        try:
+            updates, deletes, repaired_count = _fused_batch_edits(layer, target_geom_type, tolerance, min_area, chaikin_iters, fix, logger_queue)
+        except Exception as e:
+            log_message(logger_queue, f"      Vectorized pass unavailable ({e}). Falling back to per-feature processing.")
+        else:
+            log_message(logger_queue, f"      Single pass complete (vectorized). Repaired {repaired_count}, updated {len(updates)}, removed {len(deletes)} (invalid, empty or below min area).")
+            success = _apply_layer_edits(layer, layer_name, updates=updates, deletes=deletes, logger_queue=logger_queue)
+            log_message(logger_queue, f"    Finished {action_desc} for '{layer_name}' in {time.time() - start_time:.2f}s.")
+            return success
+
+    features_to_keep = [None] * feature_count # Pre-sized; trimmed after the scan
+    kept_count = 0
     layer_defn = layer.GetLayerDefn()
     field_names = [layer_defn.GetFieldDefn(i).GetNameRef() for i in range(layer_defn.GetFieldCount())]
 
+    repaired_count = 0
+    removed_count = 0
     layer.ResetReading()
     feature = layer.GetNextFeature()
     processed_count = 0
-    log_message(logger_queue, f"      Processing {feature_count} features for Chaikin smoothing (updates every 1000)...")
+    log_message(logger_queue, f"      Processing {feature_count} features in one pass (updates every 8192)...")
 
     while feature:
         geom = feature.GetGeometryRef()
-        attrs = {name: feature.GetField(name) for name in field_names}
-        processed_geom = None
-
-        if geom and not geom.IsEmpty():
-            geom_type = geom.GetGeometryType()
-            flat_geom_type = ogr.GT_Flatten(geom_type) 
-
-            if flat_geom_type == ogr.wkbPolygon or flat_geom_type == ogr.wkbMultiPolygon:
-                new_multi_poly = ogr.Geometry(ogr.wkbMultiPolygon)
-                srs = geom.GetSpatialReference()
-                if srs:
-                    new_multi_poly.AssignSpatialReference(srs.Clone()) # Clone SRS
+        fid = feature.GetFID()
 
-                num_parts = geom.GetGeometryCount() if flat_geom_type == ogr.wkbMultiPolygon else 1
+        if fix:
+            geom, status = _fix_geometry(geom, fid, target_geom_type, logger_queue)
+            if status == 'repaired':
+                repaired_count += 1
+        else:
+            geom = geom.Clone() if geom and not geom.IsEmpty() else None
 
-                for k in range(num_parts):
-                    part = geom.GetGeometryRef(k) if flat_geom_type == ogr.wkbMultiPolygon else geom
-                    
-                    if not part or part.IsEmpty() or ogr.GT_Flatten(part.GetGeometryType()) != ogr.wkbPolygon:
-                        continue
+        if geom is not None and tolerance > 0:
+            try:
+                simplified = geom.SimplifyPreserveTopology(tolerance)
+                if simplified and not simplified.IsEmpty():
+                    geom = simplified
+            except Exception as e:
+                log_message(logger_queue, f"\n        Warning: SimplifyPreserveTopology failed for FID {fid}: {e}. Keeping unsimplified geometry.")
 
-                    new_poly = ogr.Geometry(ogr.wkbPolygon)
-                    if srs: new_poly.AssignSpatialReference(srs.Clone())
-                    num_rings = part.GetGeometryCount()
+        if geom is not None and chaikin_iters > 0:
+            geom = _smooth_geometry_chaikin(geom, chaikin_iters, fid, logger_queue)
 
-                    for i in range(num_rings):
-                        ring = part.GetGeometryRef(i)
-                        if not ring or ring.IsEmpty() or ogr.GT_Flatten(ring.GetGeometryType()) != ogr.wkbLinearRing:
-                            continue
-                        
-                        points = ring.GetPoints() 
-                        if not points or len(points) < 4: 
-                            new_poly.AddGeometry(ring.Clone()) 
-                            continue
+        keep = geom is not None and not geom.IsEmpty()
+        if keep and min_area > 0:
+            try:
+                keep = geom.Area() >= min_area
+            except Exception as e:
+                log_message(logger_queue, f"\n        Warning: Could not calculate area for FID {fid}: {e}. Feature will be removed by filter.")
+                keep = False
 
-                        try:
-                            points_2d = [(p[0], p[1]) for p in points]
-                            # Ensure the ring is explicitly closed for Chaikin if GetPoints doesn't guarantee it
-                            if points_2d[0] != points_2d[-1] and len(points_2d) > 1: # Check if not already closed
-                                points_2d.append(points_2d[0])
-
-                            smoothed_points_2d = _apply_chaikin_to_ring(points_2d, iterations, logger_queue)
-
-                            if smoothed_points_2d and len(smoothed_points_2d) >= 4:
-                                new_ring = ogr.Geometry(ogr.wkbLinearRing)
-                                if srs: new_ring.AssignSpatialReference(srs.Clone())
-                                has_z = len(points[0]) > 2
-                                z_val = points[0][2] if has_z else 0.0 
-
-                                for pt_idx, pt in enumerate(smoothed_points_2d):
-                                    # Ensure last point closes the ring properly
-                                    if pt_idx == len(smoothed_points_2d) -1 and smoothed_points_2d[0] != pt : # If Chaikin didn't close it
-                                        if has_z:
-                                            new_ring.AddPoint(smoothed_points_2d[0][0], smoothed_points_2d[0][1], z_val)
-                                        else:
-                                            new_ring.AddPoint(smoothed_points_2d[0][0], smoothed_points_2d[0][1])
-                                        break # Ring is now closed by adding the first point
-
-                                    if has_z:
-                                        new_ring.AddPoint(pt[0], pt[1], z_val)
-                                    else:
-                                        new_ring.AddPoint(pt[0], pt[1])
-                                
-                                # Ensure the last point is same as first for a valid LinearRing by OGR
-                                if new_ring.GetPointCount() > 0:
-                                    p_first = new_ring.GetPoint_2D(0)
-                                    p_last = new_ring.GetPoint_2D(new_ring.GetPointCount()-1)
-                                    if p_first[0] != p_last[0] or p_first[1] != p_last[1]:
-                                        if has_z: new_ring.AddPoint(p_first[0], p_first[1], z_val)
-                                        else: new_ring.AddPoint(p_first[0], p_first[1])
-
-
-                                if new_ring.IsValid():
-                                    new_poly.AddGeometry(new_ring)
-                                else:
-                                    log_message(logger_queue, f"        Warning: Chaikin resulted in invalid ring geom for FID {feature.GetFID()}, part {k}, ring {i}. Using original ring.")
-                                    new_poly.AddGeometry(ring.Clone())
-                            else: 
-                                new_poly.AddGeometry(ring.Clone())
-                        except Exception as e:
-                            log_message(logger_queue, f"\n        Error during Chaikin smoothing for FID {feature.GetFID()}, part {k}, ring {i}: {e}. Using original ring.")
-                            log_message(logger_queue, traceback.format_exc())
-                            new_poly.AddGeometry(ring.Clone())
-                    
-                    if not new_poly.IsEmpty():
-                        if new_poly.IsValid():
-                            err = new_multi_poly.AddGeometry(new_poly.Clone()) # Clone polygon before adding
-                            if err != ogr.OGRERR_NONE:
-                                log_message(logger_queue, f"        Warning: Failed to add smoothed polygon part {k} for FID {feature.GetFID()} to MultiPolygon. Error: {err}")
-                        else:
-                            log_message(logger_queue, f"        Warning: Polygon part {k} invalid after smoothing rings for FID {feature.GetFID()}. Skipping this part.")
-                
-                if not new_multi_poly.IsEmpty():
-                    if not new_multi_poly.IsValid():
-                        log_message(logger_queue, f"        Warning: Final MultiPolygon for FID {feature.GetFID()} is invalid after smoothing. Attempting MakeValid.")
-                        repaired_multi = new_multi_poly.MakeValid()
-                        if repaired_multi and not repaired_multi.IsEmpty() and repaired_multi.IsValid():
-                            processed_geom = repaired_multi.Clone()
-                        else:
-                            log_message(logger_queue, f"          MakeValid failed for smoothed MultiPolygon FID {feature.GetFID()}. Keeping original.")
-                            processed_geom = geom.Clone() 
-                    else:
-                        processed_geom = new_multi_poly.Clone()
-                else: 
-                    processed_geom = geom.Clone() 
-            else: 
-                processed_geom = geom.Clone()
-        else: 
-            processed_geom = None
+        if keep:
+            item = {'geom': geom, 'attributes': {name: feature.GetField(name) for name in field_names}}
+            if kept_count < len(features_to_keep): features_to_keep[kept_count] = item
+            else: features_to_keep.append(item)
+            kept_count += 1
+        else:
+            removed_count += 1
 
-        processed_data.append({'geom': processed_geom, 'attributes': attrs})
-        
         processed_count += 1
-        if processed_count % 1000 == 0: 
+        if (processed_count & 8191) == 0: # Every 8192 features
             elapsed = time.time() - start_time
-            log_message(logger_queue, f"        Smoothed {processed_count}/{feature_count} features in {elapsed:.1f}s...")
+            log_message(logger_queue, f"        Processed {processed_count}/{feature_count} features in {elapsed:.1f}s...")
 
         if feature: feature.Destroy()
         feature = layer.GetNextFeature()
 
-    success = clear_and_repopulate_layer(layer, processed_data, layer_name, action_desc, logger_queue)
+    del features_to_keep[kept_count:]
+    log_message(logger_queue, f"      Single pass complete. Repaired {repaired_count}, removed {removed_count} (invalid, empty or below min area).")
+    success = clear_and_repopulate_layer(layer, features_to_keep, layer_name, action_desc, logger_queue)
     log_message(logger_queue, f"    Finished {action_desc} for '{layer_name}' in {time.time() - start_time:.2f}s.")
     return success
 
-def fix_layer_geometries(layer, layer_name, logger_queue=None):
-    action_desc = "geometry fixing"
-    start_time = time.time()
-    log_message(logger_queue, f"    Applying {action_desc} to layer '{layer_name}'...")
-    feature_count = layer.GetFeatureCount()
-    if feature_count == 0:
-        log_message(logger_queue, f"    Layer '{layer_name}' is empty, skipping {action_desc}.")
-        return True
-
-    layer_defn = layer.GetLayerDefn()
-    field_names = [layer_defn.GetFieldDefn(i).GetNameRef() for i in range(layer_defn.GetFieldCount())]
-    target_geom_type = layer.GetGeomType() 
-    target_flat_geom_type = ogr.GT_Flatten(target_geom_type) 
-
-    processed_data = []
-    invalid_count = 0
-    repaired_count = 0
-    discarded_count = 0
-
-    layer.ResetReading()
-    feature = layer.GetNextFeature()
-    processed_count = 0
-    log_message(logger_queue, f"      Checking/Fixing {feature_count} geometries (updates every 5000)...")
-
-    while feature:
-        processed_count += 1
-        geom = feature.GetGeometryRef()
-        attrs = {name: feature.GetField(name) for name in field_names}
-        fid = feature.GetFID()
-        final_geom = None 
-
-        if geom and not geom.IsEmpty():
-            if geom.IsValid():
-                final_geom = geom.Clone() 
-            else:
-                invalid_count += 1
-                try:
-                    repaired_geom = geom.MakeValid()
-                except Exception as make_valid_err:
-                    log_message(logger_queue, f"        Warning: MakeValid() crashed for FID {fid}: {make_valid_err}. Discarding feature.")
-                    repaired_geom = None
-                    discarded_count +=1
-                
-                if repaired_geom and not repaired_geom.IsEmpty():
-                    repaired_type = repaired_geom.GetGeometryType()
-                    repaired_flat_type = ogr.GT_Flatten(repaired_type)
-
-                    if repaired_flat_type == target_flat_geom_type:
-                        if repaired_geom.IsValid(): 
-                            final_geom = repaired_geom.Clone()
-                            repaired_count += 1
-                        else:
-                            log_message(logger_queue, f"        Warning: MakeValid() produced an invalid geometry of type {ogr.GeometryTypeToName(repaired_type)} for FID {fid}. Discarding feature.")
-                            discarded_count += 1
-                    elif repaired_flat_type == ogr.wkbGeometryCollection and \
-                         (target_flat_geom_type == ogr.wkbPolygon or target_flat_geom_type == ogr.wkbMultiPolygon):
-                        collection_extract = ogr.Geometry(target_geom_type) 
-                        srs = geom.GetSpatialReference()
-                        if srs: collection_extract.AssignSpatialReference(srs.Clone())
-                        valid_parts_found = False
-                        for i in range(repaired_geom.GetGeometryCount()):
-                            part = repaired_geom.GetGeometryRef(i)
-                            if part and not part.IsEmpty() and ogr.GT_Flatten(part.GetGeometryType()) == ogr.wkbPolygon and part.IsValid():
-                                err = collection_extract.AddGeometry(part.Clone())
-                                if err == ogr.OGRERR_NONE:
-                                    valid_parts_found = True
-                                else:
-                                    log_message(logger_queue, f"        Warning: Failed to add valid polygon part from GeometryCollection for FID {fid}. Error: {err}")
-                        
-                        if valid_parts_found:
-                            if collection_extract.IsValid():
-                                final_geom = collection_extract.Clone() # Keep the extracted polygons (Clone before assigning)
-                                repaired_count += 1
-                                log_message(logger_queue, f"        Info: Repaired FID {fid} from GeometryCollection, extracted valid {ogr.GeometryTypeToName(target_geom_type)}.")
-                            else:
-                                log_message(logger_queue, f"        Warning: Extracted geometry from GeometryCollection for FID {fid} is invalid. Discarding feature.")
-                                discarded_count += 1
-                        else:
-                            log_message(logger_queue, f"        Warning: MakeValid() produced GeometryCollection for FID {fid}, but no valid {ogr.GeometryTypeToName(target_geom_type)} parts found. Discarding feature.")
-                            discarded_count += 1
-                    else:
-                        log_message(logger_queue, f"        Warning: MakeValid() repaired FID {fid} to an incompatible type ({ogr.GeometryTypeToName(repaired_type)} for target {ogr.GeometryTypeToName(target_geom_type)}). Discarding feature.")
-                        discarded_count += 1
-                else:
-                    log_message(logger_queue, f"        Warning: MakeValid() failed or produced empty geometry for FID {fid}. Discarding feature.")
-                    discarded_count += 1
-        else:
-            discarded_count += 1
-        
-        if final_geom:
-            # Ensure the final_geom also has SRS if the original did
-            if geom and geom.GetSpatialReference() and final_geom.GetSpatialReference() is None:
-                 final_geom.AssignSpatialReference(geom.GetSpatialReference().Clone())
-            processed_data.append({'geom': final_geom, 'attributes': attrs}) # final_geom is already a clone or a new geom
-
-        if processed_count % 5000 == 0:
-            elapsed = time.time() - start_time
-            log_message(logger_queue, f"        Checked/Fixed {processed_count}/{feature_count} geometries in {elapsed:.1f}s...")
-
-        if feature: feature.Destroy()
-        feature = layer.GetNextFeature()
-
-    log_message(logger_queue, f"      Geometry fixing complete. Found {invalid_count} invalid, repaired {repaired_count}, discarded {discarded_count}.")
-    success = clear_and_repopulate_layer(layer, processed_data, layer_name, action_desc, logger_queue)
-    log_message(logger_queue, f"    Finished {action_desc} for '{layer_name}' in {time.time() - start_time:.2f}s.")
-    return success
+def _delete_invalid_geometries(layer, layer_name, logger_queue=None):
+    """Deletes the features of a GeoPackage layer whose geometry is invalid, by FID in SQLite. Returns True on success.
+
+    Validity is tested per batch with shapely when available, else per feature with OGR's IsValid().
+    """
+    bad_fids = _batch_fids_to_drop(layer, lambda batch, geoms: ~shapely.is_valid(geoms), logger_queue=logger_queue)
+    if bad_fids is None:
+        bad_fids = []
+        layer.ResetReading()
+        for feature in layer:
+            geom = feature.GetGeometryRef()
+            if geom is not None and not geom.IsValid():
+                bad_fids.append(feature.GetFID())
+        layer.ResetReading()
+    if bad_fids:
+        log_message(logger_queue, f"      Removing {len(bad_fids)} invalid geometries from '{layer_name}'.")
+    return _delete_fids_sql(layer, layer_name, bad_fids, logger_queue)
 
 def filter_layer_by_dn(layer, keep_dn_value, layer_name, logger_queue=None):
     action_desc = f"DN filter (keep DN={keep_dn_value})"
     start_time = time.time()
     log_message(logger_queue, f"    Applying {action_desc} to layer '{layer_name}'...")
-    feature_count = layer.GetFeatureCount()
+    feature_count = _fast_feature_count(layer) # -1 when only a full scan could tell
     if feature_count == 0:
         log_message(logger_queue, f"    Layer '{layer_name}' is empty, skipping {action_desc}.")
         return True
 
-    features_to_keep = []
     layer_defn = layer.GetLayerDefn()
     dn_idx = layer_defn.GetFieldIndex('DN')
     if dn_idx < 0:
         log_message(logger_queue, f"      Error: Field 'DN' not found in layer '{layer_name}'. Cannot filter.")
         return False
+    # Polygonize writes DN as OFTInteger; read it as a C int rather than through GetField()'s type dispatch.
+    # Any other declared type goes through the typed-getter table (GetField for non-numeric types).
+    get_dn = _FIELD_GETTERS.get(layer_defn.GetFieldDefn(dn_idx).GetType(), ogr.Feature.GetField)
+
+    # Fast path (GeoPackage): delete non-matching rows in SQLite instead of rewriting the layer.
+    # ST_IsValid needs SpatiaLite; without it the plain DELETE runs and invalid geometries are removed by FID afterwards.
+    geom_col = layer.GetGeometryColumn() or 'geom'
+    sql = (f'DELETE FROM "{layer_name}" WHERE "DN" IS NULL OR "DN" <> {int(keep_dn_value)} '
+           f'OR "{geom_col}" IS NULL OR ST_IsEmpty("{geom_col}") = 1')
+    is_gpkg = _layer_driver_name(layer) == 'GPKG'
+    sql_ok = is_gpkg and _execute_layer_sql(layer, sql + f' OR ST_IsValid("{geom_col}") = 0', logger_queue, quiet=True)
+    if is_gpkg and not sql_ok and _execute_layer_sql(layer, sql, logger_queue):
+        # DN/empty rows are gone; invalid geometries still have to be dropped without ST_IsValid
+        log_message(logger_queue, "      Warning: ST_IsValid unavailable in SQL (no SpatiaLite); removing invalid geometries separately.")
+        sql_ok = _delete_invalid_geometries(layer, layer_name, logger_queue)
+    if sql_ok:
+        if feature_count >= 0:
+            removed_count = feature_count - layer.GetFeatureCount()
+            log_message(logger_queue, f"      DN filter complete (SQL). Removed {removed_count} features.")
+        else:
+            log_message(logger_queue, "      DN filter complete (SQL).")
+        log_message(logger_queue, f"    Finished {action_desc} for '{layer_name}' in {time.time() - start_time:.2f}s.")
+        return True
 
-    field_names = [layer_defn.GetFieldDefn(i).GetNameRef() for i in range(layer_defn.GetFieldCount())]
-
+    # Batch path: compare the DN column and geometry validity per batch.
+    fids_to_drop = _batch_fids_to_drop(
+        layer,
+        lambda batch, geoms: (batch['DN'] != keep_dn_value) | shapely.is_missing(geoms) | shapely.is_empty(geoms) | ~shapely.is_valid(geoms),
+        columns=('DN',), logger_queue=logger_queue)
+    if fids_to_drop is not None:
+        success = _apply_layer_edits(layer, layer_name, deletes=fids_to_drop, logger_queue=logger_queue)
+        log_message(logger_queue, f"      DN filter complete (batched). Removed {len(fids_to_drop)} features.")
+        log_message(logger_queue, f"    Finished {action_desc} for '{layer_name}' in {time.time() - start_time:.2f}s.")
+        return success
+
+    if is_gpkg:
+        # GeoPackage without the SQL spatial functions: decide per feature in Python, but delete the rejects
+        # by FID in SQLite instead of rewriting every kept feature.
+        bad_fids = []
+        layer.ResetReading()
+        for feature in layer:
+            geom = feature.GetGeometryRef()
+            if (not feature.IsFieldSetAndNotNull(dn_idx) or get_dn(feature, dn_idx) != keep_dn_value
+                    or geom is None or geom.IsEmpty() or not geom.IsValid()):
+                bad_fids.append(feature.GetFID())
+        layer.ResetReading()
+        if _delete_fids_sql(layer, layer_name, bad_fids, logger_queue):
+            log_message(logger_queue, f"      DN filter complete (FID delete). Removed {len(bad_fids)} features.")
+            log_message(logger_queue, f"    Finished {action_desc} for '{layer_name}' in {time.time() - start_time:.2f}s.")
+            return True
+
+    schema = _field_schema(layer_defn)
+    # Kept features go into flat columns (WKB list + one typed array per field) rather than a dict per feature.
+    features_to_keep = _empty_feature_columns(layer_defn, feature_count if feature_count > 0 else 4096, geoms_wkb=WkbSpool())
+    geoms_wkb, columns, nulls = features_to_keep
+
+    # Let OGR skip the rejected DN values; only matching features are read back into Python.
+    layer.SetAttributeFilter(f'"DN" = {int(keep_dn_value)}')
     layer.ResetReading()
-    feature = layer.GetNextFeature()
+    next_feature = layer.GetNextFeature
+    feature = next_feature()
     processed_count = 0
     kept_count = 0
-    log_message(logger_queue, f"      Filtering {feature_count} features by DN (updates every 5000)...")
+    count_label = feature_count if feature_count >= 0 else "all"
+    log_message(logger_queue, f"      Filtering {count_label} features by DN (updates every 8192)...")
 
-    while feature:
-        try:
-            dn = feature.GetField(dn_idx)
-            if dn == keep_dn_value:
+    try:
+        while feature:
+            try:
                 geom = feature.GetGeometryRef()
                 if geom and not geom.IsEmpty() and geom.IsValid(): # Ensure geom is valid before keeping
-                    attrs = {name: feature.GetField(name) for name in field_names}
-                    features_to_keep.append({'geom': geom.Clone() if geom else None, 'attributes': attrs})
+                    if columns and kept_count == len(columns[0]): # Count was unknown or low; double capacity
+                        geoms_wkb, columns, nulls = _grow_feature_columns(FeatureColumns(geoms_wkb, columns, nulls), 2 * kept_count)
+                    for i, get_value in schema:
+                        if feature.IsFieldSetAndNotNull(i):
+                            columns[i][kept_count] = get_value(feature, i)
+                        else:
+                            nulls[i][kept_count] = True
+                    geoms_wkb.append(geom.ExportToWkb(ogr.wkbNDR))
                     kept_count += 1
-        except Exception as e:
-            log_message(logger_queue, f"\n        Warning: Error reading DN field for FID {feature.GetFID()}: {e}. Skipping feature.")
+            except Exception as e:
+                log_message(logger_queue, f"\n        Warning: Error reading feature FID {feature.GetFID()}: {e}. Skipping feature.")
 
-        processed_count += 1
-        if processed_count % 5000 == 0:
-            elapsed = time.time() - start_time
-            log_message(logger_queue, f"        DN filter checked {processed_count}/{feature_count} features in {elapsed:.1f}s...")
+            processed_count += 1
+            if (processed_count & 8191) == 0: # Every 8192 features
+                elapsed = time.time() - start_time
+                log_message(logger_queue, f"        DN filter checked {processed_count} matching features in {elapsed:.1f}s...")
 
-        if feature: feature.Destroy()
-        feature = layer.GetNextFeature()
+            if feature: feature.Destroy()
+            feature = next_feature()
+    finally:
+        layer.SetAttributeFilter(None)
+        layer.ResetReading()
 
     if kept_count == feature_count and feature_count > 0: # If no features were removed
         log_message(logger_queue, f"      Skipping rewrite for {action_desc}: all {feature_count} features met criteria.")
+        geoms_wkb.close()
         return True
 
-    success = clear_and_repopulate_layer(layer, features_to_keep, layer_name, action_desc, logger_queue)
+    features_to_keep = FeatureColumns(geoms_wkb, [col[:kept_count] for col in columns], [mask[:kept_count] for mask in nulls])
+    try:
+        success = clear_and_repopulate_layer(layer, features_to_keep, layer_name, action_desc, logger_queue)
+    finally:
+        geoms_wkb.close()
     log_message(logger_queue, f"    Finished {action_desc} for '{layer_name}' in {time.time() - start_time:.2f}s.")
     return success
 
+def _iter_block_windows(band, target_pixels=1 << 22):
+    """Yields (xoff, yoff, xsize, ysize) windows aligned to the band's natural block size.
+
+    Strip-organised bands (blocks spanning the full width) are read several strips at a time, up to about
+    `target_pixels` per window.
+    """
+    xsize, ysize = band.XSize, band.YSize
+    block_x, block_y = band.GetBlockSize()
+    if block_x >= xsize:
+        block_x = xsize
+        block_y = max(block_y, (target_pixels // max(xsize, 1)) // block_y * block_y)
+    for yoff in range(0, ysize, block_y):
+        ys = min(block_y, ysize - yoff)
+        for xoff in range(0, xsize, block_x):
+            yield xoff, yoff, min(block_x, xsize - xoff), ys
+
+# Derived band that thresholds its source on read: 1 where value >= threshold, else 0 (NoData).
+# SourceTransferType keeps float sources from being rounded to Byte before the comparison.
+_THRESHOLD_VRT_TEMPLATE = """<VRTDataset rasterXSize="{xsize}" rasterYSize="{ysize}">
+  <SRS>{srs}</SRS>
+  <GeoTransform>{geotransform}</GeoTransform>
+  <VRTRasterBand dataType="Byte" band="1" subClass="VRTDerivedRasterBand">
+    <NoDataValue>0</NoDataValue>
+    <SourceTransferType>{transfer_type}</SourceTransferType>
+{pixel_function}
+    <SimpleSource>
+      <SourceFilename relativeToVRT="0">{source}</SourceFilename>
+      <SourceBand>{band}</SourceBand>
+    </SimpleSource>
+  </VRTRasterBand>
+</VRTDataset>"""
+
+# Built-in muparser pixel function (GDAL 3.11+); needs no embedded Python.
+_THRESHOLD_EXPRESSION_FUNCTION = """    <PixelFunctionType>expression</PixelFunctionType>
+    <PixelFunctionArguments expression="B1 &gt;= {threshold}" dialect="muparser"/>"""
+
+# Python fallback for older builds; GDAL_VRT_ENABLE_PYTHON is enabled only while this template is compiled.
+_THRESHOLD_PYTHON_FUNCTION = """    <PixelFunctionType>threshold</PixelFunctionType>
+    <PixelFunctionLanguage>Python</PixelFunctionLanguage>
+    <PixelFunctionCode><![CDATA[
+import numpy as np
+def threshold(in_ar, out_ar, xoff, yoff, xsize, ysize, raster_xsize, raster_ysize, buf_radius, gt, **kwargs):
+    np.greater_equal(in_ar[0], {threshold}, out=out_ar, casting='unsafe')
+]]></PixelFunctionCode>"""
+
+EXPRESSION_PIXEL_FUNCTION_MIN_VERSION = 3110000 # gdal.VersionInfo() of the first release with the 'expression' pixel function
+
+def _compile_threshold_vrt(vrt_xml, enable_python):
+    """Opens vrt_xml and reads one pixel so the pixel function is compiled now. Returns the dataset or None."""
+    if enable_python:
+        previous = gdal.GetThreadLocalConfigOption('GDAL_VRT_ENABLE_PYTHON', None)
+        gdal.SetThreadLocalConfigOption('GDAL_VRT_ENABLE_PYTHON', 'YES')
+    try:
+        vrt_ds = gdal.Open(vrt_xml)
+        # The band keeps its compiled function, so later reads (Polygonize) don't need the option
+        vrt_ds.GetRasterBand(1).ReadRaster(0, 0, 1, 1)
+        return vrt_ds
+    except Exception:
+        return None
+    finally:
+        if enable_python:
+            gdal.SetThreadLocalConfigOption('GDAL_VRT_ENABLE_PYTHON', previous)
+
+def _open_threshold_vrt(raster_ds, band_num, threshold_value):
+    """Opens an in-memory VRT whose single Byte band is `band_num` of raster_ds thresholded on the fly.
+
+    Uses the built-in 'expression' pixel function where GDAL has it, else the embedded Python template with
+    Python enabled only while that template is compiled. Returns None if the source has no file path or
+    neither function works; callers then threshold into a MEM raster instead.
+    """
+    source_path = raster_ds.GetDescription()
+    if not source_path or not os.path.exists(source_path):
+        return None
+    fields = dict(
+        xsize=raster_ds.RasterXSize, ysize=raster_ds.RasterYSize,
+        srs=xml_escape(raster_ds.GetProjection()),
+        geotransform=", ".join(repr(v) for v in raster_ds.GetGeoTransform()),
+        transfer_type=gdal.GetDataTypeName(raster_ds.GetRasterBand(band_num).DataType),
+        source=xml_escape(source_path), band=int(band_num))
+    threshold = int(threshold_value)
+    if int(gdal.VersionInfo()) >= EXPRESSION_PIXEL_FUNCTION_MIN_VERSION:
+        vrt_ds = _compile_threshold_vrt(_THRESHOLD_VRT_TEMPLATE.format(
+            pixel_function=_THRESHOLD_EXPRESSION_FUNCTION.format(threshold=threshold), **fields), enable_python=False)
+        if vrt_ds is not None:
+            return vrt_ds
+    return _compile_threshold_vrt(_THRESHOLD_VRT_TEMPLATE.format(
+        pixel_function=_THRESHOLD_PYTHON_FUNCTION.format(threshold=threshold), **fields), enable_python=True)
+
+def _threshold_band_to_mem(raster_ds, band, band_num, threshold_value, logger_queue=None):
+    """Thresholds `band` into an in-memory Byte raster (1 where >= threshold, NoData 0).
+
+    Returns (dataset, pixels_above, mask_array), or (None, 0, None) on error. With gdal_array the dataset wraps
+    mask_array without a copy, so the caller must keep mask_array referenced while the dataset is in use.
+    """
+    log_message(logger_queue, "  Creating temporary thresholded raster in memory...")
+    mask_array = None
+    temp_ds = None
+    temp_band = None
+    try:
+        if gdal_array is not None:
+            # Tiles are thresholded straight into this buffer, which GDAL then reads in place
+            mask_array = np.empty((raster_ds.RasterYSize, raster_ds.RasterXSize), dtype=np.uint8)
+        else:
+            temp_ds = gdal.GetDriverByName('MEM').Create('', raster_ds.RasterXSize, raster_ds.RasterYSize, 1, gdal.GDT_Byte)
+            if not temp_ds:
+                raise RuntimeError("Failed to create in-memory raster dataset.")
+            temp_band = temp_ds.GetRasterBand(1)
+    except Exception as e:
+        log_message(logger_queue, f"Error setting up temporary in-memory raster: {e}")
+        return None, 0, None
+
+    # Read and threshold one block window at a time so the full source band is never held in memory.
+    log_message(logger_queue, f"  Reading band {band_num} data...")
+    pixels_above = 0
+    tile_out = None
+    try:
+        for xoff, yoff, xs, ys in _iter_block_windows(band):
+            tile_in = band.ReadAsArray(xoff, yoff, xs, ys)
+            if tile_in is None:
+                raise MemoryError(f"ReadAsArray returned None for band {band_num} at offset ({xoff}, {yoff}).")
+            dest = mask_array[yoff:yoff + ys, xoff:xoff + xs] if mask_array is not None else None
+            if _threshold_and_count is not None and tile_in.dtype in THRESHOLD_DTYPES:
+                if dest is not None and dest.flags.c_contiguous: # Full-width windows: write in place
+                    target = dest
+                else:
+                    if tile_out is None or tile_out.shape != (ys, xs):
+                        tile_out = np.empty((ys, xs), dtype=np.uint8)
+                    target = tile_out
+                with _THRESHOLD_KERNEL_LOCK:
+                    pixels_above += _threshold_and_count(np.ascontiguousarray(tile_in).ravel(), threshold_value, target.ravel())
+                if dest is not None and target is not dest:
+                    dest[...] = target
+            else:
+                target = dest if dest is not None else np.empty((ys, xs), dtype=np.uint8)
+                np.greater_equal(tile_in, threshold_value, out=target, casting='unsafe')
+                # count_nonzero on the uint8 0/1 mask (not a bool view) is SIMD-specialized; sum would widen every byte
+                pixels_above += int(np.count_nonzero(target))
+            if temp_band is not None:
+                temp_band.WriteArray(target, xoff, yoff)
+
+        if mask_array is not None:
+            temp_ds = gdal_array.OpenArray(mask_array)
+            if temp_ds is None:
+                raise RuntimeError("Failed to wrap thresholded array as a raster dataset.")
+            temp_band = temp_ds.GetRasterBand(1)
+        temp_ds.SetGeoTransform(raster_ds.GetGeoTransform())
+        temp_ds.SetProjection(raster_ds.GetProjection())
+        temp_band.SetNoDataValue(0) # Pixels with 0 will not be polygonized
+    except (MemoryError, Exception) as e:
+        log_message(logger_queue, f"Error reading band {band_num}: {e}")
+        return None, 0, None
+    return temp_ds, pixels_above, mask_array
+
 def initial_polygonize_band(raster_ds, band_num, threshold_255, out_layer, layer_name, logger_queue=None, progress_callback=None):
     """Polygonizes a raster band based on a threshold and appends to out_layer."""
     log_message(logger_queue, f"--- Initial Polygonization: Band {band_num} ({layer_name}) ---") # layer_name now includes source raster
@@ -663,47 +1207,24 @@ def initial_polygonize_band(raster_ds, band_num, threshold_255, out_layer, layer
         log_message(logger_queue, f"Error: Could not get Band {band_num} from the raster.")
         return False
 
-    log_message(logger_queue, f"  Reading band {band_num} data...")
-    try:
-        band_array = band.ReadAsArray()
-        if band_array is None:
-            raise MemoryError(f"ReadAsArray returned None for band {band_num}. Check memory or GDAL limits.")
-    except (MemoryError, Exception) as e:
-        log_message(logger_queue, f"Error reading band {band_num}: {e}")
-        return False
-
     threshold_value = int(threshold_255)
-    log_message(logger_queue, f"  Applying confidence threshold >= {threshold_value} ({threshold_value/255.0*100:.1f}%)...")
-    thresholded_array = (band_array >= threshold_value).astype(np.uint8)
-    band_array = None 
-    pixels_above = np.sum(thresholded_array)
-
-    if pixels_above == 0:
-        log_message(logger_queue, f"  Warning: No pixels meet the confidence threshold >= {threshold_value} in current raster. No features added to '{layer_name}'.")
-        return True # Successful in the sense that no data met criteria
+    log_message(logger_queue, f"  Applying confidence threshold >= {threshold_value} ({threshold_value/255.0*100:.1f}%) to band {band_num}...")
+    mask_array = None # Backing buffer of a zero-copy MEM raster; must outlive Polygonize
+    temp_ds = _open_threshold_vrt(raster_ds, band_num, threshold_value)
+    if temp_ds is not None:
+        # GDAL thresholds each block lazily while Polygonize reads it; no mask raster is materialized and the band
+        # isn't read ahead of time just to count pixels (the feature delta below reports an empty result).
+        log_message(logger_queue, "  Thresholding on the fly through a VRT pixel function...")
     else:
+        temp_ds, pixels_above, mask_array = _threshold_band_to_mem(raster_ds, band, band_num, threshold_value, logger_queue)
+        if temp_ds is None:
+            return False
+        if pixels_above == 0:
+            log_message(logger_queue, f"  Warning: No pixels meet the confidence threshold >= {threshold_value} in current raster. No features added to '{layer_name}'.")
+            temp_ds = None
+            return True # Successful in the sense that no data met criteria
         log_message(logger_queue, f"  Found {pixels_above} pixels >= confidence threshold in current raster.")
-
-    log_message(logger_queue, "  Creating temporary thresholded raster in memory...")
-    mem_driver = gdal.GetDriverByName('MEM')
-    temp_ds = None
-    try:
-        temp_ds = mem_driver.Create('', raster_ds.RasterXSize, raster_ds.RasterYSize, 1, gdal.GDT_Byte)
-        if not temp_ds:
-            raise RuntimeError("Failed to create in-memory raster dataset.")
-        temp_ds.SetGeoTransform(raster_ds.GetGeoTransform())
-        temp_ds.SetProjection(raster_ds.GetProjection())
-        temp_band = temp_ds.GetRasterBand(1)
-        temp_band.WriteArray(thresholded_array)
-        thresholded_array = None 
-        temp_band.FlushCache()
-        temp_band.SetNoDataValue(0) # Pixels with 0 will not be polygonized
-
-    except Exception as e:
-        log_message(logger_queue, f"Error setting up temporary in-memory raster: {e}")
-        if temp_ds: temp_ds = None 
-        temp_band = None
-        return False
+    temp_band = temp_ds.GetRasterBand(1)
 
     log_message(logger_queue, "  Polygonizing (using 8-connectedness) into target layer...")
     dn_field_index = out_layer.GetLayerDefn().GetFieldIndex('DN')
@@ -714,13 +1235,15 @@ def initial_polygonize_band(raster_ds, band_num, threshold_255, out_layer, layer
 
     poly_opts = ['8CONNECTED=YES'] 
     # gdal.Polygonize appends to the layer by default if it's not a new layer.
-    # Mask band (second arg) is None to use the temp_band itself as mask implicitly with NoDataValue
+    # The mask band (second arg) is None for both the VRT and the MEM raster: temp_band's NoDataValue of 0 marks what to skip
     count_before = out_layer.GetFeatureCount()
+    flush_log(logger_queue)
     result = gdal.Polygonize(temp_band, None, out_layer, dn_field_index, poly_opts, callback=progress_callback)
     count_after = out_layer.GetFeatureCount()
 
     if temp_ds: temp_ds = None 
     temp_band = None
+    mask_array = None
 
     if result != 0:
         err_msg = gdal.GetLastErrorMsg()
@@ -728,14 +1251,165 @@ def initial_polygonize_band(raster_ds, band_num, threshold_255, out_layer, layer
             err_msg = f"Polygonize failed with error code {result}."
         log_message(logger_queue, f"Error during gdal.Polygonize: {err_msg}")
         return False
+    elif count_after == count_before:
+        log_message(logger_queue, f"  Warning: No pixels meet the confidence threshold >= {threshold_value} in current raster. No features added to '{layer_name}'.")
     else:
         log_message(logger_queue, f"  Polygonization added {count_after - count_before} features to '{layer_name}'.")
 
     log_message(logger_queue, f"--- Initial Polygonization for current raster's '{layer_name}' part finished in {time.time() - start_time:.2f}s ---")
     return True
 
+def polygonize_band_in_transaction(raster_ds, band_num, threshold_255, out_layer, layer_name, logger_queue=None):
+    """initial_polygonize_band() wrapped in a single layer transaction so the GPKG commits once per band."""
+    out_layer.StartTransaction()
+    try:
+        ok = initial_polygonize_band(raster_ds, band_num, threshold_255, out_layer, layer_name, logger_queue)
+    except Exception:
+        out_layer.RollbackTransaction()
+        raise
+    out_layer.CommitTransaction()
+    return ok
+
+# --- Per-Raster Worker Processes ---
+def _init_polygonize_worker():
+    """Process-pool initializer: exceptions on, and a smaller block cache since several workers run at once."""
+    gdal.UseExceptions()
+    ogr.UseExceptions()
+    gdal.SetCacheMax(512 << 20)
+    _load_optional_accelerators()
+
+def _polygonize_band_to_scratch(raster_path, band_num, threshold_255, target_wkt, layer_name, scratch_path, worker_log):
+    """Polygonizes one band into layer `layer_name` of its own scratch GeoPackage. Returns True on success.
+
+    Opens its own raster and output handles, so two bands of the same raster can run on separate threads.
+    """
+    raster_label = os.path.basename(raster_path)
+    raster_ds = scratch_ds = layer = None
+    try:
+        raster_ds = gdal.Open(raster_path, gdal.GA_ReadOnly)
+        if raster_ds is None:
+            raise RuntimeError(f"Could not open raster {raster_label} for polygonization.")
+        srs = osr.SpatialReference()
+        srs.ImportFromWkt(target_wkt)
+        scratch_ds = ogr.GetDriverByName('GPKG').CreateDataSource(scratch_path)
+        apply_gpkg_pragmas(scratch_ds, worker_log)
+        layer = scratch_ds.CreateLayer(layer_name, srs=srs, geom_type=ogr.wkbMultiPolygon)
+        layer.CreateField(ogr.FieldDefn('DN', ogr.OFTInteger))
+        return polygonize_band_in_transaction(raster_ds, band_num, threshold_255, layer,
+                                              f"{layer_name} (from {raster_label})", worker_log)
+    except Exception as e:
+        log_message(worker_log, f"Critical error processing band {band_num} of raster {raster_label}: {e}")
+        log_message(worker_log, traceback.format_exc())
+        return False
+    finally:
+        layer = None
+        scratch_ds = None
+        raster_ds = None
+
+def _polygonize_one(raster_idx, raster_path, threshold_255_roads, threshold_255_buildings, target_wkt, layer_names, scratch_dir):
+    """Worker: polygonizes bands 1 (roads) and 2 (buildings) of one raster into private scratch GeoPackages.
+
+    The two bands run on two threads (GDAL releases the GIL inside Polygonize), each writing its own file.
+    Returns (scratch_paths, roads_ok, buildings_ok, log_lines) where scratch_paths maps layer name -> file;
+    the parent replays log_lines in order.
+    """
+    band_jobs = ((1, threshold_255_roads, layer_names[0]), (2, threshold_255_buildings, layer_names[1]))
+    scratch_paths = {name: os.path.join(scratch_dir, f"part_{raster_idx:04d}_{name}.gpkg") for _, _, name in band_jobs}
+    band_logs = [queue.SimpleQueue() for _ in band_jobs] # One per thread so each band's lines stay together
+
+    with ThreadPoolExecutor(max_workers=len(band_jobs)) as band_executor:
+        futures = [
+            band_executor.submit(_polygonize_band_to_scratch, raster_path, band_num, threshold, target_wkt,
+                                 name, scratch_paths[name], band_log)
+            for (band_num, threshold, name), band_log in zip(band_jobs, band_logs)
+        ]
+        roads_ok, buildings_ok = (future.result() for future in futures)
+
+    log_lines = []
+    for band_log in band_logs:
+        while not band_log.empty():
+            log_lines.append(band_log.get())
+    return scratch_paths, roads_ok, buildings_ok, log_lines
+
+def polygonize_rasters_parallel(raster_paths, threshold_255_roads, threshold_255_buildings, target_wkt,
+                                output_gpkg_path, layer_names, logger_queue=None):
+    """Polygonizes each raster in its own worker process, then appends the scratch GeoPackages to output_gpkg_path.
+
+    The output must already contain `layer_names` and must not be held open by the caller. Returns (roads_ok, buildings_ok).
+    """
+    roads_ok = buildings_ok = True
+    scratch_paths = [None] * len(raster_paths)
+    scratch_dir = tempfile.mkdtemp(prefix='.polygonize_', dir=os.path.dirname(output_gpkg_path) or None)
+    try:
+        max_workers = min(len(raster_paths), os.cpu_count() or 1)
+        log_message(logger_queue, f"\n===== POLYGONIZING {len(raster_paths)} RASTERS IN {max_workers} WORKER PROCESSES =====")
+        flush_log(logger_queue)
+        # 'spawn' so workers don't inherit the GUI's Tk/GDAL thread state through fork()
+        with ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context('spawn'),
+                                 initializer=_init_polygonize_worker) as executor:
+            futures = {
+                executor.submit(_polygonize_one, idx, path, threshold_255_roads, threshold_255_buildings,
+                                target_wkt, tuple(layer_names), scratch_dir): idx
+                for idx, path in enumerate(raster_paths)
+            }
+            for future in as_completed(futures):
+                idx = futures[future]
+                raster_label = os.path.basename(raster_paths[idx])
+                log_message(logger_queue, f"\n===== PROCESSED RASTER {idx + 1}/{len(raster_paths)}: {raster_label} =====")
+                try:
+                    raster_scratch_paths, poly_ok_roads, poly_ok_buildings, log_lines = future.result()
+                except Exception as e:
+                    log_message(logger_queue, f"Critical error processing raster {raster_label}: {e}")
+                    roads_ok = buildings_ok = False
+                    continue
+                for line in log_lines:
+                    log_message(logger_queue, line)
+                if not poly_ok_roads:
+                    roads_ok = False
+                    log_message(logger_queue, f"Warning: Polygonization for roads failed for {raster_label}.")
+                if not poly_ok_buildings:
+                    buildings_ok = False
+                    log_message(logger_queue, f"Warning: Polygonization for buildings failed for {raster_label}.")
+                scratch_paths[idx] = raster_scratch_paths
+                flush_log(logger_queue)
+
+        # Merge in input order so feature order matches a serial run
+        log_message(logger_queue, "\nMerging per-raster results into the output GeoPackage...")
+        previous_journal = gdal.GetThreadLocalConfigOption('OGR_SQLITE_JOURNAL', None)
+        gdal.SetThreadLocalConfigOption('OGR_SQLITE_JOURNAL', 'MEMORY')
+        try:
+            merged_ds = gdal.OpenEx(output_gpkg_path, gdal.OF_VECTOR | gdal.OF_UPDATE) # One handle for every append
+            for idx, raster_scratch_paths in enumerate(scratch_paths):
+                if raster_scratch_paths is None:
+                    continue
+                for name in layer_names:
+                    scratch_path = raster_scratch_paths.get(name)
+                    if not scratch_path or not os.path.exists(scratch_path):
+                        continue
+                    try:
+                        # -gt commits 65536 features per transaction inside GDAL's own bulk insert loop
+                        # (no -skipfailures: it forces one transaction per feature)
+                        result = gdal.VectorTranslate(merged_ds, scratch_path, accessMode='append', layers=[name],
+                                                      geometryType='PROMOTE_TO_MULTI', options=['-gt', '65536'])
+                        if result is None:
+                            raise RuntimeError(gdal.GetLastErrorMsg() or "VectorTranslate returned no dataset")
+                    except Exception as e:
+                        log_message(logger_queue, f"Error merging '{name}' results for {os.path.basename(raster_paths[idx])}: {e}")
+                        roads_ok = buildings_ok = False
+        finally:
+            merged_ds = None # Closes (and flushes) the output before the journal mode is restored
+            gdal.SetThreadLocalConfigOption('OGR_SQLITE_JOURNAL', previous_journal)
+    finally:
+        shutil.rmtree(scratch_dir, ignore_errors=True)
+    return roads_ok, buildings_ok
+
 # --- Core Processing Function (Called by GUI Thread) ---
 def run_processing(params, logger_queue):
+    _load_optional_accelerators()
+    with BatchedLogger(logger_queue) as batched_queue:
+        return _run_processing(params, batched_queue)
+
+def _run_processing(params, logger_queue):
     log_message(logger_queue, "--- Starting Raster Vectorization ---")
 
     input_raster_paths = params['input_rasters'] # MODIFIED: Expects a list
@@ -824,7 +1498,8 @@ def run_processing(params, logger_queue):
         logger_queue.put("PROCESS_COMPLETE_FAILURE")
         return False
 
-    first_raster_ds_val = None # For validation only
+    first_raster_ds_val = None # Validation handle; kept open for the single-raster in-process run
+    open_rasters = {} # path -> dataset already opened during validation, reused by the processing loop
     target_srs = None
     first_raster_path_val = input_raster_paths[0]
 
@@ -839,6 +1514,7 @@ def run_processing(params, logger_queue):
             raise RuntimeError(f"Could not get a valid SRS from first raster: {os.path.basename(first_raster_path_val)}")
         
         target_srs = first_raster_info_val['srs'].Clone()
+        target_wkt = first_raster_info_val['projection_wkt'] # Identical WKT skips the OSR comparison below
         
         if first_raster_info_val['bands'] < 2:
             raise RuntimeError(f"Input raster {os.path.basename(first_raster_path_val)} needs at least 2 bands (Roads=1, Buildings=2). Found: {first_raster_info_val['bands']}")
@@ -861,7 +1537,8 @@ def run_processing(params, logger_queue):
                 if current_info_val['bands'] < 2:
                     raise RuntimeError(f"Input raster {os.path.basename(current_raster_path_val)} needs at least 2 bands. Found: {current_info_val['bands']}")
 
-                if not target_srs.IsSame(current_info_val['srs']):
+                # Textually different WKT can still describe the same SRS, so IsSame() decides only on a mismatch
+                if current_info_val['projection_wkt'] != target_wkt and not target_srs.IsSame(current_info_val['srs']):
                     srs1_name = target_srs.GetName() or target_srs.ExportToProj4() or "Unknown SRS 1"
                     srs2_name = current_info_val['srs'].GetName() or current_info_val['srs'].ExportToProj4() or "Unknown SRS 2"
                     log_message(logger_queue, f"Error: Projection mismatch detected!")
@@ -879,7 +1556,10 @@ def run_processing(params, logger_queue):
         logger_queue.put("PROCESS_COMPLETE_FAILURE")
         return False
     finally:
-        if first_raster_ds_val: first_raster_ds_val = None # Close the validation raster
+        if len(input_raster_paths) == 1 and first_raster_ds_val:
+            # Processing runs in this process and reopens nothing; worker processes open their own handles.
+            open_rasters[first_raster_path_val] = first_raster_ds_val
+        first_raster_ds_val = None
 
     # Warning for geographic CRS (using validated target_srs)
     if not target_srs or not target_srs.IsProjected():
@@ -908,6 +1588,7 @@ def run_processing(params, logger_queue):
         out_ds = gpkg_driver.CreateDataSource(output_gpkg_path)
         if out_ds is None:
             raise ogr.OGRError(f"Could not create GeoPackage datasource: {output_gpkg_path}")
+        apply_gpkg_pragmas(out_ds, logger_queue)
 
         dn_field = ogr.FieldDefn('DN', ogr.OFTInteger)
 
@@ -928,46 +1609,62 @@ def run_processing(params, logger_queue):
         all_poly_ok_roads = True
         all_poly_ok_buildings = True
 
-        for raster_idx, current_input_raster_path in enumerate(input_raster_paths):
-            log_message(logger_queue, f"\n===== PROCESSING RASTER {raster_idx + 1}/{len(input_raster_paths)}: {os.path.basename(current_input_raster_path)} =====")
-            current_raster_ds_proc = None # For processing this specific raster
-            try:
-                current_raster_ds_proc = gdal.Open(current_input_raster_path, gdal.GA_ReadOnly)
-                if current_raster_ds_proc is None:
-                    log_message(logger_queue, f"Error: Could not open raster {os.path.basename(current_input_raster_path)} for polygonization. Skipping this raster.")
-                    all_poly_ok_roads = False 
-                    all_poly_ok_buildings = False
-                    continue 
-
-                # === Polygonize Roads (Band 1) for current raster ===
-                if roads_layer:
-                    poly_ok_roads_current = initial_polygonize_band(
-                        current_raster_ds_proc, 1, threshold_255_roads, roads_layer, 
-                        f"{roads_layer_name} (from {os.path.basename(current_input_raster_path)})", logger_queue
-                    )
-                    if not poly_ok_roads_current:
-                        all_poly_ok_roads = False
-                        log_message(logger_queue, f"Warning: Polygonization for roads failed for {os.path.basename(current_input_raster_path)}.")
-                
-                # === Polygonize Buildings (Band 2) for current raster ===
-                if buildings_layer:
-                    poly_ok_buildings_current = initial_polygonize_band(
-                        current_raster_ds_proc, 2, threshold_255_buildings, buildings_layer, 
-                        f"{buildings_layer_name} (from {os.path.basename(current_input_raster_path)})", logger_queue
-                    )
-                    if not poly_ok_buildings_current:
+        if len(input_raster_paths) > 1:
+            # Rasters are independent: polygonize them in worker processes, then reopen the merged output.
+            roads_layer = None
+            buildings_layer = None
+            out_ds.FlushCache()
+            out_ds = None
+            all_poly_ok_roads, all_poly_ok_buildings = polygonize_rasters_parallel(
+                input_raster_paths, threshold_255_roads, threshold_255_buildings, target_srs.ExportToWkt(),
+                output_gpkg_path, (roads_layer_name, buildings_layer_name), logger_queue)
+            out_ds = ogr.Open(output_gpkg_path, 1)
+            if out_ds is None:
+                raise ogr.OGRError(f"Could not reopen GeoPackage after merging: {output_gpkg_path}")
+            apply_gpkg_pragmas(out_ds, logger_queue)
+            roads_layer = out_ds.GetLayerByName(roads_layer_name)
+            buildings_layer = out_ds.GetLayerByName(buildings_layer_name)
+        else:
+            for raster_idx, current_input_raster_path in enumerate(input_raster_paths):
+                log_message(logger_queue, f"\n===== PROCESSING RASTER {raster_idx + 1}/{len(input_raster_paths)}: {os.path.basename(current_input_raster_path)} =====")
+                current_raster_ds_proc = None # For processing this specific raster
+                try:
+                    current_raster_ds_proc = open_rasters.pop(current_input_raster_path, None) or gdal.Open(current_input_raster_path, gdal.GA_ReadOnly)
+                    if current_raster_ds_proc is None:
+                        log_message(logger_queue, f"Error: Could not open raster {os.path.basename(current_input_raster_path)} for polygonization. Skipping this raster.")
+                        all_poly_ok_roads = False 
                         all_poly_ok_buildings = False
-                        log_message(logger_queue, f"Warning: Polygonization for buildings failed for {os.path.basename(current_input_raster_path)}.")
-
-            except Exception as e_loop:
-                log_message(logger_queue, f"Critical error processing raster {os.path.basename(current_input_raster_path)}: {e_loop}")
-                log_message(logger_queue, traceback.format_exc())
-                all_poly_ok_roads = False # Mark as problematic if any raster fails critically
-                all_poly_ok_buildings = False
-            finally:
-                if current_raster_ds_proc:
-                    current_raster_ds_proc = None # Close dataset for current raster in loop
-                    log_message(logger_queue, f"Closed raster: {os.path.basename(current_input_raster_path)}")
+                        continue 
+
+                    # === Polygonize Roads (Band 1) for current raster ===
+                    if roads_layer:
+                        poly_ok_roads_current = polygonize_band_in_transaction(
+                            current_raster_ds_proc, 1, threshold_255_roads, roads_layer, 
+                            f"{roads_layer_name} (from {os.path.basename(current_input_raster_path)})", logger_queue
+                        )
+                        if not poly_ok_roads_current:
+                            all_poly_ok_roads = False
+                            log_message(logger_queue, f"Warning: Polygonization for roads failed for {os.path.basename(current_input_raster_path)}.")
+                
+                    # === Polygonize Buildings (Band 2) for current raster ===
+                    if buildings_layer:
+                        poly_ok_buildings_current = polygonize_band_in_transaction(
+                            current_raster_ds_proc, 2, threshold_255_buildings, buildings_layer, 
+                            f"{buildings_layer_name} (from {os.path.basename(current_input_raster_path)})", logger_queue
+                        )
+                        if not poly_ok_buildings_current:
+                            all_poly_ok_buildings = False
+                            log_message(logger_queue, f"Warning: Polygonization for buildings failed for {os.path.basename(current_input_raster_path)}.")
+
+                except Exception as e_loop:
+                    log_message(logger_queue, f"Critical error processing raster {os.path.basename(current_input_raster_path)}: {e_loop}")
+                    log_message(logger_queue, traceback.format_exc())
+                    all_poly_ok_roads = False # Mark as problematic if any raster fails critically
+                    all_poly_ok_buildings = False
+                finally:
+                    if current_raster_ds_proc:
+                        current_raster_ds_proc = None # Close dataset for current raster in loop
+                        log_message(logger_queue, f"Closed raster: {os.path.basename(current_input_raster_path)}")
         
         # --- MODIFIED: Global Post-Processing (after all rasters are merged into layers) ---
         
@@ -975,17 +1672,11 @@ def run_processing(params, logger_queue):
         if all_poly_ok_roads and roads_layer: # Check if layer exists
             if roads_layer.GetFeatureCount() > 0:
                 log_message(logger_queue, f"\n===== GLOBAL POST-PROCESSING FOR MERGED '{roads_layer_name}' LAYER =====")
-                simp_ok_r = simplify_layer(roads_layer, simplify_tolerance_roads, roads_layer_name, logger_queue)
-                area_ok_r = filter_layer_by_min_area(roads_layer, min_area_roads, roads_layer_name, logger_queue) if simp_ok_r else False
-                fix_geom_ok_r = fix_layer_geometries(roads_layer, roads_layer_name, logger_queue) if simp_ok_r and area_ok_r else False
-                smooth_ok_r = True
-                if chaikin_iterations_roads > 0:
-                    if simp_ok_r and area_ok_r and fix_geom_ok_r:
-                        smooth_ok_r = smooth_layer_chaikin(roads_layer, chaikin_iterations_roads, roads_layer_name, logger_queue)
-                    else:
-                        smooth_ok_r = False; log_message(logger_queue, "Skipping road Chaikin smoothing due to prior errors on merged layer.")
-                dn_ok_final_r = filter_layer_by_dn(roads_layer, 1, roads_layer_name, logger_queue) if simp_ok_r and area_ok_r and fix_geom_ok_r and smooth_ok_r else False
-                success_roads = simp_ok_r and area_ok_r and fix_geom_ok_r and smooth_ok_r and dn_ok_final_r
+                fused_ok_r = process_layer_fused(roads_layer, roads_layer_name, tolerance=simplify_tolerance_roads,
+                                                 min_area=min_area_roads, chaikin_iters=chaikin_iterations_roads,
+                                                 logger_queue=logger_queue)
+                dn_ok_final_r = filter_layer_by_dn(roads_layer, 1, roads_layer_name, logger_queue) if fused_ok_r else False
+                success_roads = fused_ok_r and dn_ok_final_r
             else: # Layer is empty after merging
                 log_message(logger_queue, f"Skipping global road post-processing: layer '{roads_layer_name}' is empty after merging all rasters.")
                 success_roads = True # Considered successful if layer is correctly empty
@@ -997,11 +1688,11 @@ def run_processing(params, logger_queue):
         if all_poly_ok_buildings and buildings_layer: # Check if layer exists
             if buildings_layer.GetFeatureCount() > 0:
                 log_message(logger_queue, f"\n===== GLOBAL POST-PROCESSING FOR MERGED '{buildings_layer_name}' LAYER =====")
-                simp_ok_b = simplify_layer(buildings_layer, simplify_tolerance_buildings, buildings_layer_name, logger_queue)
-                area_ok_b = filter_layer_by_min_area(buildings_layer, min_area_buildings, buildings_layer_name, logger_queue) if simp_ok_b else False
-                fix_geom_ok_b = fix_layer_geometries(buildings_layer, buildings_layer_name, logger_queue) if simp_ok_b and area_ok_b else False
-                dn_ok_b = filter_layer_by_dn(buildings_layer, 1, buildings_layer_name, logger_queue) if simp_ok_b and area_ok_b and fix_geom_ok_b else False
-                success_buildings = simp_ok_b and area_ok_b and fix_geom_ok_b and dn_ok_b
+                fused_ok_b = process_layer_fused(buildings_layer, buildings_layer_name, tolerance=simplify_tolerance_buildings,
+                                                 min_area=min_area_buildings, chaikin_iters=0,
+                                                 logger_queue=logger_queue)
+                dn_ok_b = filter_layer_by_dn(buildings_layer, 1, buildings_layer_name, logger_queue) if fused_ok_b else False
+                success_buildings = fused_ok_b and dn_ok_b
             else: # Layer is empty after merging
                 log_message(logger_queue, f"Skipping global building post-processing: layer '{buildings_layer_name}' is empty after merging all rasters.")
                 success_buildings = True
@@ -1020,6 +1711,7 @@ def run_processing(params, logger_queue):
         # Explicitly setting them to None first is good practice if they were handled separately.
         if roads_layer is not None: roads_layer = None
         if buildings_layer is not None: buildings_layer = None
+        open_rasters.clear() # Any validation handles not consumed by the processing loop
         if out_ds is not None:
             try:
                 out_ds.FlushCache() # Important
@@ -1091,6 +1783,7 @@ class VectorizationApp:
 
         self.conf_thresh_bldg_display_var = tk.StringVar(value=f"{self.conf_thresh_bldg_var.get():.1f}%")
         self.conf_thresh_road_display_var = tk.StringVar(value=f"{self.conf_thresh_road_var.get():.1f}%")
+        self._conf_display_text = {} # Last text set on each threshold display var, keyed by Tcl variable name
         self.log_queue = queue.Queue()
 
         main_frame = ttk.Frame(master, padding="10")
@@ -1152,6 +1845,8 @@ class VectorizationApp:
 
         self.run_button = ttk.Button(control_frame, text="Run Vectorization", command=self.start_processing)
         self.run_button.grid(row=0, column=0, pady=10) 
+        self.open_log_button = ttk.Button(control_frame, text="Open Full Log", command=self.open_full_log, state=tk.DISABLED)
+        self.open_log_button.grid(row=0, column=1, padx=5, pady=10)
 
         log_frame = ttk.LabelFrame(main_frame, text="Log", padding="10")
         log_frame.grid(row=3, column=0, columnspan=2, sticky=(tk.W, tk.E, tk.N, tk.S))
@@ -1160,11 +1855,14 @@ class VectorizationApp:
 
         self.log_text = scrolledtext.ScrolledText(log_frame, wrap=tk.WORD, height=15, state='disabled', font=("TkFixedFont", 9))
         self.log_text.grid(row=0, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
+        # The widget only keeps the last LOG_MAX_LINES lines; every line of a run also goes to this file
+        self.run_log_path = None
+        self.run_log_file = None
         self.master.after(100, self.process_log_queue)
 
     def _create_settings_widgets(self, parent_frame, conf_thresh_var, conf_thresh_display_var, simplify_var, min_area_var, chaikin_var=None):
         ttk.Label(parent_frame, text="Confidence Thr. (%):").grid(row=0, column=0, sticky=tk.W, padx=5, pady=3)
-        conf_thresh_scale = ttk.Scale(parent_frame, from_=0, to=100, orient=tk.HORIZONTAL, variable=conf_thresh_var, command=lambda v, tv=conf_thresh_display_var: tv.set(f"{float(v):.1f}%"))
+        conf_thresh_scale = ttk.Scale(parent_frame, from_=0, to=100, orient=tk.HORIZONTAL, variable=conf_thresh_var, command=lambda v, tv=conf_thresh_display_var: self._update_conf_display(v, tv))
         conf_thresh_scale.grid(row=0, column=1, sticky=(tk.W, tk.E), padx=5, pady=3)
         conf_thresh_label = ttk.Label(parent_frame, textvariable=conf_thresh_display_var, width=7)
         conf_thresh_label.grid(row=0, column=2, sticky=tk.W, padx=5, pady=3)
@@ -1183,6 +1881,14 @@ class VectorizationApp:
             chaikin_spinbox = ttk.Spinbox(parent_frame, from_=0, to=20, increment=1, textvariable=chaikin_var, width=8, wrap=False)
             chaikin_spinbox.grid(row=widget_row, column=1, columnspan=2, sticky=tk.W, padx=5, pady=3)
 
+    def _update_conf_display(self, value, display_var):
+        # The scale fires on every pixel of drag; only touch Tk when the 1-decimal text actually changes
+        text = f"{float(value):.1f}%"
+        key = str(display_var)
+        if self._conf_display_text.get(key) != text:
+            self._conf_display_text[key] = text
+            display_var.set(text)
+
     # MODIFIED: browse_input to browse_input_rasters for multiple files
     def browse_input_rasters(self):
         filepaths = filedialog.askopenfilenames(
@@ -1208,29 +1914,81 @@ class VectorizationApp:
             self.output_dir_var.set(dirpath)
 
     def log(self, message):
+        text = str(message) + '\n'
+        if self.run_log_file is not None:
+            try:
+                self.run_log_file.write(text)
+                self.run_log_file.flush()
+            except OSError:
+                self._close_run_log()
+        at_bottom = self.log_text.yview()[1] >= 0.99 # Don't yank the view away from a user reading older lines
         self.log_text.configure(state='normal')
-        self.log_text.insert(tk.END, str(message) + '\n')
+        self.log_text.insert(tk.END, text)
+        num_lines = int(self.log_text.index('end-1c').split('.')[0])
+        if num_lines > LOG_MAX_LINES: # Tk Text slows down as it grows, keep only the tail
+            self.log_text.delete('1.0', f'{num_lines - LOG_MAX_LINES}.0')
         self.log_text.configure(state='disabled')
-        self.log_text.see(tk.END)
+        if at_bottom:
+            self.log_text.see(tk.END)
+
+    def _open_run_log(self, output_dir, output_name):
+        self._close_run_log()
+        path = os.path.join(output_dir, os.path.splitext(output_name)[0] + "_run.log")
+        try:
+            self.run_log_file = open(path, 'w', encoding='utf-8')
+        except OSError as e:
+            self.log(f"Warning: Could not create run log file '{path}': {e}")
+            return
+        self.run_log_path = path
+        self.open_log_button.config(state=tk.NORMAL)
+
+    def _close_run_log(self):
+        if self.run_log_file is not None:
+            try:
+                self.run_log_file.close()
+            except OSError:
+                pass
+            self.run_log_file = None
+
+    def open_full_log(self):
+        if not self.run_log_path or not os.path.isfile(self.run_log_path):
+            messagebox.showerror("Log Error", "No run log file is available yet.")
+            return
+        if hasattr(os, 'startfile'): # Windows: default editor for .log
+            os.startfile(self.run_log_path)
+        else:
+            webbrowser.open('file://' + os.path.abspath(self.run_log_path))
 
     def process_log_queue(self):
+        # Everything drained in one tick goes into the widget with a single insert
+        parts = []
+        drained = False
         try:
             while True: 
                 msg = self.log_queue.get_nowait()
-                if msg == "PROCESS_COMPLETE_SUCCESS":
+                drained = True
+                if msg in CONTROL_MESSAGES:
+                    if parts: # Lines queued before the sentinel are shown before its message
+                        self.log("\n".join(parts))
+                        parts = []
                     self.run_button.config(state=tk.NORMAL)
-                    self.log(">>> Process completed successfully!")
-                    messagebox.showinfo("Success", "Vectorization process completed successfully!")
-                elif msg == "PROCESS_COMPLETE_FAILURE":
-                    self.run_button.config(state=tk.NORMAL)
-                    self.log(">>> Process failed or completed with errors.")
-                    messagebox.showerror("Failure", "Vectorization process failed or completed with errors. Check log.")
+                    if msg == "PROCESS_COMPLETE_SUCCESS":
+                        self.log(">>> Process completed successfully!")
+                        self._close_run_log()
+                        messagebox.showinfo("Success", "Vectorization process completed successfully!")
+                    else:
+                        self.log(">>> Process failed or completed with errors.")
+                        self._close_run_log()
+                        messagebox.showerror("Failure", "Vectorization process failed or completed with errors. Check log.")
                 else:
-                    self.log(msg)
+                    parts.append(str(msg))
         except queue.Empty:
             pass
         finally:
-            self.master.after(100, self.process_log_queue)
+            if parts:
+                self.log("\n".join(parts))
+            # Poll faster while messages are flowing, back off when idle
+            self.master.after(50 if drained else 100, self.process_log_queue)
 
     def validate_inputs(self):
         # MODIFIED: Validate list of input rasters
@@ -1242,40 +2000,44 @@ class VectorizationApp:
                 messagebox.showerror("Input Error", f"Invalid input raster file: {path}")
                 return False
         
-        if not self.output_dir_var.get():
+        output_dir = self.output_dir_var.get()
+        if not output_dir:
             messagebox.showerror("Input Error", "Please select an output directory.")
             return False
-        elif not os.path.isdir(self.output_dir_var.get()):
-            if messagebox.askyesno("Create Directory?", f"Output directory '{self.output_dir_var.get()}' does not exist.\nCreate it?"):
+        elif not os.path.isdir(output_dir):
+            if messagebox.askyesno("Create Directory?", f"Output directory '{output_dir}' does not exist.\nCreate it?"):
                 try:
-                    os.makedirs(self.output_dir_var.get(), exist_ok=True)
+                    os.makedirs(output_dir, exist_ok=True)
                 except Exception as e:
                     messagebox.showerror("Directory Error", f"Could not create output directory:\n{e}")
                     return False
             else:
                 return False
 
-        if not self.output_name_var.get().strip():
+        output_name = self.output_name_var.get()
+        if not output_name.strip():
             messagebox.showerror("Input Error", "Output filename cannot be empty.")
             return False
-        if not self.output_name_var.get().lower().endswith(".gpkg"):
+        if not output_name.lower().endswith(".gpkg"):
             if not messagebox.askyesno("Filename Warning", "Output filename does not end with '.gpkg'.\nThis might cause issues with GeoPackage drivers.\nContinue anyway?"):
                 return False
         try:
-            float(self.simplify_bldg_var.get())
-            float(self.min_area_bldg_var.get())
-            float(self.simplify_road_var.get())
-            float(self.min_area_road_var.get())
-            int(self.smooth_roads_chaikin_var.get())
-
-            if any(v.get() < 0 for v in [self.simplify_bldg_var, self.min_area_bldg_var,
-                                          self.simplify_road_var, self.min_area_road_var, self.smooth_roads_chaikin_var]):
+            # Read each Tk variable once (every .get() is a Tcl round trip) and validate the cached values
+            simplify_bldg = float(self.simplify_bldg_var.get())
+            min_area_bldg = float(self.min_area_bldg_var.get())
+            simplify_road = float(self.simplify_road_var.get())
+            min_area_road = float(self.min_area_road_var.get())
+            chaikin_iters = int(self.smooth_roads_chaikin_var.get())
+            conf_thresh_bldg = self.conf_thresh_bldg_var.get()
+            conf_thresh_road = self.conf_thresh_road_var.get()
+
+            if any(v < 0 for v in (simplify_bldg, min_area_bldg, simplify_road, min_area_road, chaikin_iters)):
                 raise ValueError("Numeric parameters cannot be negative.")
-            if not (0 <= self.conf_thresh_bldg_var.get() <= 100):
+            if not (0 <= conf_thresh_bldg <= 100):
                 raise ValueError("Building confidence threshold must be between 0 and 100.")
-            if not (0 <= self.conf_thresh_road_var.get() <= 100):
+            if not (0 <= conf_thresh_road <= 100):
                 raise ValueError("Road confidence threshold must be between 0 and 100.")
-        except ValueError as e:
+        except (ValueError, tk.TclError) as e:
             messagebox.showerror("Input Error", f"Invalid numeric input: {e}\nPlease enter valid numbers.")
             return False
         return True
@@ -1287,6 +2049,7 @@ class VectorizationApp:
         self.log_text.configure(state='normal')
         self.log_text.delete(1.0, tk.END)
         self.log_text.configure(state='disabled')
+        self._open_run_log(self.output_dir_var.get(), self.output_name_var.get())
         self.log("Starting processing thread...")
         self.master.update_idletasks()
 
@@ -0,0 +1,133 @@
+"""Numba kernels for the timelapse tools (harmonizer.py, harmonizer2.py, timelapse_processor.py).
+
+Same conventions as dataviz/_numba_kernels.py: every kernel has explicit signatures and cache=True, so it is
+compiled when this module is first imported and later runs load it from __pycache__. Importing this module raises
+ImportError when Numba isn't installed; callers fall back to their NumPy code paths.
+"""
+import numpy as np
+from numba import njit, prange
+
+# Pixel types the histogram kernel is compiled for
+HIST_DTYPES = (np.uint8, np.uint16)
+
+@njit(['i8[:, ::1](u1[:, :, ::1], i8, i8)',
+       'i8[:, ::1](u2[:, :, ::1], i8, i8)'],
+      parallel=True, cache=True)
+def channel_histograms(image, bins, shift):
+    """Per-channel counts of (value >> shift) for a C-contiguous (channels, rows, cols) image; values past `bins` are ignored."""
+    channels, rows, cols = image.shape
+    out = np.zeros((channels, bins), np.int64)
+    for c in prange(channels):
+        for r in range(rows):
+            for x in range(cols):
+                b = image[c, r, x] >> shift
+                if b < bins:
+                    out[c, b] += 1
+    return out
+
+@njit(['i8[:, ::1](u1[:, :, ::1], i8)',
+       'i8[:, ::1](u2[:, :, ::1], i8)'],
+      parallel=True, cache=True)
+def channel_cdfs(image, nbins):
+    """Per-channel cumulative counts (unnormalized CDFs) of a C-contiguous (channels, rows, cols) image over `nbins` values."""
+    channels, rows, cols = image.shape
+    out = np.zeros((channels, nbins), np.int64)
+    for c in prange(channels):
+        for r in range(rows):
+            for x in range(cols):
+                out[c, image[c, r, x]] += 1
+        acc = 0
+        for i in range(nbins): # Prefix sum in place, in the same call as the counting
+            acc += out[c, i]
+            out[c, i] = acc
+    return out
+
+@njit(['void(u1[:, :, ::1], u1[:, ::1], u1[:, :, ::1])',
+       'void(u2[:, :, ::1], u2[:, ::1], u2[:, :, ::1])',
+       'void(u2[:, :, ::1], u1[:, ::1], u1[:, :, ::1])'],
+      parallel=True, cache=True)
+def apply_channel_luts(image, luts, out):
+    """out[c, r, x] = luts[c, image[c, r, x]] for C-contiguous (channels, rows, cols) arrays, rows in parallel."""
+    channels, rows, cols = image.shape
+    # One parallel region over rows (not one per channel); each thread walks every channel's LUT for its rows
+    for r in prange(rows):
+        for c in range(channels):
+            for x in range(cols):
+                out[c, r, x] = luts[c, image[c, r, x]]
+
+@njit(['void(u1[:, :, ::1], f8, f8, f8, f8, u1[:, :, ::1])',
+       'void(u2[:, :, ::1], f8, f8, f8, f8, u2[:, :, ::1])'],
+      parallel=True, fastmath=True, cache=True)
+def grade_hsv(image, hue_shift, sat_scale, val_scale, max_val, out):
+    """
+    HSV grading of the RGB channels (0-2) of a C-contiguous (channels, rows, cols) image into `out`, rows in parallel.
+
+    Each pixel goes RGB -> HSV, hue is rotated by `hue_shift` (fraction of a turn), saturation and value are scaled
+    and clipped to [0, 1], and it comes back to RGB, all in registers. `max_val` is the dtype's full-scale value
+    (255 or 65535). Extra channels are copied; `out` may be `image`.
+    """
+    channels, rows, cols = image.shape
+    scale = 1.0 / max_val
+    for y in prange(rows):
+        for x in range(cols):
+            r = image[0, y, x] * scale
+            g = image[1, y, x] * scale
+            b = image[2, y, x] * scale
+            mx = max(r, g, b)
+            delta = mx - min(r, g, b)
+            h = 0.0
+            if delta > 0.0:
+                if mx == r:
+                    h = ((g - b) / delta) % 6.0
+                elif mx == g:
+                    h = (b - r) / delta + 2.0
+                else:
+                    h = (r - g) / delta + 4.0
+                h /= 6.0
+            s = delta / mx if mx > 0.0 else 0.0
+            h = (h + hue_shift) % 1.0
+            s = min(max(s * sat_scale, 0.0), 1.0)
+            v = min(max(mx * val_scale, 0.0), 1.0)
+
+            h6 = h * 6.0
+            sector = int(h6)
+            f = h6 - sector
+            p = v * (1.0 - s)
+            q = v * (1.0 - s * f)
+            t = v * (1.0 - s * (1.0 - f))
+            sector %= 6 # h6 can round up to 6.0, which is sector 0 again
+            if sector == 0:
+                r, g, b = v, t, p
+            elif sector == 1:
+                r, g, b = q, v, p
+            elif sector == 2:
+                r, g, b = p, v, t
+            elif sector == 3:
+                r, g, b = p, q, v
+            elif sector == 4:
+                r, g, b = t, p, v
+            else:
+                r, g, b = v, p, q
+            out[0, y, x] = int(r * max_val + 0.5)
+            out[1, y, x] = int(g * max_val + 0.5)
+            out[2, y, x] = int(b * max_val + 0.5)
+            for c in range(3, channels):
+                out[c, y, x] = image[c, y, x]
+
+@njit(['void(u2[:, :, ::1], f8, f8, u1[:, :, ::1])'], cache=True)
+def minmax_to_u8_bgr(src, lo, scale, out):
+    """
+    Min-max stretch of a C-contiguous (rows, cols, channels) image straight into uint8 (rows, cols, 3) BGR, in
+    one pass: out = round((src - lo) * scale). One channel is replicated to B, G, R; a 4th (alpha) is dropped.
+    Used by timelapse_processor.py in place of normalize + astype + cvtColor.
+
+    Serial on purpose: frames are already converted on a thread pool, and concurrent launches of a parallel
+    kernel abort the process under Numba's default 'workqueue' threading layer.
+    """
+    rows, cols, channels = src.shape
+    for y in range(rows):
+        for x in range(cols):
+            for k in range(3):
+                c = k if channels >= 3 else 0
+                v = int((src[y, x, c] - lo) * scale + 0.5)
+                out[y, x, k] = min(max(v, 0), 255)
@@ -1,16 +1,54 @@
 import os
 import numpy as np
-import rasterio
-from skimage.exposure import match_histograms
-from multiprocessing import Pool
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import logging
 
+try:
+    import cv2 # Optional: SIMD byte gather for applying uint8 LUTs
+except ImportError:
+    cv2 = None
+
+# rasterio (GDAL) is imported inside the functions that read/write rasters, so the folder prompts come up
+# without waiting for it to load.
+
 # Suppress NotGeoreferencedWarning from rasterio
 logging.getLogger('rasterio').setLevel(logging.ERROR)
 
-def compute_histogram(image, channel, bins, range_min, range_max):
-    """Compute histogram for a single channel."""
-    return np.histogram(image[channel], bins=bins, range=(range_min, range_max))[0]
+# Histograms only need the distribution shape, so Step 3 reads each image decimated to at most this many pixels per side
+HIST_READ_SIZE = 512
+
+# Creation options for the corrected GeoTIFFs: 512x512 LZW tiles with horizontal differencing
+OUTPUT_PROFILE = dict(tiled=True, blockxsize=512, blockysize=512, compress='lzw', predictor=2, BIGTIFF='IF_SAFER')
+
+# process_image streams each image through in strips of this many rows (one row of output tiles at a time)
+STREAM_ROWS = OUTPUT_PROFILE['blockysize']
+
+# Reference CDFs built in this worker from the shared reference image: (segment name, [(values, quantiles) per channel])
+_REF = None
+
+def compute_histogram(image, channel, bins, shift):
+    """Compute histogram for a single channel (integer pixel values right-shifted by `shift` into `bins` bins)."""
+    return np.bincount((image[channel].ravel() >> shift), minlength=bins)[:bins]
+
+def _hist_worker(path_bins_shift):
+    """Read one image (decimated to HIST_READ_SIZE) and return (path, [histogram per channel]) for the histogram pass."""
+    import rasterio
+    from rasterio.enums import Resampling
+    path, bins, shift = path_bins_shift
+    with rasterio.open(path) as src:
+        out_shape = (src.count, min(HIST_READ_SIZE, src.height), min(HIST_READ_SIZE, src.width))
+        image = src.read(out_shape=out_shape, resampling=Resampling.average)
+    if image.shape[0] != 3:
+        raise ValueError(f"Image {os.path.basename(path)} has {image.shape[0]} bands, expected 3 (RGB).")
+    # Optional: precompiled Numba kernel (_timelapse_kernels.py next to this script) counts all channels in one pass
+    try:
+        from _timelapse_kernels import HIST_DTYPES, channel_histograms
+    except ImportError:
+        channel_histograms = None
+    if channel_histograms is not None and image.dtype in HIST_DTYPES:
+        return path, channel_histograms(np.ascontiguousarray(image), bins, shift)
+    return path, [compute_histogram(image, c, bins, shift) for c in range(image.shape[0])]
 
 def get_valid_folder(prompt, must_exist=True):
     """Prompt for a folder path and validate it."""
@@ -36,32 +74,86 @@ def get_tif_files(input_folder):
         raise ValueError(f"No TIF files found in '{input_folder}'.")
     return tif_files
 
+def _channel_counts(channel):
+    """Per-value pixel counts of one integer channel over its dtype's full value range."""
+    return np.bincount(channel.ravel(), minlength=np.iinfo(channel.dtype).max + 1)
+
+def _reference_cdfs(ref_image):
+    """Per-channel (values, quantiles) of the reference: its distinct pixel values and their cumulative share."""
+    cdfs = []
+    for c in range(ref_image.shape[0]):
+        counts = _channel_counts(ref_image[c])
+        values = np.flatnonzero(counts)
+        cdfs.append((values, np.cumsum(counts[values]) / ref_image[c].size))
+    return cdfs
+
+def _match_lut(counts, ref_values, ref_quantiles, dtype):
+    """Lookup table mapping every source value (given its per-value `counts`) to the reference value at the same quantile.
+
+    Same result as skimage's match_histograms for integer images.
+    """
+    src_quantiles = np.cumsum(counts) / counts.sum()
+    return np.interp(src_quantiles, ref_quantiles, ref_values).astype(dtype)
+
+def _attach_reference(shm_name, shape, dtype):
+    """Return the reference CDFs, building them from the shared-memory reference once per worker process."""
+    global _REF
+    if _REF is None or _REF[0] != shm_name:
+        shm = shared_memory.SharedMemory(name=shm_name)
+        try:
+            cdfs = _reference_cdfs(np.ndarray(shape, dtype=dtype, buffer=shm.buf))
+        finally:
+            shm.close()  # The CDFs are all the worker needs; drop the mapping
+        _REF = (shm_name, cdfs)
+    return _REF[1]
+
 def process_image(args):
-    """Process a single image: read, match histograms, and save."""
-    input_path, output_path, ref_image, dtype = args
+    """Process a single image: read, match histograms against the shared reference, and save."""
+    import rasterio
+    from rasterio.windows import Window
+    input_path, output_path, (shm_name, ref_shape, dtype) = args
     try:
+        ref_cdfs = _attach_reference(shm_name, ref_shape, dtype)
         with rasterio.open(input_path) as src:
-            image = src.read()
             meta = src.meta.copy()
             # Verify 3 bands (RGB)
-            if image.shape[0] != 3:
-                raise ValueError(f"Image {os.path.basename(input_path)} has {image.shape[0]} bands, expected 3 (RGB).")
-            # Apply histogram matching
-            corrected_image = match_histograms(
-                image, ref_image, channel_axis=0
-            ).astype(dtype)
-            # Verify output has 3 bands
-            if corrected_image.shape[0] != 3:
-                raise ValueError(f"Corrected image {os.path.basename(input_path)} has {corrected_image.shape[0]} bands, expected 3 (RGB).")
-            # Update metadata to ensure RGB
-            meta.update(photometric='RGB', count=3)
+            if src.count != 3:
+                raise ValueError(f"Image {os.path.basename(input_path)} has {src.count} bands, expected 3 (RGB).")
+            # Only one strip of pixels is held in memory at a time
+            windows = [Window(0, row, src.width, min(STREAM_ROWS, src.height - row)) for row in range(0, src.height, STREAM_ROWS)]
+
+            # Pass 1: per-channel value counts of the whole image
+            counts = np.zeros((3, np.iinfo(src.dtypes[0]).max + 1), dtype=np.int64)
+            for window in windows:
+                block = src.read(window=window)
+                for c in range(3):
+                    counts[c] += _channel_counts(block[c])
+
+            # Histogram matching: one quantile-mapping LUT per channel, applied as a gather
+            luts = [_match_lut(counts[c], *ref_cdfs[c], dtype) for c in range(3)]
+            use_cv2 = cv2 is not None and np.dtype(src.dtypes[0]) == np.uint8 and luts[0].dtype == np.uint8
+
+            # Pass 2: map and write each strip; update metadata to ensure RGB
+            meta.update(photometric='RGB', count=3, **OUTPUT_PROFILE)
             with rasterio.open(output_path, 'w', **meta) as dst:
-                dst.write(corrected_image)
+                # One output strip buffer for every window; the LUTs are already in `dtype`, so nothing is cast or copied
+                corrected = np.empty((3, STREAM_ROWS, src.width), dtype=dtype)
+                for window in windows:
+                    block = src.read(window=window)
+                    corrected_block = corrected[:, :window.height]
+                    for c in range(3):
+                        if use_cv2:
+                            cv2.LUT(block[c], luts[c], dst=corrected_block[c])
+                        else:
+                            # Full 65536-entry LUT for uint16; gathered straight into the output view (no temporary)
+                            np.take(luts[c], block[c], out=corrected_block[c], mode='clip')
+                    dst.write(corrected_block, window=window)
         return os.path.basename(input_path)
     except Exception as e:
         return f"Error processing {os.path.basename(input_path)}: {str(e)}"
 
 def main(input_folder, output_folder, num_workers=10):
+    import rasterio
     # Step 1: List all TIF files
     tif_files = get_tif_files(input_folder)
     file_paths = [os.path.join(input_folder, f) for f in tif_files]
@@ -78,73 +170,72 @@ def main(input_folder, output_folder, num_workers=10):
         dtype = sample_image.dtype
         if dtype == np.uint8:
             bins = 256
-            hist_range = (0, 255)
+            shift = 0
         elif dtype == np.uint16:
             bins = 256  # Reduced for efficiency; adjust if needed
-            hist_range = (0, 65535)
+            shift = 8   # Top 8 bits select the bin
         else:
             raise ValueError(f"Unsupported data type: {dtype}")
 
-    # Step 3: Compute histograms for each image and channel (sequential)
-    histograms = {c: [] for c in range(num_channels)}
-    for path in file_paths:
-        with rasterio.open(path) as src:
-            image = src.read()
-            if image.shape[0] != 3:
-                raise ValueError(f"Image {os.path.basename(path)} has {image.shape[0]} bands, expected 3 (RGB).")
-            for c in range(num_channels):
-                hist = compute_histogram(image, c, bins, *hist_range)
-                histograms[c].append(hist)
-
-    # Step 4: Compute average histogram for each channel
-    avg_histograms = {}
-    for c in range(num_channels):
-        avg_histograms[c] = np.mean(histograms[c], axis=0)
-
-    # Step 5: Find the reference image (closest to average histogram)
-    distances = []
-    for idx, path in enumerate(file_paths):
-        dist = 0
-        for c in range(num_channels):
-            hist = histograms[c][idx]
-            avg_hist = avg_histograms[c]
-            dist += np.sum((hist - avg_hist) ** 2)  # L2 distance
-        distances.append(dist)
-    
-    ref_idx = np.argmin(distances)
-    ref_path = file_paths[ref_idx]
-    print(f"Selected reference image: {os.path.basename(ref_path)}")
-
-    # Step 6: Read the reference image
-    with rasterio.open(ref_path) as src:
-        ref_image = src.read()
-        if ref_image.shape[0] != 3:
-            raise ValueError(f"Reference image {os.path.basename(ref_path)} has {ref_image.shape[0]} bands, expected 3 (RGB).")
-
-    # Step 7: Create output folder if it doesn't exist
-    if not os.path.exists(output_folder):
-        os.makedirs(output_folder)
-        print(f"Created output folder: {output_folder}")
-
-    # Step 8: Prepare tasks for parallel processing
-    tasks = [
-        (
-            path,
-            os.path.join(output_folder, os.path.basename(path)),
-            ref_image,
-            dtype
-        )
-        for path in file_paths
-    ]
-
-    # Step 9: Process images in parallel
-    print(f"Processing {num_images} images using {num_workers} workers...")
-    with Pool(processes=num_workers) as pool:
-        results = pool.map(process_image, tasks)
-    
-    # Step 10: Report results
-    for result in results:
-        print(f"Processed and saved: {result}" if not result.startswith("Error") else result)
+    # One worker pool serves both the histogram pass (Step 3) and the matching pass (Step 9)
+    with ProcessPoolExecutor(max_workers=num_workers) as pool:
+        # Step 3: Compute histograms for each image and channel (parallel, results in file order)
+        hists = np.empty((num_images, num_channels, bins), dtype=np.int64)
+        chunksize = max(1, num_images // (4 * num_workers)) # Several files per IPC round trip, still ~4 chunks per worker
+        for idx, (path, channel_hists) in enumerate(pool.map(_hist_worker, [(p, bins, shift) for p in file_paths], chunksize=chunksize)):
+            hists[idx] = channel_hists
+
+        # Step 4: Compute the summed histogram for each channel (the average scaled by num_images)
+        total_hist = hists.sum(axis=0)
+
+        # Step 5: Find the reference image (closest to average histogram, L2 distance over all channels).
+        # Both sides are scaled by num_images (same argmin as against the average) and computed in float64,
+        # so large frame counts can't wrap around the way the squared int64 differences would.
+        distances = ((hists.astype(np.float64) * num_images - total_hist) ** 2).sum(axis=(1, 2))
+        ref_idx = int(np.argmin(distances))
+        ref_path = file_paths[ref_idx]
+        print(f"Selected reference image: {os.path.basename(ref_path)}")
+
+        # Step 6: Read the reference image (the Step 2 sample is already decoded when it was chosen)
+        if ref_idx == 0:
+            ref_image = sample_image
+        else:
+            with rasterio.open(ref_path) as src:
+                ref_image = src.read()
+                if ref_image.shape[0] != 3:
+                    raise ValueError(f"Reference image {os.path.basename(ref_path)} has {ref_image.shape[0]} bands, expected 3 (RGB).")
+        del sample_image  # Only the reference is needed from here on
+
+        # Step 7: Create output folder if it doesn't exist
+        if not os.path.exists(output_folder):
+            os.makedirs(output_folder)
+            print(f"Created output folder: {output_folder}")
+
+        # Step 8: Publish the reference once in shared memory; tasks only carry its name, shape and dtype
+        ref_shm = shared_memory.SharedMemory(create=True, size=ref_image.nbytes)
+        try:
+            np.ndarray(ref_image.shape, dtype=ref_image.dtype, buffer=ref_shm.buf)[...] = ref_image
+            ref_spec = (ref_shm.name, ref_image.shape, ref_image.dtype.str)
+            del ref_image
+            tasks = [
+                (
+                    path,
+                    os.path.join(output_folder, os.path.basename(path)),
+                    ref_spec
+                )
+                for path in file_paths
+            ]
+
+            # Step 9: Process images in parallel
+            # Step 10: Report each result as soon as its worker finishes (completion order, not file order)
+            print(f"Processing {num_images} images using {num_workers} workers...")
+            futures = [pool.submit(process_image, task) for task in tasks]
+            for i, future in enumerate(as_completed(futures), 1):
+                result = future.result()
+                print(f"[{i}/{num_images}] " + (f"Processed and saved: {result}" if not result.startswith("Error") else result))
+        finally:
+            ref_shm.close()
+            ref_shm.unlink()
 
     print("Color harmonization completed.")
 
@@ -2,17 +2,64 @@ import os
 import sys
 import numpy as np
 import rasterio
-from rasterio.enums import Photometric # For JPEG
-from skimage.exposure import match_histograms
-# from skimage.color import rgb2hsv, hsv2rgb, rgb2lab, lab2rgb # Imports depend on process_image
+from rasterio.enums import Resampling
+from rasterio.windows import Window
 from multiprocessing import Pool, cpu_count
 from tqdm import tqdm
+from tqdm.contrib.logging import logging_redirect_tqdm
 import logging
 import shutil # For copying reference image if needed
+import hashlib
+from contextlib import nullcontext
+from xml.sax.saxutils import escape as xml_escape
+
+try:
+    import cv2 # Optional: libjpeg-turbo JPEG encoding without a GDAL JPEG dataset
+except ImportError:
+    cv2 = None
+
+try:
+    from skimage.color import rgb2hsv, hsv2rgb # Optional: color grading fallback when Numba isn't installed
+except ImportError:
+    rgb2hsv = hsv2rgb = None
+
+# Optional: precompiled Numba kernels (_timelapse_kernels.py next to this script) for applying matching LUTs
+try:
+    from _timelapse_kernels import apply_channel_luts as _apply_channel_luts
+    from _timelapse_kernels import channel_histograms as _channel_histograms, HIST_DTYPES as _HIST_DTYPES
+    from _timelapse_kernels import channel_cdfs as _channel_cdfs, grade_hsv as _grade_hsv
+except ImportError:
+    _apply_channel_luts = _channel_histograms = _channel_cdfs = _grade_hsv = None
+    _HIST_DTYPES = ()
 
 # Suppress NotGeoreferencedWarning from rasterio
 logging.getLogger('rasterio').setLevel(logging.ERROR)
 
+LUT_SAMPLE_SIZE = 512 # Per-image matching LUTs are built from a read decimated to at most this many pixels per side
+STRIP_ROWS = 256      # Rows per window when streaming an untiled (striped) input
+TIF_TILE_SIZE = 256   # Tile size for GeoTIFF output
+HIST_TARGET_PIXELS = 1_000_000 # Reference-selection histograms read each image decimated to about this many pixels
+
+# Largest per-band CDF difference (KS statistic) at which an image is treated as already matching the reference
+KS_IDENTITY_THRESHOLD = 1e-3
+# Source extensions that can be copied as-is for each output format
+FORMAT_EXTENSIONS = {'tif': ('.tif', '.tiff'), 'png': ('.png',), 'jpg': ('.jpg', '.jpeg')}
+
+# Settings shared by every process_image call, set once per worker process by _init_worker
+_WORKER_STATE = {}
+
+# GDAL settings entered once per worker process (see _init_worker); GDAL_NUM_THREADS is added per run
+GDAL_WORKER_OPTIONS = {
+    'GDAL_CACHEMAX': 512,         # MB of raster block cache per worker
+    'GTIFF_DIRECT_IO': 'YES',     # Uncompressed GeoTIFF windows are read straight from the file
+    'GDAL_DISABLE_READDIR_ON_OPEN': 'EMPTY_DIR', # Don't list sibling files on every open
+}
+_GDAL_ENV = None
+
+# Per-worker cache of matching LUTs keyed by a fingerprint of the source CDFs (see _cached_luts); FIFO-evicted
+LUT_CACHE_SIZE = 32
+_LUT_CACHE = {}
+
 # --- Placeholder for functions you mentioned as unchanged ---
 def get_valid_folder(prompt, must_exist=True):
     """Placeholder: Gets and validates a folder path from user input."""
@@ -35,11 +82,49 @@ def get_image_files(folder_path):
     return [f for f in os.listdir(folder_path)
             if f.lower().endswith(supported_extensions)]
 
+def _hist_shift(bins, hist_min, hist_max):
+    """Right shift mapping values in [hist_min, hist_max] onto `bins` bins (both power-of-two sizes)."""
+    return (int(hist_max) - int(hist_min) + 1).bit_length() - int(bins).bit_length() # e.g. 65536 values -> 1024 bins: >> 6
+
 def compute_histogram(image_data, channel, bins, hist_min, hist_max):
-    """Placeholder: Computes histogram for a given channel."""
-    # Actual implementation: hist, _ = np.histogram(image_data[channel, ...].ravel(), bins=bins, range=(hist_min, hist_max))
-    # print(f"Placeholder: Computing histogram for channel {channel}")
-    return np.zeros(bins)
+    """Computes the histogram of one integer channel over [hist_min, hist_max] (power-of-two sizes) with np.bincount."""
+    shift = _hist_shift(bins, hist_min, hist_max)
+    values = image_data[channel].ravel()
+    if hist_min:
+        values = values - hist_min
+    return np.bincount(values >> shift, minlength=bins)[:bins]
+
+def _hist_worker(args):
+    """
+    Pool worker for the reference-selection pass.
+
+    Returns (path, histograms, log_level, message): histograms is a (num_channels, bins) array, or None when
+    the image was skipped, in which case message says why.
+    """
+    path, bins, hist_range, num_channels = args
+    try:
+        with rasterio.open(path) as src:
+            # The histogram shape survives decimation, and GDAL serves decimated reads from overviews when present
+            k = max(1, int((src.width * src.height / HIST_TARGET_PIXELS) ** 0.5))
+            image = src.read(out_shape=(src.count, max(1, src.height // k), max(1, src.width // k)),
+                             resampling=Resampling.nearest)
+        # Only compute hist for common bands if image has more than reference
+        # We use initial_num_channels (num_channels) as the basis.
+        if image.shape[0] < num_channels:
+            return path, None, logging.WARNING, (f"Image {os.path.basename(path)} has {image.shape[0]} bands, fewer than "
+                                                 f"reference type ({num_channels}). Skipping its histogram.")
+        # One contiguous (channels, pixels) block, so every channel is counted from a sequential buffer
+        image = np.ascontiguousarray(image[:num_channels])
+        hist_min, hist_max = hist_range
+        if _channel_histograms is not None and image.dtype in _HIST_DTYPES and not hist_min:
+            # Single fused pass over all channels
+            hists = _channel_histograms(image, bins, _hist_shift(bins, hist_min, hist_max))
+        else:
+            flat = image.reshape(num_channels, -1)
+            hists = np.stack([compute_histogram(flat, c, bins, hist_min, hist_max) for c in range(num_channels)])
+        return path, hists, logging.DEBUG, f"Computed histogram for {os.path.basename(path)}"
+    except Exception as e:
+        return path, None, logging.ERROR, f"Error computing histogram for {os.path.basename(path)}: {e}"
 
 def select_reference_image(file_paths, histograms, num_channels, bins, hist_range):
     """Placeholder: Selects a reference image."""
@@ -48,161 +133,294 @@ def select_reference_image(file_paths, histograms, num_channels, bins, hist_rang
         raise ValueError("No image files provided to select a reference from.")
     return 0, file_paths[0]
 
-def apply_color_grading(image_data, params):
-    """Placeholder for applying color grading adjustments."""
-    # This function would modify image_data based on hue_shift, sat_scale, val_scale
-    # For example, convert to HSV, adjust channels, convert back to RGB
-    # For simplicity, this placeholder just returns the image as is.
-    # print(f"Placeholder: Applying color grading with params: {params}")
-    return image_data
-
-def scale_to_uint8(image_data_float, original_max_val):
-    """Scales float image data (0-1 range typically) to uint8 (0-255)."""
-    # Or if image_data is uint16, scale from original_max_val (e.g., 65535)
-    if image_data_float.dtype == np.uint16:
-        scaled_data = (image_data_float / original_max_val * 255)
-    elif image_data_float.dtype == np.float32 or image_data_float.dtype == np.float64:
-         # Assuming float data is already in a sensible range (e.g. 0-1 or 0-255)
-         # If it was 0-1 from skimage operations:
-        if image_data_float.max() <= 1.0 and image_data_float.min() >=0.0:
-            scaled_data = image_data_float * 255.0
-        else: # Assume it might be other float ranges, clip and scale
-            scaled_data = np.clip(image_data_float, 0, original_max_val) / original_max_val * 255.0
-    else: # Already uint8 or other, just ensure it's in range.
-        scaled_data = image_data_float
-
-    return np.clip(scaled_data, 0, 255).astype(np.uint8)
+def _band_cdfs(image, dtype):
+    """Normalized per-band CDFs of an integer image, shape (bands, nbins) float64, over the full value range of `dtype`."""
+    nbins = np.iinfo(dtype).max + 1
+    if _channel_cdfs is not None and image.dtype == dtype and image.dtype in _HIST_DTYPES:
+        # Counting and prefix sum fused in one compiled call per image
+        cdfs = _channel_cdfs(np.ascontiguousarray(image), nbins).astype(np.float64)
+    else:
+        cdfs = np.stack([np.cumsum(np.bincount(image[c].ravel(), minlength=nbins)) for c in range(image.shape[0])]).astype(np.float64)
+    cdfs /= cdfs[:, -1:]
+    return cdfs
+
+def _build_luts(src_cdfs, ref_cdfs, dtype):
+    """
+    Per-band matching LUTs, shape (bands, nbins) in `dtype`, from source and reference CDFs (both from _band_cdfs).
+
+    Each band's LUT maps a source value to the first reference value whose CDF reaches that source value's
+    CDF (np.searchsorted).
+    """
+    nbins = np.iinfo(dtype).max + 1
+    luts = np.empty(src_cdfs.shape, dtype=dtype)
+    for c in range(src_cdfs.shape[0]):
+        luts[c] = np.minimum(np.searchsorted(ref_cdfs[c], src_cdfs[c]), nbins - 1)
+    return luts
+
+def _cached_luts(src_cdfs, ref_cdfs, dtype):
+    """
+    _build_luts, reusing the LUTs of an earlier frame in this worker whose source CDFs were exactly the same.
+    The key is a digest of the exact CDF bytes, so a cache hit returns the LUTs this frame would have built itself.
+    """
+    fingerprint = hashlib.blake2b(src_cdfs.tobytes(), digest_size=16).digest()
+    luts = _LUT_CACHE.get(fingerprint)
+    if luts is None:
+        luts = _build_luts(src_cdfs, ref_cdfs, dtype)
+        if len(_LUT_CACHE) >= LUT_CACHE_SIZE:
+            del _LUT_CACHE[next(iter(_LUT_CACHE))] # Oldest entry first
+        _LUT_CACHE[fingerprint] = luts
+    return luts
+
+def _apply_luts(block, luts, dtype, out=None):
+    """
+    Maps every band of `block` (of input `dtype`) through its LUT; the result has the LUTs' dtype, with no float work.
+    `out` is an optional preallocated C-contiguous result array of block's shape and the LUTs' dtype.
+    """
+    if out is None:
+        out = np.empty(block.shape, dtype=luts.dtype)
+    if _apply_channel_luts is not None and block.dtype == dtype:
+        _apply_channel_luts(np.ascontiguousarray(block), luts, out)
+    else:
+        for c in range(block.shape[0]):
+            np.take(luts[c], block[c], out=out[c], mode='clip')
+    return out
+
+def _processing_windows(src):
+    """Windows to stream `src` through: its native tiles when tiled, else full-width strips of STRIP_ROWS rows."""
+    # Block shape from the open dataset; src.profile would rebuild the whole profile dict (CRS, transform, tags)
+    _, block_cols = src.block_shapes[0]
+    if block_cols < src.width:
+        return [window for _, window in src.block_windows(1)]
+    return [Window(0, row, src.width, min(STRIP_ROWS, src.height - row)) for row in range(0, src.height, STRIP_ROWS)]
+
+def _matched_windows(src, band_indexes, luts, input_dtype, color_grading_params):
+    """
+    Yields (window, block) for every processing window of `src`, matched through `luts` (and graded).
+    The yielded block is overwritten on the next iteration, so consume it before advancing.
+    """
+    out = None # Reused while consecutive windows have the same shape; each block is consumed before the next read
+    for window in _processing_windows(src):
+        block = src.read(band_indexes, window=window)
+        if out is None or out.shape != block.shape:
+            out = np.empty(block.shape, dtype=luts.dtype)
+        matched_block = _apply_luts(block, luts, input_dtype, out=out)
+        graded_block = apply_color_grading(matched_block, color_grading_params, out=matched_block)
+        yield window, graded_block
+
+def _write_jpeg_cv2(output_path, windows, height, width, bands, jpeg_quality):
+    """
+    Assembles uint8 (bands, rows, cols) windows into one (height, width) BGR/gray frame and encodes it with
+    cv2.imwrite. Returns False if OpenCV couldn't write the file.
+    """
+    frame = np.empty((height, width, bands), dtype=np.uint8)
+    for window, block in windows:
+        rows, cols = window.toslices()
+        frame[rows, cols] = np.moveaxis(block[::-1], 0, -1) # (bands, h, w) RGB -> (h, w, bands) BGR
+    return cv2.imwrite(output_path, frame, [cv2.IMWRITE_JPEG_QUALITY, int(jpeg_quality), cv2.IMWRITE_JPEG_OPTIMIZE, 1])
+
+def _write_pam_georef(output_path, crs, transform):
+    """
+    Writes the CRS and geotransform to a <output_path>.aux.xml sidecar, the same one GDAL's JPEG driver leaves,
+    since cv2.imwrite keeps no georeferencing. Nothing is written for an ungeoreferenced source.
+    """
+    if crs is None and transform.is_identity:
+        return
+    parts = ['<PAMDataset>']
+    if crs is not None:
+        parts.append(f'  <SRS>{xml_escape(crs.to_wkt())}</SRS>')
+    if not transform.is_identity:
+        parts.append(f'  <GeoTransform>{", ".join(repr(v) for v in transform.to_gdal())}</GeoTransform>')
+    parts.append('</PAMDataset>')
+    with open(output_path + '.aux.xml', 'w') as f:
+        f.write('\n'.join(parts) + '\n')
+
+def _is_identity_grading(params):
+    """True when `params` (see DEFAULT_COLOR_GRADING) leave every pixel unchanged."""
+    return (not params or (params.get('hue_shift', 0.0) % 1.0 == 0.0
+                           and params.get('sat_scale', 1.0) == 1.0 and params.get('val_scale', 1.0) == 1.0))
+
+def apply_color_grading(image_data, params, out=None):
+    """
+    Applies hue_shift / sat_scale / val_scale (see DEFAULT_COLOR_GRADING) in HSV to the RGB bands of an integer
+    (bands, rows, cols) image; extra bands pass through. Identity params, or fewer than 3 bands, return the input.
+
+    Uses the grade_hsv Numba kernel (one pass, no float image copies) when available, else skimage's rgb2hsv/hsv2rgb.
+    `out` may be image_data to grade in place.
+    """
+    if _is_identity_grading(params) or image_data.shape[0] < 3:
+        return image_data
+    hue_shift = float(params.get('hue_shift', 0.0))
+    sat_scale = float(params.get('sat_scale', 1.0))
+    val_scale = float(params.get('val_scale', 1.0))
+    if out is None:
+        out = np.empty_like(image_data)
+
+    max_val = np.iinfo(image_data.dtype).max
+    if _grade_hsv is not None and image_data.dtype in _HIST_DTYPES:
+        _grade_hsv(np.ascontiguousarray(image_data), hue_shift, sat_scale, val_scale, float(max_val), out)
+        return out
+
+    hsv = rgb2hsv(np.moveaxis(image_data[:3], 0, -1).astype(np.float32) / max_val)
+    hsv[..., 0] = (hsv[..., 0] + hue_shift) % 1.0
+    np.clip(hsv[..., 1] * sat_scale, 0.0, 1.0, out=hsv[..., 1])
+    np.clip(hsv[..., 2] * val_scale, 0.0, 1.0, out=hsv[..., 2])
+    np.rint(np.moveaxis(hsv2rgb(hsv), -1, 0) * max_val, out=out[:3], casting='unsafe')
+    if out is not image_data:
+        out[3:] = image_data[3:]
+    return out
+
+def scale_to_uint8(image_data, original_max_val, out=None):
+    """
+    Scales integer or float image data from [0, original_max_val] to uint8 (0-255), writing into `out` if given.
+
+    One multiply, then a clip that casts straight into the uint8 result; pass original_max_val=1.0 for
+    [0, 1] floats. uint8 input is copied through unchanged.
+    """
+    if out is None:
+        out = np.empty(image_data.shape, dtype=np.uint8)
+    if image_data.dtype == np.uint8:
+        np.copyto(out, image_data)
+        return out
+    np.clip(np.multiply(image_data, 255.0 / original_max_val), 0, 255, out=out, casting='unsafe')
+    return out
+
 
+def _init_worker(ref_cdfs, input_dtype, color_space_method, match_independent, color_grading_params,
+                 output_format, jpeg_quality, gdal_threads=1):
+    """
+    Pool initializer (also called directly for in-process runs): stores the run-wide settings for process_image
+    and enters a rasterio.Env with GDAL_WORKER_OPTIONS that every later rasterio.open in this process inherits.
+    """
+    global _GDAL_ENV
+    if _GDAL_ENV is None: # Entered once per process and left open for its lifetime
+        _GDAL_ENV = rasterio.Env(GDAL_NUM_THREADS=str(gdal_threads), **GDAL_WORKER_OPTIONS)
+        _GDAL_ENV.__enter__()
+    _LUT_CACHE.clear() # LUTs from an earlier run were built against another reference
+    _WORKER_STATE.update(
+        ref_cdfs=ref_cdfs, input_dtype=input_dtype, color_space_method=color_space_method,
+        match_independent=match_independent, color_grading_params=color_grading_params,
+        output_format=output_format, jpeg_quality=jpeg_quality, gdal_threads=gdal_threads,
+    )
 
 def process_image(args):
     """
-    Placeholder: Processes a single image, including format-specific saving.
+    Processes a single image window by window, including format-specific saving.
+
+    `args` is (image_path, output_path); everything else comes from _WORKER_STATE (see _init_worker).
+    The matching LUTs are built once from a decimated read, so each window is just read, mapped, converted
+    for the output format and written; peak memory is bounded by the window size, not the raster size.
+    The exception is gray/RGB JPEG output through OpenCV, which holds one full uint8 frame
+    (height x width x bands bytes) because cv2.imwrite encodes a whole image at once.
     """
-    (image_path, output_path, ref_image_data, input_dtype,
-     color_space_method, match_independent, color_grading_params,
-     output_format, jpeg_quality) = args
+    image_path, output_path = args
+    ref_cdfs = _WORKER_STATE['ref_cdfs']
+    input_dtype = _WORKER_STATE['input_dtype']
+    color_space_method = _WORKER_STATE['color_space_method']
+    match_independent = _WORKER_STATE['match_independent']
+    color_grading_params = _WORKER_STATE['color_grading_params']
+    output_format = _WORKER_STATE['output_format']
+    jpeg_quality = _WORKER_STATE['jpeg_quality']
 
     try:
         with rasterio.open(image_path) as src:
-            src_profile = src.profile.copy() # Get profile of the source image
-            img_data = src.read() # Reads as (bands, height, width)
+            src_profile = src.profile # Built once (a fresh dict) and reused as the base of the output profile
 
             # Ensure consistent band count with reference for matching
-            if img_data.shape[0] != ref_image_data.shape[0]:
+            if src.count != ref_cdfs.shape[0]:
                 # This case should ideally be handled before even attempting to process
                 # or by only matching common bands. For simplicity, we assume they match here.
-                # Or, one might select only the first min(img_data.shape[0], ref_image_data.shape[0]) bands.
+                # Or, one might select only the first min(src.count, ref_cdfs.shape[0]) bands.
                 # For Planet Labs, if input is 4-band and reference is 3-band (or vice-versa),
                 # a strategy is needed (e.g. match only RGB).
                 # For this placeholder, we'll assume band counts are compatible for matching.
                 pass
 
+            # 1. Histogram Matching (per-band LUTs against the reference CDFs)
+            # For Planet Labs, if using 4-band (RGBNir), decide if you match all or just RGB.
+            # If the image could have an alpha channel but the reference doesn't, only the common bands are matched.
+            original_max = 255 if input_dtype == np.uint8 else 65535 # Integer inputs only (checked in main)
+            num_bands_to_match = min(src.count, ref_cdfs.shape[0])
+            band_indexes = list(range(1, num_bands_to_match + 1))
+
+            # The LUTs depend only on the image's CDF, which a decimated read preserves
+            sample = src.read(band_indexes, out_shape=(num_bands_to_match,
+                                                       min(LUT_SAMPLE_SIZE, src.height),
+                                                       min(LUT_SAMPLE_SIZE, src.width)))
+            src_cdfs = _band_cdfs(sample, input_dtype)
+            del sample
+
+            # Already matching the reference (max CDF difference under the KS threshold on every band), no grading
+            # and no format change: the output would be the input, so copy the file instead of rewriting every pixel
+            ks = np.abs(src_cdfs - ref_cdfs[:num_bands_to_match]).max()
+            if (ks < KS_IDENTITY_THRESHOLD and num_bands_to_match == src.count
+                    and _is_identity_grading(color_grading_params)
+                    and os.path.splitext(image_path)[1].lower() in FORMAT_EXTENSIONS[output_format]):
+                shutil.copy(image_path, output_path)
+                return True, output_path
+
+            luts = _cached_luts(src_cdfs, ref_cdfs[:num_bands_to_match], input_dtype)
+
+            # 2. Prepare the output profile based on output format
+            final_profile = src_profile # Start with source profile and modify
+            out_bands = num_bands_to_match # Number of bands in matched image
 
-        # 1. Simulate Histogram Matching (skimage.exposure.match_histograms)
-        # Ensure data is in a format suitable for match_histograms (e.g. C, H, W or H, W, C)
-        # match_histograms expects image and reference to have same number of channels if multichannel=True (older skimage)
-        # or uses channel_axis for newer skimage.
-        # For Planet Labs, if using 4-band (RGBNir), decide if you match all or just RGB.
-        # Assuming ref_image_data and img_data are (bands, height, width)
-        # And that match_histograms is called appropriately.
-        # If img_data could have an alpha channel but ref_image doesn't, handle this.
-        # e.g., img_to_match = img_data[:ref_image_data.shape[0], :, :]
-        
-        # This is a very simplified placeholder for matching:
-        # matched_image = img_data # In reality: match_histograms(img_data, ref_image_data, channel_axis=0)
-        # Let's assume match_histograms preserves the original data type of `img_data`
-        
-        # If skimage functions converted to float (0-1 range), store max value for scaling back
-        original_max = 1.0 if img_data.dtype in [np.float32, np.float64] and img_data.max() <=1.0 else (255 if input_dtype == np.uint8 else 65535)
-
-        # Placeholder for matching - this would be your skimage.exposure.match_histograms call
-        # Ensure that 'img_data' and 'ref_image_data' are correctly prepared for this function
-        # e.g., if ref_image_data has fewer bands, select corresponding bands from img_data
-        num_bands_to_match = min(img_data.shape[0], ref_image_data.shape[0])
-        img_to_match = img_data[:num_bands_to_match, :, :]
-        ref_to_match = ref_image_data[:num_bands_to_match, :, :]
-
-        # skimage.exposure.match_histograms returns a float array [0,1] if input is integer
-        # or preserves float range if input is float. We need to handle this.
-        matched_image_float = match_histograms(img_to_match, ref_to_match, channel_axis=0)
-
-
-        # 2. Simulate Color Grading
-        # graded_image_float = apply_color_grading(matched_image_float, color_grading_params)
-        graded_image_float = matched_image_float # Placeholder returns as is
-
-        # 3. Prepare data for saving based on output format
-        final_profile = src_profile # Start with source profile and modify
-        final_profile['count'] = graded_image_float.shape[0] # Number of bands in matched image
-
-
-        if output_format == 'jpg':
-            # JPEG is typically 3-band (RGB) and 8-bit.
-            if graded_image_float.shape[0] == 4: # If RGBA, take RGB
-                final_image_data = graded_image_float[:3, :, :]
-                final_profile['count'] = 3
-            elif graded_image_float.shape[0] == 1: # If grayscale
-                # Need to handle grayscale JPEG correctly. For now, assume we are working with RGB.
-                 final_image_data = graded_image_float
-            else:
-                final_image_data = graded_image_float
-
-            # Scale to uint8
-            final_image_data = scale_to_uint8(final_image_data, original_max_val=original_max)
-            final_profile['dtype'] = rasterio.uint8
-            final_profile['driver'] = 'JPEG'
-            final_profile['photometric'] = 'RGB' # or 'YCBCR'
-            # Remove compression tags not applicable to JPEG or set JPEG specific ones
-            for key in ['compress', 'predictor', 'photometric', 'nodata', 'blockxsize', 'blockysize', 'tiled']:
-                final_profile.pop(key, None)
-            # No specific creation options needed for quality here for basic rasterio save,
-            # but can be passed to dst.write with some drivers/versions or as creation options
-
-        elif output_format == 'png':
-            final_profile['driver'] = 'PNG'
-            # PNG can be uint8 or uint16. Preserve input bit depth if possible.
-            if input_dtype == np.uint16:
-                # Scale float [0,1] back to uint16 [0, 65535]
-                final_image_data = (np.clip(graded_image_float, 0, 1) * 65535.0).astype(np.uint16)
-                final_profile['dtype'] = rasterio.uint16
-            else: # uint8
-                final_image_data = scale_to_uint8(graded_image_float, original_max_val=original_max)
-                final_profile['dtype'] = rasterio.uint8
-            # Remove GeoTIFF specific tags
-            for key in ['compress', 'predictor', 'blockxsize', 'blockysize', 'tiled']:
-                 final_profile.pop(key, None)
-
-
-        elif output_format == 'tif': # GeoTIFF
-            final_profile['driver'] = 'GTiff'
-            # Preserve input bit depth if possible, or target_dtype
-            if input_dtype == np.uint16:
-                final_image_data = (np.clip(graded_image_float, 0, 1) * 65535.0).astype(np.uint16)
-                final_profile['dtype'] = rasterio.uint16
-                final_profile.setdefault('compress', 'lzw') # Sensible default for TIFF
-                final_profile.setdefault('predictor', 2)
-            else: # uint8
-                final_image_data = scale_to_uint8(graded_image_float, original_max_val=original_max)
-                final_profile['dtype'] = rasterio.uint8
-                final_profile.setdefault('compress', 'deflate')
-        else:
-            return False, f"Unsupported output format '{output_format}' for {os.path.basename(image_path)}"
-
-        # Ensure count matches data
-        final_profile['count'] = final_image_data.shape[0]
-
-        # Clean up nodata if not appropriate for the output format or if it's problematic
-        if output_format == 'jpg' and 'nodata' in final_profile:
-            del final_profile['nodata']
-
-        # Write the processed image
-        with rasterio.open(output_path, 'w', **final_profile) as dst:
             if output_format == 'jpg':
-                # For JPEG, some rasterio versions/GDAL need specific write params
-                # This is a common way to set quality for JPEG driver
-                dst.write(final_image_data, GDX_バンド書き込み順序='RGB', JPEG_QUALITY=jpeg_quality)
+                # JPEG is typically 3-band (RGB) and 8-bit.
+                if out_bands == 4: # If RGBA, take RGB
+                    out_bands = 3
+                # If grayscale (1 band): need to handle grayscale JPEG correctly. For now, assume we are working with RGB.
+                final_profile['dtype'] = rasterio.uint8
+                final_profile['driver'] = 'JPEG'
+                # Remove compression/tiling tags and nodata, which don't apply to JPEG
+                for key in ['compress', 'predictor', 'photometric', 'nodata', 'blockxsize', 'blockysize', 'tiled']:
+                    final_profile.pop(key, None)
+                final_profile['quality'] = int(jpeg_quality) # Passed to GDAL's JPEG driver as the QUALITY creation option
+
+            elif output_format == 'png':
+                final_profile['driver'] = 'PNG'
+                # PNG can be uint8 or uint16. Preserve input bit depth if possible.
+                final_profile['dtype'] = rasterio.uint16 if input_dtype == np.uint16 else rasterio.uint8
+                # Remove GeoTIFF specific tags
+                for key in ['compress', 'predictor', 'blockxsize', 'blockysize', 'tiled']:
+                     final_profile.pop(key, None)
+
+            elif output_format == 'tif': # GeoTIFF
+                final_profile['driver'] = 'GTiff'
+                # Preserve input bit depth if possible, or target_dtype
+                if input_dtype == np.uint16:
+                    final_profile['dtype'] = rasterio.uint16
+                    final_profile.setdefault('compress', 'lzw') # Sensible default for TIFF
+                    final_profile.setdefault('predictor', 2)
+                else: # uint8
+                    final_profile['dtype'] = rasterio.uint8
+                    final_profile.setdefault('compress', 'deflate')
+                # Tiled layout for block-aligned downstream reads; compression threads as set up in _init_worker
+                final_profile.update(tiled=True, blockxsize=TIF_TILE_SIZE, blockysize=TIF_TILE_SIZE,
+                                     num_threads=str(_WORKER_STATE['gdal_threads']), BIGTIFF='IF_SAFER')
             else:
-                dst.write(final_image_data)
+                return False, f"Unsupported output format '{output_format}' for {os.path.basename(image_path)}"
+
+            final_profile['count'] = out_bands
+
+            # Fold the output conversion into the LUTs (e.g. uint16 -> uint8 for JPEG): a few thousand entries are
+            # scaled once instead of every pixel, and each window below is a single integer gather.
+            luts = luts[:out_bands]
+            if np.dtype(final_profile['dtype']) == np.uint8:
+                luts = scale_to_uint8(luts, original_max_val=original_max)
+            final_profile['dtype'] = luts.dtype.name
+            band_indexes = band_indexes[:out_bands]
+
+            # 3. Stream: read, match, (grade,) convert and write one window at a time
+            windows = _matched_windows(src, band_indexes, luts, input_dtype, color_grading_params)
+            if output_format == 'jpg' and cv2 is not None and out_bands in (1, 3):
+                # Plain gray/RGB JPEG: encode with OpenCV (libjpeg-turbo) instead of going through a GDAL JPEG dataset
+                if not _write_jpeg_cv2(output_path, windows, src.height, src.width, out_bands, jpeg_quality):
+                    return False, f"OpenCV could not write {os.path.basename(output_path)}"
+                _write_pam_georef(output_path, src.crs, src.transform)
+            else:
+                with rasterio.open(output_path, 'w', **final_profile) as dst:
+                    for window, graded_block in windows:
+                        dst.write(graded_block, window=window)
 
         return True, output_path
 
@@ -212,7 +430,7 @@ def process_image(args):
 
 
 DEFAULT_COLOR_GRADING = {
-    'hue_shift': 0.0, # Usually safer to keep hue_shift at 0 unless specifically needed
+    'hue_shift': 0.0, # Fraction of a full hue turn (0.5 = 180 degrees); usually safer to keep at 0 unless specifically needed
     'sat_scale': 1.0,
     'val_scale': 1.0
 }
@@ -224,6 +442,9 @@ def main(input_folder, output_folder, output_format='tif', jpeg_quality=90,
     """
     if color_grading_params is None:
         color_grading_params = DEFAULT_COLOR_GRADING
+    if not _is_identity_grading(color_grading_params) and _grade_hsv is None and rgb2hsv is None:
+        logging.warning("Color grading needs Numba (_timelapse_kernels.py) or scikit-image; continuing without grading.")
+        color_grading_params = DEFAULT_COLOR_GRADING
 
     output_format = output_format.lower().replace('.', '') # Normalize (e.g. .jpg -> jpg)
     valid_formats = ['tif', 'tiff', 'png', 'jpg', 'jpeg']
@@ -305,36 +526,31 @@ def main(input_folder, output_folder, output_format='tif', jpeg_quality=90,
         return
 
 
-    logging.info("Computing histograms for all images (for reference selection)...")
+    actual_num_workers = cpu_count() if num_workers is None else num_workers
+    actual_num_workers = min(actual_num_workers, os.cpu_count() or 1)
+
+    logging.info(f"Computing histograms for all images (for reference selection) using {actual_num_workers} workers...")
+    hist_by_path = {}
+    hist_tasks = [(path, bins, hist_range, initial_num_channels) for path in file_paths]
+    # With one worker (or one file) run in-process: a pool would only add fork and pickling overhead
+    in_process = actual_num_workers == 1 or len(hist_tasks) == 1
+    with (nullcontext() if in_process else Pool(processes=actual_num_workers)) as pool:
+        hist_results = map(_hist_worker, hist_tasks) if pool is None else pool.imap_unordered(_hist_worker, hist_tasks)
+        for path, hists, level, message in tqdm(hist_results,
+                                                total=num_images, desc="Computing histograms",
+                                                disable=not verbose, unit="image"):
+            hist_by_path[path] = hists
+            logging.log(level, message)
+
+    # Back in file order; None for each channel of a skipped image to maintain structure for select_reference_image
     histograms_by_channel = {c: [] for c in range(initial_num_channels)} # Use initial_num_channels
     valid_file_paths_for_hist = [] # Store paths for which histograms were successfully computed
-
-    for path in tqdm(file_paths, desc="Computing histograms", disable=not verbose, unit="image"):
-        try:
-            with rasterio.open(path) as src:
-                image = src.read()
-                # Only compute hist for common bands if image has more than reference
-                # For simplicity, assume consistency for now or that select_reference_image handles it.
-                # We use initial_num_channels as the basis.
-                current_bands = image.shape[0]
-                if current_bands < initial_num_channels:
-                    logging.warning(f"Image {os.path.basename(path)} has {current_bands} bands, fewer than "
-                                    f"reference type ({initial_num_channels}). Skipping its histogram.")
-                    # Add None for each channel to maintain structure, or handle this in select_reference_image
-                    for c_idx in range(initial_num_channels):
-                        histograms_by_channel[c_idx].append(None)
-                    continue
-
-                for c in range(initial_num_channels): # Compute for the number of channels determined initially
-                    hist = compute_histogram(image, c, bins, *hist_range)
-                    histograms_by_channel[c].append(hist)
-                valid_file_paths_for_hist.append(path) # Add path if hist computed
-            if verbose:
-                logging.debug(f"Computed histogram for {os.path.basename(path)}")
-        except Exception as e:
-            logging.error(f"Error computing histogram for {os.path.basename(path)}: {e}")
-            for c_idx in range(initial_num_channels):
-                histograms_by_channel[c_idx].append(None)
+    for path in file_paths:
+        hists = hist_by_path[path]
+        for c in range(initial_num_channels):
+            histograms_by_channel[c].append(None if hists is None else hists[c])
+        if hists is not None:
+            valid_file_paths_for_hist.append(path)
 
     if not valid_file_paths_for_hist:
         logging.error("No valid histograms could be computed. Cannot select a reference image.")
@@ -362,7 +578,10 @@ def main(input_folder, output_folder, output_format='tif', jpeg_quality=90,
             if ref_image_data.shape[0] != initial_num_channels:
                  raise ValueError(f"Reference image {os.path.basename(ref_path)} after band selection has "
                                  f"{ref_image_data.shape[0]} bands, expected {initial_num_channels}.")
-        logging.info(f"Reference image data loaded ({ref_image_data.shape[0]} bands).")
+        # Workers only need the reference's per-band CDFs, not the raster itself
+        ref_cdfs = _band_cdfs(ref_image_data, input_dtype)
+        del ref_image_data, ref_image_data_full
+        logging.info(f"Reference image data loaded ({ref_cdfs.shape[0]} bands).")
     except Exception as e:
         logging.error(f"Failed to read reference image {ref_path}: {e}")
         return
@@ -386,46 +605,43 @@ def main(input_folder, output_folder, output_format='tif', jpeg_quality=90,
                 logging.warning(f"Could not copy reference image {path}: {e}. It will be processed instead.")
 
 
-        tasks.append((
-            path,
-            output_path,
-            ref_image_data,
-            input_dtype, # Original input dtype, process_image handles scaling based on output_format
-            'rgb_independent', # Placeholder for color space method
-            True,              # Placeholder for match_independent
-            color_grading_params,
-            output_format,
-            jpeg_quality
-        ))
+        tasks.append((path, output_path))
 
+    # Shipped once per worker through the pool initializer instead of pickled into every task
+    worker_args = (
+        ref_cdfs,
+        input_dtype, # Original input dtype, process_image handles scaling based on output_format
+        'rgb_independent', # Placeholder for color space method
+        True,              # Placeholder for match_independent
+        color_grading_params,
+        output_format,
+        jpeg_quality,
+        max(1, (os.cpu_count() or 1) // actual_num_workers) # GDAL compression/decode threads per worker
+    )
 
-    batch_size = 50
-    actual_num_workers = cpu_count() if num_workers is None else num_workers
-    actual_num_workers = min(actual_num_workers, os.cpu_count() or 1)
+
+    chunksize = 4 # Tasks handed to a worker per IPC round trip
     if not tasks:
         logging.info("No images to process after preparing tasks (e.g., reference image was the only one).")
     else:
-        logging.info(f"Processing {len(tasks)} images using {actual_num_workers} workers in batches of up to {batch_size}...")
-        with Pool(processes=actual_num_workers) as pool:
-            for i in range(0, len(tasks), batch_size):
-                batch_tasks = tasks[i:i + batch_size]
-                current_batch_num = (i // batch_size) + 1
-                logging.info(f"Starting batch {current_batch_num} ({len(batch_tasks)} images)...")
-
-                results = []
-                for result in tqdm(pool.imap_unordered(process_image, batch_tasks),
-                                   total=len(batch_tasks),
-                                   desc=f"Batch {current_batch_num}",
-                                   disable=not verbose,
-                                   unit="image"):
-                    results.append(result)
-
-                for success, message_or_path in results:
+        logging.info(f"Processing {len(tasks)} images using {actual_num_workers} workers...")
+        in_process = actual_num_workers == 1 or len(tasks) == 1
+        if in_process:
+            _init_worker(*worker_args)
+        with (nullcontext() if in_process else Pool(processes=actual_num_workers, initializer=_init_worker, initargs=worker_args)) as pool:
+            results = map(process_image, tasks) if pool is None else pool.imap_unordered(process_image, tasks, chunksize=chunksize)
+            # Each result is logged as it arrives (nothing is buffered); log lines are routed through tqdm.write
+            # so they print above the progress bar instead of breaking it
+            with logging_redirect_tqdm():
+                for success, message_or_path in tqdm(results,
+                                                     total=len(tasks),
+                                                     desc="Processing",
+                                                     disable=not verbose,
+                                                     unit="image"):
                     if success:
                         logging.info(f"Successfully processed and saved: {os.path.basename(message_or_path)}")
                     else:
                         logging.error(message_or_path)
-                sys.stdout.flush()
 
     logging.info("Color harmonization completed.")
 
@@ -11,9 +11,11 @@ from glob import glob
 from PIL import Image, ImageTk
 from typing import Dict, List, Tuple, Optional
 import threading
+import cv2
+import numpy as np
 
 from timelapse_processor import (
-    load_metadata, compute_quality_score, detect_outliers,
+    load_metadata_batch, compute_quality_scores_batch, detect_outliers,
     process_frame, create_timelapse
 )
 
@@ -26,6 +28,22 @@ RESOLUTION_PRESETS = {
     "Original Size": "original"
 }
 
+# Filter metric columns: (metadata keys summed, default when missing)
+FILTER_COLUMNS = (
+    (('cloud_percent',), 0),
+    (('heavy_haze_percent', 'light_haze_percent'), 0),
+    (('shadow_percent',), 0),
+    (('snow_ice_percent',), 0),
+    (('anomalous_pixels',), 0),
+    (('clear_confidence_percent',), 100),
+    (('visible_confidence_percent',), 100),
+    (('view_angle',), 0),
+)
+# Columns whose threshold is a minimum (clear/visible confidence); the others are maxima
+FILTER_IS_MIN = np.array([False, False, False, False, False, True, True, False])
+FILTER_DEBOUNCE_MS = 50  # Threshold edits arriving within this window trigger one filter pass
+SCAN_DEBOUNCE_MS = 250   # Input-folder edits wait this long for typing to pause before the folder is scanned
+
 class SatelliteTimelapseApp(tk.Tk):
     def __init__(self):
         super().__init__()
@@ -35,7 +53,14 @@ class SatelliteTimelapseApp(tk.Tk):
         self.image_files: List[str] = []
         self.filtered_files: List[str] = []
         self.quality_scores: List[float] = []
+        self._scores_arr = np.empty(0)  # quality_scores as an array, rebuilt by scan_dir
+        # Filter metrics per image file, one column per FILTER_COLUMNS entry (rebuilt by scan_dir)
+        self._meta_arr = np.empty((0, len(FILTER_COLUMNS)))
+        self._meta_idx = np.empty(0, dtype=np.intp)  # image_files indexes that have metadata (rows of _scores_arr)
         self.tkimg = None
+        self._filter_job = None  # Pending after() id of a debounced filter pass
+        self._scan_job = None    # Pending after() id of a debounced folder scan
+        self._last_scanned = None  # (folder, mtime) the current image_files/metadata came from
         self.setup_vars()
         self.build_ui()
         self.bind_events()
@@ -149,7 +174,7 @@ class SatelliteTimelapseApp(tk.Tk):
         # Frames list
         lf = ttk.Labelframe(self, text="Frames")
         lf.pack(fill="both", expand=False, pady=5)
-        self.listbox = tk.Listbox(lf, height=8)
+        self.listbox = tk.Listbox(lf, height=8, fg='black')
         self.listbox.pack(side="left", fill="both", expand=True)
         sb = ttk.Scrollbar(lf, orient="vertical", command=self.listbox.yview)
         sb.pack(side="right", fill="y")
@@ -163,7 +188,7 @@ class SatelliteTimelapseApp(tk.Tk):
         ttk.Button(prf, text="Preview", command=self.preview).pack(pady=5)
 
     def bind_events(self):
-        self.input_dir.trace_add('write', lambda *a: self.scan_dir())
+        self.input_dir.trace_add('write', lambda *a: self._schedule_scan())
         for v in [self.cloud_th, self.haze_th, self.shadow_th, self.snow_th,
                   self.anom_th, self.clear_th, self.vis_th, self.angle_th,
                   self.enable_out, self.outlier_std, self.use_all]:
@@ -176,57 +201,84 @@ class SatelliteTimelapseApp(tk.Tk):
 
     def browse_input(self):
         d = filedialog.askdirectory()
-        if d: self.input_dir.set(d)
+        if d:
+            self._last_scanned = None  # Picking a folder explicitly always rescans it
+            self.input_dir.set(d)
 
     def browse_output(self):
         f = filedialog.asksaveasfilename(defaultextension=".mp4",
                                          filetypes=[("MP4","*.mp4"),("All","*.*")])
         if f: self.output_file.set(f)
 
+    def _schedule_scan(self):
+        """Restart the scan timer on every keystroke, so a path is only scanned once typing pauses."""
+        if self._scan_job is not None:
+            self.after_cancel(self._scan_job)
+        self._scan_job = self.after(SCAN_DEBOUNCE_MS, self.scan_dir)
+
     def scan_dir(self):
+        self._scan_job = None
         d = self.input_dir.get()
         if not os.path.isdir(d): return
+        d = os.path.normpath(os.path.abspath(d))
+        # Same folder, unchanged since the current list was built: no glob or metadata reads.
+        # Adding or removing files bumps the folder's mtime, so retyping a path after a change rescans it.
+        scan_key = (d, os.stat(d).st_mtime)
+        if scan_key == self._last_scanned: return
+        self._last_scanned = scan_key
         self.metadata_map.clear()
         self.quality_scores.clear()
         tifs = sorted(glob(os.path.join(d, '*.tif')))
-        for tif in tifs:
-            md = load_metadata(tif.replace('.tif','_metadata.json'))
+        metas = load_metadata_batch([tif.replace('.tif','_metadata.json') for tif in tifs])
+        for tif, md in zip(tifs, metas):
             if md is not None:
                 self.metadata_map[tif] = md
-                self.quality_scores.append(compute_quality_score(md))
+        # Score every frame in one batch (metadata_map keeps the tifs' sorted order)
+        self._scores_arr = compute_quality_scores_batch(list(self.metadata_map.values()))
+        self.quality_scores = self._scores_arr.tolist()
+        # Metrics as a (frames, columns) array so update_filters is a few vectorized comparisons
+        self._meta_arr = np.array([[sum(self.metadata_map.get(tif, {}).get(k, default) for k in keys)
+                                    for keys, default in FILTER_COLUMNS] for tif in tifs],
+                                  dtype=np.float64).reshape(len(tifs), len(FILTER_COLUMNS))
+        self._meta_idx = np.array([i for i, tif in enumerate(tifs) if tif in self.metadata_map], dtype=np.intp)
         self.image_files = tifs
         self.update_filters()
 
     def update_filters(self):
-        if self.use_all.get():
-            self.filtered_files = self.image_files.copy()
-        else:
-            ths = (
+        """Schedule a filter pass; bursts of trace callbacks (typing, toggles) collapse into one."""
+        if self._filter_job is None:
+            self._filter_job = self.after(FILTER_DEBOUNCE_MS, self._do_update_filters)
+
+    def _do_update_filters(self):
+        self._filter_job = None
+        try:
+            # Every Tk variable is read once per pass
+            use_all = self.use_all.get()
+            ths = np.array([
                 self.cloud_th.get()*100, self.haze_th.get()*100,
                 self.shadow_th.get()*100, self.snow_th.get()*100,
                 self.anom_th.get()*100, self.clear_th.get(),
                 self.vis_th.get(), self.angle_th.get()
-            )
-            out_flags = detect_outliers(self.quality_scores, self.outlier_std.get()) if self.enable_out.get() else [False]*len(self.image_files)
-            sel = []
-            for i,f in enumerate(self.image_files):
-                p = self.metadata_map.get(f, {})
-                cond = (
-                    p.get('cloud_percent',0) <= ths[0] and
-                    (p.get('heavy_haze_percent',0)+p.get('light_haze_percent',0)) <= ths[1] and
-                    p.get('shadow_percent',0) <= ths[2] and
-                    p.get('snow_ice_percent',0) <= ths[3] and
-                    p.get('anomalous_pixels',0) <= ths[4] and
-                    p.get('clear_confidence_percent',100) >= ths[5] and
-                    p.get('visible_confidence_percent',100) >= ths[6] and
-                    p.get('view_angle',0) <= ths[7]
-                )
-                if cond and not out_flags[i]: sel.append(f)
-            self.filtered_files = sel
+            ], dtype=np.float64)
+            outlier_std = self.outlier_std.get() if self.enable_out.get() else None
+        except tk.TclError:
+            return  # A threshold entry is mid-edit (empty or not a number); keep the current selection
+        if use_all:
+            self.filtered_files = self.image_files.copy()
+        else:
+            A = self._meta_arr
+            mask = np.where(FILTER_IS_MIN, A >= ths, A <= ths).all(axis=1)
+            if outlier_std is not None:
+                # Scores exist only for frames with metadata; map their outlier flags back onto image_files
+                mask[self._meta_idx] &= ~detect_outliers(self._scores_arr, outlier_std)
+            self.filtered_files = [self.image_files[i] for i in np.flatnonzero(mask)]
+        kept = set(self.filtered_files)
         self.listbox.delete(0, 'end')
-        for f in self.image_files:
-            self.listbox.insert('end', os.path.basename(f))
-            self.listbox.itemconfig('end', fg='black' if f in self.filtered_files else 'gray')
+        # One insert call for all names; kept frames use the listbox's black foreground, so only rejects need itemconfig
+        self.listbox.insert('end', *[os.path.basename(f) for f in self.image_files])
+        for i, f in enumerate(self.image_files):
+            if f not in kept:
+                self.listbox.itemconfig(i, fg='gray')
         # Update frame count and estimate
         self.frame_count.set(len(self.filtered_files))
         self.update_estimate()
@@ -258,12 +310,9 @@ class SatelliteTimelapseApp(tk.Tk):
         ref = self.filtered_files[0]
         ref_img = process_frame((ref,0,params,None))['frame']
         out = process_frame((path,1,params,ref_img))['frame']
-        img = Image.fromarray(ImageTk.PhotoImage(out).zoom(1))
-        img = Image.fromarray(out)
-        img = Image.fromarray(out)
-        # Convert and display
-        img = Image.fromarray(out)
-        img = img.resize((self.canvas.winfo_width(), self.canvas.winfo_height()), Image.ANTIALIAS)
+        # Convert (frames are BGR) and display
+        img = Image.fromarray(cv2.cvtColor(out, cv2.COLOR_BGR2RGB))
+        img = img.resize((self.canvas.winfo_width(), self.canvas.winfo_height()), Image.Resampling.LANCZOS)
         self.tkimg = ImageTk.PhotoImage(img)
         self.canvas.delete('all')
         self.canvas.create_image(0,0,anchor='nw',image=self.tkimg)
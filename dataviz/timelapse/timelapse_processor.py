@@ -8,12 +8,24 @@ import os
 import cv2
 import json
 import time
+import heapq
 import numpy as np
 import logging
-from concurrent.futures import ProcessPoolExecutor
-from typing import Dict, List, Tuple, Optional
-from statistics import mean, stdev
-from PIL import Image, ImageDraw, ImageFont
+import threading
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, NamedTuple, Tuple, Optional, Union
+
+try:
+    import orjson  # Optional: faster metadata JSON parsing
+except ImportError:
+    orjson = None
+
+# Optional: precompiled Numba kernel (_timelapse_kernels.py next to this script) for 16-bit frame conversion
+try:
+    from _timelapse_kernels import minmax_to_u8_bgr as _minmax_to_u8_bgr
+except ImportError:
+    _minmax_to_u8_bgr = None
 
 # Video codecs for timelapse creation
 VIDEO_CODECS = {
@@ -41,29 +53,46 @@ def test_codec(codec: str) -> bool:
 def load_metadata(file_path: str) -> Optional[Dict]:
     """Load and return metadata properties from JSON."""
     try:
-        with open(file_path, "r") as f:
-            data = json.load(f)
+        if orjson is not None:
+            with open(file_path, "rb") as f:
+                data = orjson.loads(f.read())
+        else:
+            with open(file_path, "r") as f:
+                data = json.load(f)
         return data.get("properties", {})
     except Exception as e:
         logging.warning(f"Failed to load metadata {file_path}: {e}")
         return None
 
 
+def load_metadata_batch(file_paths: List[str]) -> List[Optional[Dict]]:
+    """load_metadata for many sidecars, read concurrently (open/read latency dominates on HDDs and shares)."""
+    if len(file_paths) < 2:
+        return [load_metadata(p) for p in file_paths]
+    with ThreadPoolExecutor(max_workers=min(32, (os.cpu_count() or 1)*4, len(file_paths))) as ex:
+        return list(ex.map(load_metadata, file_paths))
+
+
+# Quality score weights per metadata key (missing keys count as 0)
+QUALITY_WEIGHTS = {
+    "cloud_percent": -0.2,
+    "heavy_haze_percent": -0.3,
+    "light_haze_percent": -0.1,
+    "shadow_percent": -0.15,
+    "snow_ice_percent": -0.2,
+    "anomalous_pixels": -0.5,
+    "clear_confidence_percent": 0.1,
+    "visible_confidence_percent": 0.05,
+    "view_angle": -0.05
+}
+_QUALITY_KEYS = tuple(QUALITY_WEIGHTS)
+_QUALITY_W = np.array([QUALITY_WEIGHTS[k] for k in _QUALITY_KEYS], dtype=np.float64)
+
+
 def compute_quality_score(metadata: Dict) -> float:
     """Compute quality score based on metadata weights."""
-    weights = {
-        "cloud_percent": -0.2,
-        "heavy_haze_percent": -0.3,
-        "light_haze_percent": -0.1,
-        "shadow_percent": -0.15,
-        "snow_ice_percent": -0.2,
-        "anomalous_pixels": -0.5,
-        "clear_confidence_percent": 0.1,
-        "visible_confidence_percent": 0.05,
-        "view_angle": -0.05
-    }
     score = 100.0
-    for key, w in weights.items():
+    for key, w in QUALITY_WEIGHTS.items():
         score += metadata.get(key, 0) * w
     if metadata.get("quality_category", "standard") != "standard":
         score -= 20.0
@@ -72,30 +101,80 @@ def compute_quality_score(metadata: Dict) -> float:
     return max(0.0, min(100.0, score))
 
 
-def detect_outliers(scores: List[float], threshold: float = 1.5) -> List[bool]:
-    """Mark scores as outliers if deviating beyond threshold*std."""
-    if len(scores) < 2:
-        return [False] * len(scores)
-    avg = mean(scores)
-    std = stdev(scores)
-    return [abs(s - avg) > threshold * std for s in scores]
+def compute_quality_scores_batch(metas: List[Dict]) -> np.ndarray:
+    """compute_quality_score for many metadata dicts at once: one feature matrix, one matrix-vector product."""
+    n = len(metas)
+    feat = np.empty((n, len(_QUALITY_KEYS)), dtype=np.float64)
+    penalty = np.empty(n, dtype=np.float64)
+    for i, md in enumerate(metas):
+        feat[i] = [md.get(k, 0) for k in _QUALITY_KEYS]
+        penalty[i] = (20.0 * (md.get("quality_category", "standard") != "standard")
+                      + 10.0 * (not md.get("ground_control", True)))
+    return np.clip(100.0 + feat @ _QUALITY_W - penalty, 0.0, 100.0)
+
+
+def detect_outliers(scores: Union[List[float], np.ndarray], threshold: float = 1.5) -> np.ndarray:
+    """Boolean mask of scores deviating from the mean by more than threshold * sample std."""
+    a = np.asarray(scores, dtype=np.float64)
+    if a.size < 2:
+        return np.zeros(a.size, dtype=bool)
+    return np.abs(a - a.mean()) > threshold * a.std(ddof=1)
 
 # Image enhancement & alignment
 
-def white_balance(img: np.ndarray) -> np.ndarray:
-    """Gray-world white balance."""
-    b, g, r = cv2.split(img)
-    avg = (np.mean(b) + np.mean(g) + np.mean(r)) / 3
-    return cv2.merge([np.clip(b * (avg / np.mean(b)), 0,255).astype(np.uint8),
-                       np.clip(g * (avg / np.mean(g)), 0,255).astype(np.uint8),
-                       np.clip(r * (avg / np.mean(r)), 0,255).astype(np.uint8)])
+# Per-thread CLAHE instance (apply() keeps internal scratch state, so it can't be shared across threads)
+_CLAHE = threading.local()
+
+
+def _get_clahe():
+    """This thread's CLAHE object (clipLimit 2.0, 8x8 tiles) for enhance_contrast and match_histograms."""
+    clahe = getattr(_CLAHE, "clahe", None)
+    if clahe is None:
+        clahe = _CLAHE.clahe = cv2.createCLAHE(clipLimit=2.0,tileGridSize=(8,8))
+    return clahe
 
+def white_balance(img: np.ndarray, dst: Optional[np.ndarray] = None) -> np.ndarray:
+    """Gray-world white balance. dst may be img to balance in place."""
+    means = cv2.mean(img)[:3]
+    avg = sum(means) / 3
+    # One saturating per-channel multiply on the packed BGR image (no split/merge or float copies)
+    scale = tuple(avg / m if m > 0 else 1.0 for m in means) + (1.0,)
+    return cv2.multiply(img, scale, dst=dst)
 
-def align_frames(img: np.ndarray, ref: np.ndarray,
+
+# Per-thread brute-force Hamming matcher for ORB alignment (built once per thread by _get_matcher)
+_MATCHER = threading.local()
+
+
+def _get_matcher():
+    matcher = getattr(_MATCHER, "bf", None)
+    if matcher is None:
+        matcher = _MATCHER.bf = cv2.BFMatcher(cv2.NORM_HAMMING, crossCheck=True)
+    return matcher
+
+
+class RefFrame(NamedTuple):
+    """Reference frame with everything align_frames needs from it, computed once per timelapse."""
+    bgr: np.ndarray
+    gray: np.ndarray
+    keypoints: tuple            # ORB keypoints of gray
+    descriptors: Optional[np.ndarray]
+
+
+def prepare_reference(ref: np.ndarray) -> RefFrame:
+    """Grayscale and ORB features of the reference frame, shared by every align_frames call."""
+    gray = cv2.cvtColor(ref, cv2.COLOR_BGR2GRAY)
+    kp, des = cv2.ORB_create().detectAndCompute(gray, None)
+    return RefFrame(ref, gray, kp, des)
+
+
+def align_frames(img: np.ndarray, ref: Union[np.ndarray, RefFrame],
                  method: str = "ecc") -> np.ndarray:
-    """Align img to ref via ECC or ORB fallback."""
+    """Align img to ref via ECC or ORB fallback. Pass a RefFrame (prepare_reference) when aligning many frames."""
+    if not isinstance(ref, RefFrame):
+        ref = prepare_reference(ref)
     gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-    ref_gray = cv2.cvtColor(ref, cv2.COLOR_BGR2GRAY)
+    ref_gray = ref.gray
     if gray.shape != ref_gray.shape:
         img = cv2.resize(img, (ref_gray.shape[1], ref_gray.shape[0]))
     if method == "ecc":
@@ -103,18 +182,17 @@ def align_frames(img: np.ndarray, ref: np.ndarray,
             warp_mat = np.eye(2,3, dtype=np.float32)
             criteria = (cv2.TERM_CRITERIA_EPS|cv2.TERM_CRITERIA_COUNT,100,1e-4)
             _, wm = cv2.findTransformECC(ref_gray, gray, warp_mat, cv2.MOTION_EUCLIDEAN, criteria)
-            h,w = ref.shape[:2]
+            h,w = ref_gray.shape
             return cv2.warpAffine(img, wm, (w,h), flags=cv2.INTER_LINEAR+cv2.WARP_INVERSE_MAP)
         except:
             logging.warning("ECC failed, using feature fallback")
     # ORB fallback
-    orb = cv2.ORB_create()
-    kp1, des1 = orb.detectAndCompute(ref_gray, None)
-    kp2, des2 = orb.detectAndCompute(gray, None)
+    kp1, des1 = ref.keypoints, ref.descriptors
+    kp2, des2 = cv2.ORB_create().detectAndCompute(gray, None)
     if des1 is None or des2 is None:
         return img
-    matches = cv2.BFMatcher(cv2.NORM_HAMMING, crossCheck=True).match(des1,des2)
-    matches = sorted(matches, key=lambda x: x.distance)[:50]
+    # Best 50 matches by partial selection rather than sorting every match
+    matches = heapq.nsmallest(50, _get_matcher().match(des1,des2), key=lambda x: x.distance)
     if len(matches)<4:
         return img
     src = np.float32([kp1[m.queryIdx].pt for m in matches]).reshape(-1,1,2)
@@ -122,7 +200,7 @@ def align_frames(img: np.ndarray, ref: np.ndarray,
     M,_ = cv2.findHomography(dst, src, cv2.RANSAC,5.0)
     if M is None:
         return img
-    h,w = ref.shape[:2]
+    h,w = ref_gray.shape
     return cv2.warpPerspective(img, M, (w,h))
 
 
@@ -133,7 +211,7 @@ def match_histograms(img: np.ndarray, ref: np.ndarray) -> np.ndarray:
     lab = cv2.cvtColor(img, cv2.COLOR_BGR2LAB)
     rl, a, b = cv2.split(cv2.cvtColor(ref, cv2.COLOR_BGR2LAB))
     l,_,_ = cv2.split(lab)
-    cl = cv2.createCLAHE(clipLimit=2.0,tileGridSize=(8,8)).apply(l)
+    cl = _get_clahe().apply(l)
     return cv2.cvtColor(cv2.merge([cl,a,b]), cv2.COLOR_LAB2BGR)
 
 
@@ -141,48 +219,90 @@ def enhance_contrast(img: np.ndarray) -> np.ndarray:
     """CLAHE on image lightness."""
     lab = cv2.cvtColor(img, cv2.COLOR_BGR2LAB)
     l,a,b = cv2.split(lab)
-    cl = cv2.createCLAHE(clipLimit=2.0,tileGridSize=(8,8)).apply(l)
+    cl = _get_clahe().apply(l)
     return cv2.cvtColor(cv2.merge([cl,a,b]), cv2.COLOR_LAB2BGR)
 
 
+_OVERLAY_FONT = cv2.FONT_HERSHEY_SIMPLEX
+
+
 def add_metadata_overlay(img: np.ndarray, text: str,
                          pos: str="bottom", size:int=24) -> np.ndarray:
-    """Draw text overlay with background."""
-    pil = Image.fromarray(cv2.cvtColor(img, cv2.COLOR_BGR2RGB))
-    draw = ImageDraw.Draw(pil)
-    try:
-        font = ImageFont.truetype("DejaVuSans.ttf", size)
-    except:
-        font = ImageFont.load_default()
-    w,h = draw.textsize(text, font=font)
-    x=10; y = pil.height-h-10 if pos=="bottom" else 10
-    draw.rectangle([x-5,y-5,x+w+5,y+h+5], fill=(0,0,0,128))
-    draw.text((x,y), text, font=font, fill=(255,255,255))
-    return cv2.cvtColor(np.array(pil), cv2.COLOR_RGB2BGR)
-
-
-def process_frame(args: Tuple[str,int,Dict,Optional[np.ndarray]] ) -> Dict:
-    """Process TIFF => RGB => optional enhancements => overlay."""
+    """Draw text overlay with background, in place on the BGR frame (which is returned)."""
+    thickness = max(1, size//12)
+    scale = cv2.getFontScaleFromHeight(_OVERLAY_FONT, size, thickness)
+    (w,h), baseline = cv2.getTextSize(text, _OVERLAY_FONT, scale, thickness)
+    h += baseline
+    x=10; y = img.shape[0]-h-10 if pos=="bottom" else 10
+    cv2.rectangle(img, (x-5,y-5), (x+w+5,y+h+5), (0,0,0), cv2.FILLED)
+    cv2.putText(img, text, (x,y+h-baseline), _OVERLAY_FONT, scale, (255,255,255), thickness, cv2.LINE_AA)
+    return img
+
+
+# Per-thread free lists of frame-sized scratch buffers keyed by (shape, dtype); see _rent_buffer/_return_buffer
+_BUFS = threading.local()
+
+
+def _buffer_pool() -> Dict:
+    pool = getattr(_BUFS, "pool", None)
+    if pool is None:
+        pool = _BUFS.pool = defaultdict(list)
+    return pool
+
+
+def _rent_buffer(shape: Tuple[int,...], dtype=np.uint8) -> np.ndarray:
+    """An uninitialized array of shape/dtype, reused from this thread's pool when one is free."""
+    free = _buffer_pool()[(tuple(shape), np.dtype(dtype))]
+    return free.pop() if free else np.empty(shape, dtype)
+
+
+def _return_buffer(arr: np.ndarray) -> None:
+    _buffer_pool()[(arr.shape, arr.dtype)].append(arr)
+
+
+def process_frame(args: Tuple[str,int,Dict,Optional[Union[np.ndarray,RefFrame]]] ) -> Dict:
+    """Process TIFF => RGB => optional enhancements => overlay.
+
+    The conversion steps write into pooled scratch buffers (passed as dst=); every rented buffer except the
+    returned frame goes back to the pool afterwards, so the caller owns the frame it gets.
+    """
     path,i,params,ref = args
+    img = None
+    rented = []
+
+    def rent(shape, dtype=np.uint8):
+        buf = _rent_buffer(shape, dtype)
+        rented.append(buf)
+        return buf
+
     try:
         img = cv2.imread(path, cv2.IMREAD_UNCHANGED)
         if img is None:
             return {"status":"error","message":"read failed"}
+        if (_minmax_to_u8_bgr is not None and img.dtype==np.uint16
+                and (img.ndim==2 or img.shape[2] in (1, 3, 4))):
+            # 16-bit frame: stretch, cast and drop alpha/expand gray in one pass instead of the three steps below
+            lo, hi = cv2.minMaxLoc(img.reshape(img.shape[0], -1))[:2]
+            src = img.reshape(img.shape[0], img.shape[1], -1)
+            img = rent(img.shape[:2]+(3,))
+            _minmax_to_u8_bgr(src, lo, 255.0/(hi-lo) if hi>lo else 0.0, img)
         if img.dtype!=np.uint8:
-            img = cv2.normalize(img,None,0,255,cv2.NORM_MINMAX).astype(np.uint8)
+            # Min-max stretch straight into a uint8 buffer (no intermediate in the source dtype)
+            img = cv2.normalize(img,rent(img.shape),0,255,cv2.NORM_MINMAX,dtype=cv2.CV_8U)
         if len(img.shape)==2:
-            img = cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
+            img = cv2.cvtColor(img, cv2.COLOR_GRAY2BGR, dst=rent(img.shape+(3,)))
         if img.shape[2]==4:
-            img = cv2.cvtColor(img, cv2.COLOR_BGRA2BGR)
-        if params.get("white_balance"): img=white_balance(img)
+            img = cv2.cvtColor(img, cv2.COLOR_BGRA2BGR, dst=rent(img.shape[:2]+(3,)))
+        if params.get("white_balance"): img=white_balance(img, dst=img)
         if params.get("stabilize") and ref is not None and i>0:
             img=align_frames(img,ref)
         if params.get("histogram_matching") and ref is not None:
-            img=match_histograms(img,ref)
+            img=match_histograms(img,ref.bgr if isinstance(ref, RefFrame) else ref)
         if params.get("contrast_enhance"): img=enhance_contrast(img)
         out_size = params.get("output_size")
         if out_size and out_size!="original":
-            img = cv2.resize(img, out_size, interpolation=cv2.INTER_LANCZOS4)
+            img = cv2.resize(img, out_size, dst=rent((out_size[1], out_size[0])+img.shape[2:]),
+                             interpolation=cv2.INTER_LANCZOS4)
         if params.get("metadata_overlay"):
             # filename prefix used as date
             date_str = os.path.basename(path).split("_")[0]
@@ -193,10 +313,23 @@ def process_frame(args: Tuple[str,int,Dict,Optional[np.ndarray]] ) -> Dict:
     except Exception as e:
         logging.error(f"Frame proc failed {path}: {e}")
         return {"status":"error","message":str(e)}
+    finally:
+        for buf in rented:
+            if buf is not img:
+                _return_buffer(buf)
+
 
+def _init_frame_worker() -> None:
+    """ThreadPoolExecutor initializer: builds the thread's CLAHE object before its first frame."""
+    _get_clahe()
 
-def create_timelapse(input_dir:str, output_file:str, params:Dict, batch_size:int=100) -> Dict:
-    """Run through filtered files, write to video."""
+
+def create_timelapse(input_dir:str, output_file:str, params:Dict, max_in_flight:Optional[int]=None) -> Dict:
+    """Run through filtered files, write to video.
+
+    Frames are submitted to the pool ahead of the writer, at most max_in_flight (default 2 per worker) at a
+    time, and written in order as the oldest one finishes, so decoding/enhancing and video encoding overlap.
+    """
     os.makedirs(os.path.dirname(output_file),exist_ok=True)
     files = params.get("filtered_files",[])
     if not files:
@@ -215,18 +348,39 @@ def create_timelapse(input_dir:str, output_file:str, params:Dict, batch_size:int
     writer = cv2.VideoWriter(output_file,fourcc,params.get("fps",30),size)
     writer.write(ref_img)
     stats={"processed_frames":1,"errors":0}
-    jobs=[(f,i+1,params,ref_img) for i,f in enumerate(files[1:])]
+    # Worker threads share the reference and params with this thread: nothing is pickled or copied per frame.
+    # Its grayscale and ORB features are computed here once instead of in every align_frames call.
+    ref = prepare_reference(ref_img) if params.get("stabilize") else ref_img
+    jobs=[(f,i+1,params,ref) for i,f in enumerate(files[1:])]
     start=time.time()
-    for i in range(0,len(jobs),batch_size):
-        batch=jobs[i:i+batch_size]
-        with ProcessPoolExecutor(max_workers=params.get("max_workers",os.cpu_count())) as ex:
-            for res in ex.map(process_frame,batch):
-                if res["status"]=="ok":
-                    writer.write(res["frame"])
-                    stats["processed_frames"]+=1
-                else:
-                    stats["errors"]+=1
-    writer.release()
+    workers = params.get("max_workers") or os.cpu_count()
+    max_in_flight = max_in_flight or 2*workers
+
+    def write_result(res: Dict) -> None:
+        if res["status"]=="ok":
+            writer.write(res["frame"])
+            stats["processed_frames"]+=1
+        else:
+            stats["errors"]+=1
+
+    # One thread pool for the whole run: OpenCV releases the GIL in imread, color conversion, CLAHE, ECC/ORB,
+    # warps and resize, so threads run frames in parallel without pickling frames through a process pipe.
+    # The bounded queue of futures keeps every worker busy while the writer drains the oldest frame, and caps
+    # how many finished frames wait in memory.
+    pending = deque()
+    cv_threads = cv2.getNumThreads()
+    cv2.setNumThreads(1) # Frames already run in parallel; don't also split each OpenCV call across cores
+    try:
+        with ThreadPoolExecutor(max_workers=workers, initializer=_init_frame_worker) as ex:
+            for job in jobs:
+                pending.append(ex.submit(process_frame, job))
+                if len(pending) >= max_in_flight:
+                    write_result(pending.popleft().result())
+            while pending:
+                write_result(pending.popleft().result())
+    finally:
+        cv2.setNumThreads(cv_threads)
+        writer.release()
     stats["time"]=time.time()-start
     logging.info(f"Timelapse stats: {stats}")
     return stats
@@ -5,6 +5,11 @@ import json
 import csv
 import argparse
 
+try:
+    import orjson  # Optional: faster feature encoding
+except ImportError:
+    orjson = None
+
 def find_coord_keys(obj):
     """Find the keys for latitude and longitude in a dict (case‐insensitive)."""
     lat_keys = {'lat','latitude'}
@@ -14,7 +19,10 @@ def find_coord_keys(obj):
     return lat, lon
 
 def load_records(path):
-    """Load list of dicts from a JSON array or from a CSV file."""
+    """Load list of dicts from a JSON array or from a CSV file.
+
+    main() streams CSV input through csv_features instead; this keeps CSV support for callers that want records.
+    """
     ext = os.path.splitext(path)[1].lower()
     if ext == '.json':
         with open(path, 'r', encoding='utf-8') as f:
@@ -23,20 +31,26 @@ def load_records(path):
                 raise ValueError("JSON input must be an array of objects")
             return data
     elif ext == '.csv':
-        with open(path, 'r', encoding='utf-8') as f:
-            reader = csv.DictReader(f)
-            return list(reader)
+        with open(path, 'r', encoding='utf-8', newline='') as f:
+            reader = csv.reader(f)
+            header = next(reader, None)
+            if header is None:
+                return []
+            return [dict(zip(header, row)) for row in reader if row] # Blank lines are skipped, as DictReader does
     else:
         raise ValueError(f"Unsupported input format: {ext}")
 
 def to_geojson_features(records):
-    """Convert list of dict-records into GeoJSON Feature dicts."""
-    features = []
+    """Convert dict-records into GeoJSON Feature dicts, yielded one at a time."""
+    lat_key = lon_key = None
     for rec in records:
-        lat_key, lon_key = find_coord_keys(rec)
-        if lat_key is None or lon_key is None:
-            # skip records without both coords
-            continue
+        # Records normally share one schema: reuse the previous record's keys, and only re-detect on the
+        # first record or when a record lacks them (schema drift)
+        if lat_key not in rec or lon_key not in rec:
+            lat_key, lon_key = find_coord_keys(rec)
+            if lat_key is None or lon_key is None:
+                # skip records without both coords
+                continue
         try:
             lat = float(rec[lat_key])
             lon = float(rec[lon_key])
@@ -46,26 +60,59 @@ def to_geojson_features(records):
         # build properties without the coord fields
         props = {k: v for k, v in rec.items()
                  if k not in (lat_key, lon_key) and v != ''}
-        feature = {
-            "type": "Feature",
-            "geometry": {
-                "type": "Point",
-                "coordinates": [lon, lat]
-            },
-            "properties": props
-        }
-        features.append(feature)
-    return features
+        yield point_feature(lon, lat, props)
 
-def write_geojson(features, outpath):
-    """Write a FeatureCollection to a file."""
-    fc = {
-        "type": "FeatureCollection",
-        "features": features
+def csv_features(path):
+    """Yield GeoJSON Features straight from a CSV file: csv.reader rows by column index, no per-row dicts."""
+    with open(path, 'r', encoding='utf-8', newline='') as f:
+        reader = csv.reader(f)
+        header = next(reader, None)
+        if header is None:
+            return
+        lat_key, lon_key = find_coord_keys(header)
+        if lat_key is None or lon_key is None:
+            return
+        lat_i, lon_i = header.index(lat_key), header.index(lon_key)
+        prop_cols = [(i, h) for i, h in enumerate(header) if h not in (lat_key, lon_key)]
+        for row in reader:
+            try:
+                lat = float(row[lat_i])
+                lon = float(row[lon_i])
+            except (ValueError, IndexError):
+                # skip blank/short rows and rows without numeric coords
+                continue
+            props = {h: row[i] for i, h in prop_cols if i < len(row) and row[i] != ''}
+            yield point_feature(lon, lat, props)
+
+def point_feature(lon, lat, props):
+    """GeoJSON Point Feature dict."""
+    return {
+        "type": "Feature",
+        "geometry": {
+            "type": "Point",
+            "coordinates": [lon, lat]
+        },
+        "properties": props
     }
-    with open(outpath, 'w', encoding='utf-8') as f:
-        json.dump(fc, f, ensure_ascii=False, indent=2)
-    print(f"Wrote {len(features)} features to {outpath}")
+
+def encode_feature(feature):
+    """Compact UTF-8 JSON bytes for one feature (orjson when installed)."""
+    if orjson is not None:
+        return orjson.dumps(feature)
+    return json.dumps(feature, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+def write_geojson(features, outpath):
+    """Stream a FeatureCollection to a file, one feature per line, without holding the features in memory."""
+    count = 0
+    with open(outpath, 'wb') as f:
+        f.write(b'{"type":"FeatureCollection","features":[\n')
+        for feature in features:
+            if count:
+                f.write(b',\n')
+            f.write(encode_feature(feature))
+            count += 1
+        f.write(b'\n]}\n')
+    print(f"Wrote {count} features to {outpath}")
 
 def main():
     p = argparse.ArgumentParser(
@@ -75,8 +122,10 @@ def main():
     p.add_argument("output", help="Path to output .geojson file")
     args = p.parse_args()
 
-    recs = load_records(args.input)
-    feats = to_geojson_features(recs)
+    if os.path.splitext(args.input)[1].lower() == '.csv':
+        feats = csv_features(args.input)
+    else:
+        feats = to_geojson_features(load_records(args.input))
     write_geojson(feats, args.output)
 
 if __name__ == "__main__":